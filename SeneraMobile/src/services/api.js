@@ -32,7 +32,7 @@ export const wardrobeAPI = {
 };
 
 export const outfitAPI = {
-  generateCompleteOutfit: (prompt, model = 'dalle') => api.post('/generate-complete-outfit', { prompt, model }),
+  generateCompleteOutfit: (prompt, model = 'dalle', analysisId = null) => api.post('/generate-complete-outfit', { prompt, model, analysis_id: analysisId }),
   analyzePrompt: (prompt) => api.post('/analyze-prompt', { prompt }),
   saveOutfit: (outfitData) => api.post('/save-outfit', outfitData),
   getSavedOutfits: () => api.get('/saved-outfits'),
@@ -1,37 +1,142 @@
+import json
+import click
 from flask import Flask
-from flask_session import Session
-from flask_cors import CORS
 from config import Config
 from db import db
+from db.engine import configure_engine
+from db.migrations import upgrade_database
+from services.logs import configure_logging
+from services.usage import init_usage_tracking, usage_rollup, format_rollup
 
-app = Flask(__name__)
-app.config.from_object(Config)
 
-# Configure CORS to allow your phone to connect
-api_host = app.config['API_HOST']
-CORS(app, origins=['http://localhost:3000', f'http://{api_host}:8081', f'exp://{api_host}:8081'], 
-     supports_credentials=True)
+def create_app(config_object=Config, web=True):
+    """Build the Flask app
 
-# Initialize database with app
-db.init_app(app)
+    web=False only sets up configuration and the database, for scripts such as
+    db/populate_tags.py. Nothing here touches the network, creates tables or
+    imports rembg; see preload_app and the upgrade-db command.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
 
-# Configure session
-Session(app)
+    # Structured logs written from a background thread (LOG_LEVEL, LOG_FORMAT)
+    configure_logging()
 
-# Import and setup your existing routes (don't change the route files!)
-from routes.auth_routes import setup_auth_routes
-from routes.routes import setup_routes
+    # Initialize database with app
+    db.init_app(app)
 
-# Setup routes using your existing functions
-setup_auth_routes(app)
-setup_routes(app)
+    # SQLite pragmas (WAL, busy timeout, caches) or PostgreSQL pool logging
+    configure_engine(app, db)
+
+    # Record external AI calls (tokens, images, latency, cost) in usage_records
+    init_usage_tracking(app)
+
+    # Apply pending schema migrations: flask --app app upgrade-db (or python db/migrations.py)
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Create tables and apply pending schema migrations"""
+        upgrade_database()
+
+    # Per-user and per-day usage: flask --app app usage-report --by user,day --days 30
+    @app.cli.command('usage-report')
+    @click.option('--days', default=7, show_default=True, help='Days back from now')
+    @click.option('--by', 'group_by', default='user,day', show_default=True,
+                  help='Comma-separated groups: user, day, call_type, model, endpoint')
+    @click.option('--user', 'user_id', type=int, help='Only this user id')
+    @click.option('--json', 'as_json', is_flag=True, help='Print JSON instead of a table')
+    def usage_report_command(days, group_by, user_id, as_json):
+        """Roll up calls, tokens, images, latency and cost of external AI calls"""
+        group_by = group_by.split(',')
+        try:
+            rows = usage_rollup(group_by, days=days, user_id=user_id)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--by')
+        click.echo(json.dumps(rows, indent=2) if as_json else format_rollup(rows, group_by))
+
+    if not web:
+        return app
+
+    from flask_cors import CORS
+    from ip_utils import get_api_host
+    from session_store import init_session_store
+    from services.metrics import init_metrics
+    from services.logs import init_request_logging
+    from services.profiling import init_profiling
+    from services.uploads import UploadRequest
+
+    # Resolve the host now rather than when config is imported (auto-detection probes the network)
+    if not app.config.get('API_HOST'):
+        app.config['API_HOST'] = get_api_host()
+
+    # Configure CORS to allow your phone to connect
+    api_host = app.config['API_HOST']
+    CORS(app, origins=['http://localhost:3000', f'http://{api_host}:8081', f'exp://{api_host}:8081'],
+         supports_credentials=True)
+
+    # Spool uploaded files to disk above UPLOAD_SPOOL_BYTES
+    app.request_class = UploadRequest
+
+    # Configure session storage (SESSION_BACKEND)
+    init_session_store(app)
+
+    # Request ids, request lines and spans in the logs
+    init_request_logging(app)
+
+    # Stacks of slow requests when profiling is on (PROFILING, X-Profile, POST /admin/profiling)
+    init_profiling(app)
+
+    # Request timing and database pool metrics for /metrics
+    init_metrics(app)
+
+    # Import and setup your existing routes (don't change the route files!)
+    from routes.auth_routes import setup_auth_routes
+    from routes.routes import setup_routes
+
+    # Setup routes using your existing functions
+    setup_auth_routes(app)
+    setup_routes(app)
+
+    if app.config.get('PRELOAD_APP'):
+        preload_app(app)
+
+    return app
+
+
+def preload_app(app):
+    """Do the slow start-up work now instead of on the first request
+
+    Call before the server starts its request threads (or forks its workers).
+    """
+    from password_hasher import start_password_hasher
+    from services.background_removal import preload_background_removal
+
+    # Start the password hashing workers before any request threads exist
+    start_password_hasher()
+    preload_background_removal()
+
+
+_default_app = None
+
+
+def __getattr__(name):
+    # `from app import app` (asgi.py, WSGI servers, scripts) builds the default app on first
+    # access, so importing create_app alone stays cheap
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Create tables
-with app.app_context():
-    db.create_all()
-    print("Database tables created successfully!")
 
 if __name__ == '__main__':
+    app = create_app()
+
+    # Create tables and apply pending schema migrations
+    with app.app_context():
+        upgrade_database()
+    preload_app(app)
+
     # Use configuration for host and port
     host = app.config['API_HOST']
     port = app.config['API_PORT']
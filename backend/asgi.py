@@ -0,0 +1,14 @@
+"""
+ASGI entry point
+Serves the outfit generation endpoints natively async and everything else
+through the Flask app. Run with an ASGI server, e.g.:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+from app import create_app, preload_app
+from routes.async_routes import create_asgi_app
+
+app = create_app()
+preload_app(app)
+application = create_asgi_app(app)
@@ -0,0 +1,120 @@
+"""
+Benchmark fixtures
+Synthetic garment images and generated wardrobes. Everything is derived from
+a fixed seed, so two runs (before and after a change) work on the same data.
+Wardrobe items share a small pool of tile images on disk; selection never
+reads the files, and a collage only draws a handful of them.
+"""
+
+import os
+import random
+from PIL import Image, ImageDraw
+
+GARMENT_COLORS = [(30, 30, 30), (240, 240, 240), (40, 60, 140), (120, 120, 120), (200, 180, 150), (150, 30, 40)]
+
+# The vocabulary of the tagging prompt in routes.upload_clothing
+TYPES_BY_CATEGORY = {
+    'top': ['shirt', 'blouse', 't-shirt', 'sweater'],
+    'bottom': ['pants', 'jeans', 'skirt', 'shorts'],
+    'footwear': ['shoes', 'boots', 'sandals', 'sneakers'],
+    'outerwear': ['jacket', 'coat', 'blazer'],
+    'accessory': ['scarf', 'belt', 'gloves'],
+    'headwear': ['hat'],
+}
+COLORS = ['red', 'blue', 'black', 'white', 'gray', 'green', 'navy', 'beige', 'brown', 'olive']
+STYLES = ['casual', 'formal', 'sporty', 'business', 'streetwear', 'vintage', 'chic', 'classic', 'minimalistic', 'elegant']
+SEASONS = ['summer', 'winter', 'spring', 'fall', 'all-season']
+OCCASIONS = ['work', 'party', 'outdoor', 'travel', 'casual', 'formal', 'date', 'gym', 'beach', 'wedding']
+
+# A typical analysed prompt ("smart casual office look for fall")
+TARGET_TAGS = {
+    'type_categories': ['top', 'bottom', 'footwear', 'outerwear'],
+    'styles': ['business', 'classic', 'minimalistic'],
+    'colors': ['navy', 'white', 'gray'],
+    'occasions': ['work'],
+    'seasons': ['fall', 'all-season'],
+}
+
+TAGGING_RESPONSE = '''```json
+{"type": "blazer", "type_category": "outerwear", "color": "navy", "style": ["business", "classic", "elegant"],
+ "season": ["fall", "winter", "spring"], "occasion": ["work", "formal", "date"]}
+```'''
+
+
+def garment_image(size=1024, seed=0):
+    """A garment-like shape on a transparent background, as left by background removal"""
+    rng = random.Random(seed)
+    image = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    color = rng.choice(GARMENT_COLORS) + (255,)
+    margin = size // 8
+    draw.rectangle([margin, margin + size // 8, size - margin, size - margin], fill=color)
+    draw.polygon([(margin, margin + size // 8), (size // 2, margin), (size - margin, margin + size // 8)], fill=color)
+    # Some texture, so the image doesn't compress to nothing
+    for _ in range(40):
+        x, y = rng.randrange(margin, size - margin), rng.randrange(margin + size // 8, size - margin)
+        draw.line([x, y, x + rng.randrange(10, 60), y + rng.randrange(-20, 20)], fill=(255, 255, 255, 255), width=2)
+    return image
+
+
+def write_tile_pool(uploads_dir, count=24, size=512):
+    """Save `count` resized-style JPEG tiles; returns their /uploads/ URLs"""
+    os.makedirs(uploads_dir, exist_ok=True)
+    urls = []
+    for index in range(count):
+        filename = f"bench_tile_{index}_resized.jpg"
+        garment_image(size, seed=index).convert('RGB').save(os.path.join(uploads_dir, filename), 'JPEG', quality=85)
+        urls.append(f"/uploads/{filename}")
+    return urls
+
+
+def random_tags(rng):
+    """A tagging result like parse_tags returns for an upload"""
+    type_category = rng.choice(list(TYPES_BY_CATEGORY))
+    return {
+        'type': rng.choice(TYPES_BY_CATEGORY[type_category]),
+        'type_category': type_category,
+        'color': rng.choice(COLORS),
+        'style': rng.sample(STYLES, rng.randint(1, 3)),
+        'season': rng.sample(SEASONS, rng.randint(1, 2)),
+        'occasion': rng.sample(OCCASIONS, rng.randint(1, 3)),
+    }
+
+
+def generate_wardrobe(user_id, item_count, tile_urls, seed=0):
+    """Insert a user with item_count tagged items using multi-row inserts; call inside an app context"""
+    from db import db
+    from db.models import User, Tag, WardrobeItem, WardrobeItemTag
+
+    rng = random.Random(seed)
+    db.session.execute(db.insert(User), [{
+        'id': user_id, 'display_name': f"Bench {user_id}", 'email': f"bench{user_id}@example.com",
+        'password_hash': 'x', 'is_active': True,
+    }])
+
+    vocabulary = [('type', name) for names in TYPES_BY_CATEGORY.values() for name in names]
+    vocabulary += [('color', name) for name in COLORS] + [('style', name) for name in STYLES]
+    vocabulary += [('season', name) for name in SEASONS] + [('occasion', name) for name in OCCASIONS]
+    existing = dict(db.session.execute(db.select(Tag.name, Tag.id)).all())
+    # Tag names are unique across categories (e.g. casual is a style and an occasion)
+    missing = list({name: {'name': name, 'category': category}
+                    for category, name in vocabulary if name not in existing}.values())
+    if missing:
+        db.session.execute(db.insert(Tag), missing)
+        existing = dict(db.session.execute(db.select(Tag.name, Tag.id)).all())
+
+    first_id = (db.session.execute(db.select(db.func.max(WardrobeItem.id))).scalar() or 0) + 1
+    items, links = [], []
+    for offset in range(item_count):
+        tags = random_tags(rng)
+        item_id = first_id + offset
+        items.append({
+            'id': item_id, 'user_id': user_id, 'image_url': rng.choice(tile_urls),
+            'type_category': tags['type_category'],
+        })
+        names = {tags['type'], tags['color'], *tags['style'], *tags['season'], *tags['occasion']}
+        links.extend({'wardrobe_item_id': item_id, 'tag_id': existing[name]} for name in names)
+    if items:
+        db.session.execute(db.insert(WardrobeItem), items)
+        db.session.execute(db.insert(WardrobeItemTag), links)
+    db.session.commit()
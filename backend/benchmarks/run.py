@@ -0,0 +1,294 @@
+"""
+Microbenchmarks for the image, collage, selection and tagging hot paths
+Runs each case against synthetic garment images and generated wardrobes of
+10, 1k and 10k items in a temporary SQLite database, with no network access
+(nothing benchmarked calls an external API, and the API bases point at a
+closed port in case something starts to). Reports ops/sec per case, the
+peak Python allocation of one call and how much the process RSS grew.
+Baselines are saved as JSON, so a change can be measured against them:
+
+    python -m benchmarks.run --save benchmarks/baseline.json
+    # ...change collage_service.py...
+    python -m benchmarks.run --compare benchmarks/baseline.json --filter collage
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from statistics import median
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+DEFAULT_SIZES = '10,1000,10000'
+# Collage cases draw from a fixed wardrobe, whatever --sizes is
+COLLAGE_WARDROBE_SIZE = 1000
+
+
+def prepare_environment(work_dir):
+    """Point the app at a scratch database and uploads folder; call before importing the app"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['USAGE_TRACKING'] = 'false'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.pop('METRICS_DIR', None)
+    # Anything that tries the network fails immediately instead of calling a real API
+    for name in ('OPENAI_API_BASE', 'HUGGINGFACE_API_BASE', 'POLLINATIONS_BASE_URL'):
+        os.environ[name] = 'http://127.0.0.1:9'
+    # Collages and tiles are read from and written to ./uploads
+    os.chdir(work_dir)
+
+
+def rss_kb():
+    """Resident set size of this process (Linux), or None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def measure(func, min_time, min_rounds, max_rounds):
+    """Time repeated calls of func; the first (warm-up) call is not counted"""
+    rss_before = rss_kb()
+    func()
+    gc.collect()
+
+    times = []
+    while True:
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+        if len(times) >= max_rounds or (len(times) >= min_rounds and sum(times) >= min_time):
+            break
+
+    # Allocations of one more call; Pillow's pixel buffers aren't traced, see rss_delta_kb for those
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss_kb()
+
+    return {
+        'rounds': len(times),
+        'ops_per_sec': round(len(times) / sum(times), 2),
+        'mean_ms': round(sum(times) / len(times) * 1000, 3),
+        'median_ms': round(median(times) * 1000, 3),
+        'min_ms': round(min(times) * 1000, 3),
+        'peak_alloc_kb': round(peak / 1024, 1),
+        'rss_delta_kb': rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+    }
+
+
+def build_cases(app, sizes):
+    """[(name, size, setup)] where setup() returns the function to time"""
+    from db import db
+    from benchmarks import fixtures
+    from services.services import resize_image, parse_tags
+    from services.collage_service import (
+        score_item_relevance, select_items_for_collage, rank_wardrobe_items, load_wardrobe,
+        create_collage, save_collage, clear_tile_cache
+    )
+    from routes.routes import save_wardrobe_item
+
+    tile_urls = fixtures.write_tile_pool('uploads')
+    users = {}
+    with app.app_context():
+        for index, size in enumerate(sizes, start=1):
+            fixtures.generate_wardrobe(index, size, tile_urls, seed=size)
+            users[size] = index
+        upload_user = len(sizes) + 1
+        fixtures.generate_wardrobe(upload_user, 0, tile_urls)
+        collage_user = len(sizes) + 2
+        fixtures.generate_wardrobe(collage_user, COLLAGE_WARDROBE_SIZE, tile_urls, seed=COLLAGE_WARDROBE_SIZE)
+
+    def in_app(func):
+        def run():
+            with app.app_context():
+                func()
+                # A fresh session per call, as per request
+                db.session.remove()
+        return run
+
+    def wardrobe_of(user_id):
+        with app.app_context():
+            wardrobe = load_wardrobe(user_id)
+            db.session.expunge_all()
+        return wardrobe
+
+    def resize_case():
+        path = os.path.join('uploads', 'bench_upload.png')
+        fixtures.garment_image(1024, seed=1).save(path)
+        return lambda: resize_image(path)
+
+    def parse_tags_case():
+        return lambda: parse_tags(fixtures.TAGGING_RESPONSE)
+
+    def save_item_case():
+        rng = random.Random(0)
+        return in_app(lambda: save_wardrobe_item(upload_user, tile_urls[0], fixtures.random_tags(rng)))
+
+    def collage_selection():
+        return rank_wardrobe_items(wardrobe_of(collage_user), fixtures.TARGET_TAGS)
+
+    def create_collage_case():
+        selected = collage_selection()
+        return lambda: create_collage(selected)
+
+    def create_collage_cold_case():
+        selected = collage_selection()
+
+        def run():
+            clear_tile_cache()
+            create_collage(selected)
+        return run
+
+    def save_collage_case():
+        image = create_collage(collage_selection())
+        return lambda: save_collage(image, 'bench_collage.png')
+
+    def load_case(size):
+        return in_app(lambda: load_wardrobe(users[size]))
+
+    def select_case(size):
+        return in_app(lambda: select_items_for_collage(fixtures.TARGET_TAGS, users[size]))
+
+    def rank_case(size):
+        wardrobe = wardrobe_of(users[size])
+        return lambda: rank_wardrobe_items(wardrobe, fixtures.TARGET_TAGS)
+
+    def score_case(size):
+        wardrobe = wardrobe_of(users[size])
+        return lambda: [score_item_relevance(item, fixtures.TARGET_TAGS) for item in wardrobe]
+
+    cases = [
+        ('resize_image', None, resize_case),
+        ('parse_tags', None, parse_tags_case),
+        ('save_wardrobe_item', None, save_item_case),
+        ('create_collage', None, create_collage_case),
+        ('create_collage_cold_tiles', None, create_collage_cold_case),
+        ('save_collage', None, save_collage_case),
+    ]
+    for size in sizes:
+        for name, setup in (('load_wardrobe', load_case), ('select_items_for_collage', select_case),
+                            ('rank_wardrobe_items', rank_case), ('score_item_relevance', score_case)):
+            cases.append((name, size, lambda setup=setup, size=size: setup(size)))
+    return cases
+
+
+def case_key(result):
+    return f"{result['case']}[{result['size']}]" if result['size'] is not None else result['case']
+
+
+def print_report(results, baseline=None, threshold=10.0):
+    previous = {case_key(result): result for result in (baseline or {}).get('results', [])}
+    header = f"{'case':<36}{'ops/s':>12}{'mean ms':>11}{'median ms':>11}{'peak KB':>10}{'rss +KB':>10}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+    for result in results:
+        line = (f"{case_key(result):<36}{result['ops_per_sec']:>12.2f}{result['mean_ms']:>11.3f}"
+                f"{result['median_ms']:>11.3f}{result['peak_alloc_kb']:>10.1f}{str(result['rss_delta_kb']):>10}")
+        before = previous.get(case_key(result))
+        if before:
+            change = (result['ops_per_sec'] / before['ops_per_sec'] - 1) * 100
+            marker = ' slower' if change < -threshold else ' faster' if change > threshold else ''
+            line += f"{change:>+9.1f}%{marker}"
+        elif baseline:
+            line += f"{'new':>10}"
+        print(line)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    work_dir = tempfile.mkdtemp(prefix='senera-bench-')
+    prepare_environment(work_dir)
+    try:
+        import PIL
+        import sqlalchemy
+        from app import create_app
+        from db.migrations import upgrade_database
+
+        app = create_app(web=False)
+        with app.app_context():
+            upgrade_database()
+
+        print(f"Generating wardrobes of {', '.join(map(str, sizes))} items in {work_dir}...")
+        results = []
+        for name, size, setup in build_cases(app, sizes):
+            if args.filter and not any(part in name for part in args.filter.split(',')):
+                continue
+            result = {'case': name, 'size': size}
+            result.update(measure(setup(), args.min_time, args.min_rounds, args.max_rounds))
+            results.append(result)
+            print(f"  {case_key(result)}: {result['ops_per_sec']} ops/s")
+
+        report = {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'packages': {'pillow': PIL.__version__, 'sqlalchemy': sqlalchemy.__version__},
+            'settings': {'sizes': sizes, 'min_time': args.min_time, 'min_rounds': args.min_rounds},
+            'results': results,
+        }
+    finally:
+        os.chdir(BACKEND_DIR)
+        if args.keep:
+            print(f"Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for image, collage, selection and tagging code')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='wardrobe sizes, comma-separated')
+    parser.add_argument('--filter', help='only cases whose name contains one of these (comma-separated)')
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds to spend timing each case')
+    parser.add_argument('--min-rounds', type=int, default=5)
+    parser.add_argument('--max-rounds', type=int, default=10000)
+    parser.add_argument('--save', metavar='PATH', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='show the change in ops/s against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent change in ops/s reported as slower/faster')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch database and images')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = run_benchmarks(args)
+    print()
+    print_report(report['results'], baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,35 @@
 import os
 from dotenv import load_dotenv
-from ip_utils import get_api_host
+from db.engine import database_uri, engine_options
 
 load_dotenv()
 
+# Placeholder signing key for development; the cookie session backend refuses to run with it
+DEFAULT_SECRET_KEY = 'dev-secret-key-change-in-production'
+
 class Config:
     UPLOAD_FOLDER = 'uploads'
+    # Larger request bodies are answered with 413 before they are read (see services/uploads.py)
+    MAX_CONTENT_LENGTH = int(os.getenv('UPLOAD_MAX_BYTES', str(16 * 1024 * 1024)))
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-    SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'senera.db')}"
+    # DATABASE_URL selects PostgreSQL (pooled) or another SQLite file; defaults to senera.db
+    SQLALCHEMY_DATABASE_URI = database_uri()
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
-    SESSION_TYPE = 'filesystem'
+    SECRET_KEY = os.getenv('SECRET_KEY', DEFAULT_SECRET_KEY)
+    # Session storage: "sqlite" (server-side, shared by workers), "memory", "filesystem" or "cookie"
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite')
+    SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', os.path.join(os.path.dirname(__file__), 'sessions.db'))
+    SESSION_MEMORY_MAX_ENTRIES = int(os.getenv('SESSION_MEMORY_MAX_ENTRIES', '10000'))
+    SESSION_SWEEP_INTERVAL = int(os.getenv('SESSION_SWEEP_INTERVAL', '300'))
+    SESSION_TYPE = 'filesystem'  # used by the "filesystem" backend (Flask-Session)
     SESSION_PERMANENT = False
     SESSION_USE_SIGNER = True
+    # Import rembg and start the password hashing workers when the app is created
+    PRELOAD_APP = os.getenv('PRELOAD_APP', 'false').lower() == 'true'
     
     # Network Configuration - Auto-detect IP if not set in environment
-    API_HOST = get_api_host()  # This will auto-detect if API_HOST env var is not set
+    API_HOST = os.getenv('API_HOST')  # None: detected by create_app (see ip_utils.get_api_host)
     API_PORT = int(os.getenv('API_PORT', '5000'))
     
     # Image Generation Service Configuration
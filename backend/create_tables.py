@@ -1,7 +1,9 @@
 
-from app import app
-from db import db
+from app import create_app
+from db.migrations import upgrade_database
+
+app = create_app(web=False)
 
 with app.app_context():
-    db.create_all()
+    upgrade_database()
     print("Tables created successfully!")
\ No newline at end of file
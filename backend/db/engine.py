@@ -0,0 +1,89 @@
+"""
+Database engine profiles
+DATABASE_URL selects the database. When it is unset, the local SQLite file
+is used. SQLite connections get WAL journaling, a busy timeout and larger
+caches, so concurrent uploads and deletes wait for the write lock instead of
+failing with "database is locked". PostgreSQL (postgresql://...) gets a
+sized, pre-pinged connection pool for multi-worker deployments.
+"""
+
+import os
+from sqlalchemy import event
+from services.logs import get_logger
+
+logger = get_logger('db')
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'senera.db')
+
+
+def database_uri():
+    uri = os.getenv('DATABASE_URL', f"sqlite:///{DEFAULT_SQLITE_PATH}")
+    # Some hosts still hand out the old postgres:// scheme, which SQLAlchemy no longer accepts,
+    # and newer SQLAlchemy picks psycopg 3 for a bare postgresql://; requirements-prod ships psycopg2
+    for scheme in ('postgres://', 'postgresql://'):
+        if uri.startswith(scheme):
+            uri = 'postgresql+psycopg2://' + uri[len(scheme):]
+    return uri
+
+
+def is_sqlite(uri):
+    return uri.startswith('sqlite')
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for the database profile of a URI"""
+    if is_sqlite(uri):
+        return {
+            # Seconds the driver waits on a locked database (busy_timeout is set too, see below)
+            'connect_args': {'timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')) / 1000},
+        }
+
+    options = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': True,
+    }
+    if uri.startswith('postgresql'):
+        connect_args = {'application_name': os.getenv('DB_APPLICATION_NAME', 'senera')}
+        statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT_MS')
+        if statement_timeout:
+            connect_args['options'] = f"-c statement_timeout={int(statement_timeout)}"
+        options['connect_args'] = connect_args
+    return options
+
+
+def sqlite_pragmas():
+    """PRAGMA statements run on every new SQLite connection"""
+    return [
+        'PRAGMA journal_mode=WAL',
+        f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}",
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))}",
+        # Negative cache_size is in KiB
+        f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))}",
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+
+def configure_engine(app, db):
+    """Attach per-connection setup to the app's engine; call after db.init_app(app)"""
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            options = engine_options(str(engine.url))
+            logger.info("Database: %s with a pool of %d (+%d overflow)",
+                        engine.dialect.name, options['pool_size'], options['max_overflow'])
+            return
+
+        pragmas = sqlite_pragmas()
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+        logger.info("Database: SQLite (WAL)")
@@ -0,0 +1,95 @@
+"""
+Versioned schema migrations
+Each migration runs once per database and is recorded in schema_migrations,
+so existing senera.db files are evolved in place instead of being dropped
+and recreated. Migrations must be safe to run against a database created
+from the current models (fresh databases run them all too).
+
+    python db/migrations.py            # apply pending migrations
+    python db/migrations.py status     # list applied and pending migrations
+"""
+
+import os
+import sys
+
+# Allow running as a script from the backend directory, like db/populate_tags.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import db
+from db.models import User, Tag, WardrobeItem, WardrobeItemTag, SavedOutfit, SchemaMigration, UsageRecord
+
+
+def _create_indexes(conn, model, *names):
+    for index in model.__table__.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+def create_initial_tables(conn):
+    """The tables db.create_all() used to create"""
+    for model in (User, Tag, WardrobeItem, WardrobeItemTag, SavedOutfit):
+        model.__table__.create(conn, checkfirst=True)
+
+
+def add_hot_path_indexes(conn):
+    """Indexes for wardrobe listing/selection, saved outfit listing and tag lookups"""
+    _create_indexes(conn, WardrobeItem, 'ix_wardrobe_items_user_id', 'ix_wardrobe_items_user_id_type_category')
+    _create_indexes(conn, SavedOutfit, 'ix_saved_outfits_user_id_timestamp')
+    _create_indexes(conn, WardrobeItemTag, 'ix_wardrobe_item_tags_tag_id')
+
+
+def create_usage_records(conn):
+    """Per-call token, image, latency and cost records (services/usage.py)"""
+    UsageRecord.__table__.create(conn, checkfirst=True)
+
+
+# (version, name, function) in the order they are applied; never renumber or remove entries
+MIGRATIONS = [
+    (1, 'initial tables', create_initial_tables),
+    (2, 'hot path indexes', add_hot_path_indexes),
+    (3, 'usage records', create_usage_records),
+]
+
+
+def applied_versions(conn):
+    SchemaMigration.__table__.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(db.select(SchemaMigration.version))}
+
+
+def upgrade_database():
+    """Apply every pending migration, each in its own transaction; call inside an app context"""
+    with db.engine.begin() as conn:
+        applied = applied_versions(conn)
+
+    pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+    for version, name, migrate in pending:
+        with db.engine.begin() as conn:
+            migrate(conn)
+            conn.execute(db.insert(SchemaMigration).values(version=version, name=name))
+        print(f"Applied migration {version}: {name}")
+
+    if not pending:
+        print(f"Database schema is up to date (version {MIGRATIONS[-1][0]})")
+    return [version for version, _, _ in pending]
+
+
+def migration_status():
+    """(version, name, applied) for every known migration"""
+    with db.engine.begin() as conn:
+        applied = applied_versions(conn)
+    return [(version, name, version in applied) for version, name, _ in MIGRATIONS]
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app(web=False)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    with app.app_context():
+        if command == 'upgrade':
+            upgrade_database()
+        elif command == 'status':
+            for version, name, applied in migration_status():
+                print(f"{version:>4}  {'applied' if applied else 'pending':<8} {name}")
+        else:
+            sys.exit(f"Unknown command {command!r}, expected upgrade or status")
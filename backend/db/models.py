@@ -1,6 +1,6 @@
 from db import db
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from password_hasher import hash_password, verify_password, needs_rehash
 
 # User model
 class User(db.Model):
@@ -15,12 +15,16 @@ class User(db.Model):
     saved_outfits = db.relationship('SavedOutfit', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        """Hash and set the user's password"""
-        self.password_hash = generate_password_hash(password)
+        """Hash and set the user's password (in the password hashing pool)"""
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
         """Check if provided password matches the hash"""
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """True if the stored hash predates the current PASSWORD_HASH_METHOD"""
+        return needs_rehash(self.password_hash)
     
     def to_dict(self):
         """Convert user to dictionary (exclude password)"""
@@ -41,6 +45,11 @@ class WardrobeItem(db.Model):
     type_category = db.Column(db.String(50), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     tags = db.relationship('Tag', secondary='wardrobe_item_tags', backref='wardrobe_items')
+    # Added to existing databases by migration 2 (db/migrations.py)
+    __table_args__ = (
+        db.Index('ix_wardrobe_items_user_id', 'user_id'),
+        db.Index('ix_wardrobe_items_user_id_type_category', 'user_id', 'type_category'),
+    )
     
     def to_dict(self):
         """Convert wardrobe item to dictionary"""
@@ -64,6 +73,9 @@ class WardrobeItemTag(db.Model):
     __tablename__ = 'wardrobe_item_tags'
     wardrobe_item_id = db.Column(db.Integer, db.ForeignKey('wardrobe_items.id'), primary_key=True)
     tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_wardrobe_item_tags_tag_id', 'tag_id'),
+    )
 
 # SavedOutfit model for storing user's saved outfits
 class SavedOutfit(db.Model):
@@ -74,6 +86,9 @@ class SavedOutfit(db.Model):
     image_url = db.Column(db.String(255), nullable=False)  # Path to the saved collage image
     prompt = db.Column(db.Text, nullable=True)  # Store the original prompt used to generate the outfit
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_saved_outfits_user_id_timestamp', 'user_id', 'timestamp'),
+    )
     
     def to_dict(self):
         """Convert saved outfit to dictionary"""
@@ -89,4 +104,32 @@ class SavedOutfit(db.Model):
             'image_url': image_url,
             'prompt': self.prompt,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
-        }
\ No newline at end of file
+        }
+
+# Schema versions applied by db/migrations.py
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# One external AI call, written in batches by services/usage.py
+class UsageRecord(db.Model):
+    __tablename__ = 'usage_records'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=True)  # None for calls outside a logged-in request
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    call_type = db.Column(db.String(40), nullable=False)  # pipeline stage, e.g. tag_api or vision_call
+    endpoint = db.Column(db.String(40), nullable=False)
+    model = db.Column(db.String(100), nullable=True)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    images = db.Column(db.Integer, nullable=False, default=0)
+    latency_ms = db.Column(db.Integer, nullable=False)
+    outcome = db.Column(db.String(40), nullable=False)  # ok, http_<status> or an exception name
+    cost_usd = db.Column(db.Float, nullable=False, default=0.0)
+    request_id = db.Column(db.String(64), nullable=True)
+    __table_args__ = (
+        db.Index('ix_usage_records_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_usage_records_created_at', 'created_at'),
+    )
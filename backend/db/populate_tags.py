@@ -4,10 +4,12 @@ import os
 # Add the backend directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app
+from app import create_app
 from db import db
 from db.models import Tag
 
+app = create_app(web=False)
+
 def populate_tags():
     tags = [
         # Type
@@ -0,0 +1,95 @@
+"""
+Query plan check for the hot queries
+Runs the wardrobe, collage and saved-outfit queries from routes.py and
+collage_service.py against the configured SQLite database, captures the SQL
+they emit and verifies with EXPLAIN QUERY PLAN that each one is served by
+its index instead of a full table scan. Exits non-zero when one is not.
+
+    python db/query_plans.py
+"""
+
+import os
+import sys
+
+# Allow running as a script from the backend directory, like db/populate_tags.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from db import db
+from db.models import Tag, WardrobeItem, WardrobeItemTag, SavedOutfit
+
+# A user id that owns nothing, so the check never reads real wardrobe data
+CHECK_USER_ID = -1
+
+WARDROBE_USER_INDEXES = ('ix_wardrobe_items_user_id', 'ix_wardrobe_items_user_id_type_category')
+
+
+def hot_queries():
+    """(description, acceptable index names, function that runs the query)"""
+    from services.collage_service import select_items_for_collage, load_wardrobe
+
+    return [
+        ('GET /wardrobe-items', WARDROBE_USER_INDEXES,
+         lambda: WardrobeItem.query.filter_by(user_id=CHECK_USER_ID).all()),
+        ('DELETE /cleanup-unknown', ('ix_wardrobe_items_user_id_type_category',),
+         lambda: WardrobeItem.query.filter_by(user_id=CHECK_USER_ID, type_category='unknown').all()),
+        ('select_items_for_collage', ('ix_wardrobe_items_user_id_type_category',),
+         lambda: select_items_for_collage({'type_categories': ['shirt', 'pants'], 'style': ['casual']}, CHECK_USER_ID)),
+        ('load_wardrobe', ('ix_wardrobe_items_user_id',),
+         lambda: load_wardrobe(CHECK_USER_ID)),
+        ('GET /saved-outfits', ('ix_saved_outfits_user_id_timestamp',),
+         lambda: SavedOutfit.query.filter_by(user_id=CHECK_USER_ID).order_by(SavedOutfit.timestamp.desc()).all()),
+        ('wardrobe items by tag', ('ix_wardrobe_item_tags_tag_id',),
+         lambda: db.session.query(WardrobeItemTag.wardrobe_item_id).filter(
+             WardrobeItemTag.tag_id.in_(db.select(Tag.id).where(Tag.name == 'unknown'))
+         ).all()),
+    ]
+
+
+def capture_statements(run):
+    """The SELECT statements (with parameters) a function executes"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        run()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def explain(statement, parameters):
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    """[(description, ok, plan lines)] for every hot query; call inside an app context"""
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('The query plan check reads SQLite EXPLAIN QUERY PLAN output')
+
+    results = []
+    for description, indexes, run in hot_queries():
+        plan = []
+        for statement, parameters in capture_statements(run):
+            plan.extend(explain(statement, parameters))
+        ok = any(f"INDEX {index}" in line for line in plan for index in indexes)
+        results.append((description, ok, plan))
+    return results
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    with create_app(web=False).app_context():
+        results = check_query_plans()
+    for description, ok, plan in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {description}")
+        for line in plan:
+            print(f"       {line}")
+    sys.exit(0 if all(ok for _, ok, _ in results) else 1)
@@ -1,13 +1,16 @@
-from app import app
+from app import create_app
 from db import db
+from db.migrations import upgrade_database
 from db.models import User, WardrobeItem, Tag, WardrobeItemTag, SavedOutfit
 
+app = create_app(web=False)
+
 def init_database():
     """Initialize the database with tables"""
     with app.app_context():
         # Drop all tables and recreate (for development)
         db.drop_all()
-        db.create_all()
+        upgrade_database()
         
         print("Database initialized successfully!")
         print("Tables created:")
@@ -7,6 +7,9 @@ import socket
 import os
 import subprocess
 import re
+from services.logs import get_logger
+
+logger = get_logger('ip_utils')
 
 def get_current_ip():
     """
@@ -86,7 +89,7 @@ def get_api_host():
     
     # If no environment variable, auto-detect
     detected_ip = get_current_ip()
-    print(f"🔍 Auto-detected IP: {detected_ip}")
+    logger.info("Auto-detected IP: %s", detected_ip)
     return detected_ip
 
 def get_frontend_api_url():
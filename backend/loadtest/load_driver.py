@@ -0,0 +1,270 @@
+"""
+Load driver for the Senera backend
+Simulates users who register, upload a few wardrobe items and then mix
+outfit generations, prompt analyses and wardrobe browsing, and reports
+throughput and p50/p95/p99 latency per endpoint. Run it against a backend
+that talks to loadtest/stub_server.py:
+    python -m loadtest.load_driver --base-url http://127.0.0.1:5000 --users 20 --duration 60
+"""
+
+import io
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import requests
+from PIL import Image, ImageDraw
+
+PROMPTS = [
+    "casual coffee date outfit",
+    "business meeting look",
+    "summer beach day",
+    "cozy winter weekend",
+    "night out with friends",
+    "smart casual office friday",
+    "comfortable travel outfit",
+    "outdoor hiking in fall",
+    "minimalist black and white look",
+    "wedding guest outfit",
+]
+
+DEFAULT_MIX = 'outfit=3,analyze=2,wardrobe=4,upload=1'
+
+GARMENT_COLORS = [(30, 30, 30), (240, 240, 240), (40, 60, 140), (120, 120, 120), (200, 180, 150), (150, 30, 40)]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def garment_image(size=512):
+    """A synthetic garment photo: a coloured shape on a plain background"""
+    image = Image.new('RGB', (size, size), (230, 225, 220))
+    draw = ImageDraw.Draw(image)
+    color = random.choice(GARMENT_COLORS)
+    margin = random.randint(60, 140)
+    draw.rounded_rectangle((margin, margin, size - margin, size - margin // 2), radius=40, fill=color)
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class Results:
+    """Latencies and status codes per endpoint, shared by all virtual users"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}  # endpoint -> [(latency, ok)]
+        self.statuses = {}  # endpoint -> {status: count}
+
+    def record(self, endpoint, latency, status):
+        ok = isinstance(status, int) and status < 400
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append((latency, ok))
+            statuses = self.statuses.setdefault(endpoint, {})
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def summary(self, elapsed):
+        report = {}
+        with self.lock:
+            for endpoint, samples in sorted(self.samples.items()):
+                latencies = [latency for latency, _ in samples]
+                report[endpoint] = {
+                    'requests': len(samples),
+                    'errors': sum(1 for _, ok in samples if not ok),
+                    'throughput': round(len(samples) / elapsed, 3) if elapsed else None,
+                    'p50': round(percentile(latencies, 0.50), 4),
+                    'p95': round(percentile(latencies, 0.95), 4),
+                    'p99': round(percentile(latencies, 0.99), 4),
+                    'max': round(max(latencies), 4),
+                    'status_codes': dict(self.statuses[endpoint]),
+                }
+        return report
+
+
+class VirtualUser:
+    """One simulated app user with its own session cookie"""
+
+    def __init__(self, base_url, run_id, index, args, results):
+        self.base_url = base_url.rstrip('/')
+        self.email = f"loadtest-{run_id}-{index}@example.com"
+        self.args = args
+        self.results = results
+        self.session = requests.Session()
+        self.actions = {
+            'outfit': self.generate_outfit,
+            'outfit_stream': self.generate_outfit_stream,
+            'analyze': self.analyze_prompt,
+            'wardrobe': self.list_wardrobe,
+            'upload': self.upload_item,
+            'saved': self.list_saved_outfits,
+        }
+
+    def call(self, endpoint, method, path, record=True, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=self.args.timeout, **kwargs)
+            status = response.status_code
+        except requests.RequestException as e:
+            response, status = None, type(e).__name__
+        if record:
+            self.results.record(endpoint, time.perf_counter() - started, status)
+        return response
+
+    def register(self):
+        response = self.call('register', 'POST', '/register', record=False, json={
+            'display_name': 'Load Test',
+            'email': self.email,
+            'password': 'loadtest-password',
+            'confirm_password': 'loadtest-password',
+            'not_robot': True,
+        })
+        if response is None or response.status_code != 201:
+            raise RuntimeError(f"Could not register {self.email}: {response.text if response is not None else 'no response'}")
+
+    def upload_item(self, record=True):
+        files = {'image': ('garment.png', garment_image(), 'image/png')}
+        return self.call('upload', 'POST', '/upload-clothing', record=record, files=files)
+
+    def generate_outfit(self):
+        self.call('outfit', 'POST', '/generate-complete-outfit',
+                  json={'prompt': random.choice(PROMPTS), 'model': self.args.model})
+
+    def generate_outfit_stream(self):
+        """Streamed generation; also records the time until the first description token"""
+        started = time.perf_counter()
+        first_token = None
+        status = None
+        try:
+            with self.session.post(f"{self.base_url}/generate-complete-outfit/stream", stream=True,
+                                   timeout=self.args.timeout,
+                                   json={'prompt': random.choice(PROMPTS), 'model': self.args.model}) as response:
+                status = response.status_code
+                for line in response.iter_lines():
+                    line = line.decode('utf-8')
+                    if line == 'event: token' and first_token is None:
+                        first_token = time.perf_counter() - started
+                    elif line == 'event: error':
+                        status = 'error-event'
+        except requests.RequestException as e:
+            status = type(e).__name__
+        self.results.record('outfit_stream', time.perf_counter() - started, status)
+        if first_token is not None:
+            self.results.record('outfit_stream:first_token', first_token, status)
+
+    def analyze_prompt(self):
+        self.call('analyze', 'POST', '/analyze-prompt', json={'prompt': random.choice(PROMPTS)})
+
+    def list_wardrobe(self):
+        self.call('wardrobe', 'GET', '/wardrobe-items')
+
+    def list_saved_outfits(self):
+        self.call('saved', 'GET', '/saved-outfits')
+
+    def run(self, mix, deadline):
+        names, weights = zip(*mix.items())
+        while time.monotonic() < deadline:
+            self.actions[random.choices(names, weights)[0]]()
+            if self.args.think_time:
+                time.sleep(random.expovariate(1.0 / self.args.think_time))
+
+
+def parse_mix(spec):
+    mix = {}
+    for pair in spec.split(','):
+        name, weight = pair.split('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def print_report(report, elapsed):
+    print(f"\n{'endpoint':<28}{'reqs':>7}{'errs':>6}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for endpoint, stats in report['endpoints'].items():
+        print(f"{endpoint:<28}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput']:>8.2f}"
+              f"{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+    print(f"\n{report['total_requests']} requests in {elapsed:.1f}s ({report['throughput']:.2f} req/s)")
+
+
+def run_load(args):
+    mix = parse_mix(args.mix)
+    run_id = uuid.uuid4().hex[:8]
+    results = Results()
+    users = [VirtualUser(args.base_url, run_id, i, args, results) for i in range(args.users)]
+
+    # Setup (not measured): every user registers and seeds a small wardrobe
+    print(f"Registering {args.users} users and uploading {args.seed_items} items each...")
+
+    seed_failures = []
+
+    def seed(user):
+        user.register()
+        for _ in range(args.seed_items):
+            response = user.upload_item(record=False)
+            if response is None or response.status_code >= 400:
+                seed_failures.append(response.text[:200] if response is not None else 'no response')
+
+    threads = [threading.Thread(target=seed, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if seed_failures:
+        print(f"Warning: {len(seed_failures)} seed uploads failed, e.g. {seed_failures[0]}")
+
+    print(f"Running mix {mix} for {args.duration}s...")
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = []
+    for user in users:
+        thread = threading.Thread(target=user.run, args=(mix, deadline))
+        thread.start()
+        threads.append(thread)
+        # Ramp up instead of starting every user in the same millisecond
+        time.sleep(args.ramp_up / max(1, args.users))
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    endpoints = results.summary(elapsed)
+    total = sum(stats['requests'] for name, stats in endpoints.items() if ':' not in name)
+    return {
+        'run_id': run_id,
+        'users': args.users,
+        'duration': round(elapsed, 2),
+        'mix': mix,
+        'total_requests': total,
+        'throughput': round(total / elapsed, 3) if elapsed else None,
+        'endpoints': endpoints,
+    }, elapsed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Replay upload and outfit traffic against the Senera backend')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60, help='measured seconds')
+    parser.add_argument('--ramp-up', type=float, default=5, help='seconds over which users start')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='weights of outfit, outfit_stream, analyze, wardrobe, upload and saved actions')
+    parser.add_argument('--model', default='pollinations', help='image model sent with outfit requests')
+    parser.add_argument('--seed-items', type=int, default=6, help='items each user uploads before measuring')
+    parser.add_argument('--think-time', type=float, default=1.0, help='mean pause between actions (seconds)')
+    parser.add_argument('--timeout', type=float, default=180)
+    parser.add_argument('--json', metavar='PATH', help='also write the report as JSON')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    report, elapsed = run_load(args)
+    print_report(report, elapsed)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
@@ -0,0 +1,319 @@
+"""
+Stub AI services for offline load testing
+Mimics the parts of the OpenAI API (chat completions with text and vision,
+streaming included, and image generations), the Hugging Face inference
+endpoint and Pollinations that the backend uses. Latency, error rate and
+429 bursts are configurable so the app can be measured without API spend.
+
+Run it, then point the backend at it:
+    python -m loadtest.stub_server --port 8900 --speedup 5
+    OPENAI_API_BASE=http://127.0.0.1:8900/v1 HUGGINGFACE_API_BASE=http://127.0.0.1:8900 \
+    POLLINATIONS_BASE_URL=http://127.0.0.1:8900 OPENAI_API_KEY=stub python app.py
+"""
+
+import io
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageDraw
+
+# Latency distributions per route, roughly what the real services answer in
+DEFAULT_LATENCIES = {
+    'chat': 'lognormal:1.2:0.4',
+    'vision': 'lognormal:4:0.5',
+    'images': 'lognormal:12:0.3',
+    'huggingface': 'lognormal:8:0.4',
+    'pollinations': 'lognormal:0.5:0.3',
+}
+
+GARMENTS = [
+    {"type": "t-shirt", "type_category": "top"},
+    {"type": "shirt", "type_category": "top"},
+    {"type": "sweater", "type_category": "top"},
+    {"type": "jeans", "type_category": "bottom"},
+    {"type": "trousers", "type_category": "bottom"},
+    {"type": "skirt", "type_category": "bottom"},
+    {"type": "sneakers", "type_category": "footwear"},
+    {"type": "boots", "type_category": "footwear"},
+    {"type": "jacket", "type_category": "outerwear"},
+    {"type": "cap", "type_category": "headwear"},
+    {"type": "belt", "type_category": "accessory"},
+]
+COLORS = ['black', 'white', 'blue', 'navy', 'gray', 'beige', 'red', 'green']
+STYLES = ['casual', 'classic', 'streetwear', 'minimalistic', 'business', 'sporty']
+SEASONS = ['summer', 'winter', 'spring', 'fall', 'all-season']
+OCCASIONS = ['casual', 'work', 'date', 'outdoor', 'party', 'travel']
+
+DESCRIPTION = (
+    "1. EXACT CLOTHING TYPES: crew neck cotton t-shirt, high-waisted straight-leg jeans, white canvas sneakers. "
+    "2. COLORS & PATTERNS: solid navy blue, faded light blue denim, clean white. "
+    "3. STYLE DETAILS: ribbed collar, rolled cuffs, minimalist low-top design. "
+    "4. FIT & SILHOUETTE: fitted top tucked into relaxed jeans. "
+    "5. WHY THESE WORK TOGETHER: a balanced casual look with a simple, cohesive palette."
+)
+
+
+def parse_distribution(spec):
+    """Sampler for "fixed:S", "uniform:A:B" or "lognormal:MEDIAN:SIGMA" (seconds)"""
+    kind, *params = spec.split(':')
+    params = [float(p) for p in params]
+    if kind == 'fixed':
+        return lambda: params[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(params[0], params[1])
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_route_values(pairs, convert):
+    """["vision=lognormal:3:0.5", ...] -> {"vision": convert("lognormal:3:0.5")}"""
+    values = {}
+    for pair in pairs or []:
+        route, value = pair.split('=', 1)
+        values[route] = convert(value)
+    return values
+
+
+def render_png(label, size=256):
+    image = Image.new('RGB', (size, size), (248, 248, 248))
+    ImageDraw.Draw(image).text((16, size // 2), label, fill=(60, 60, 60))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class StubState:
+    """Configuration and request counters shared by all handler threads"""
+
+    def __init__(self, args):
+        latencies = {**DEFAULT_LATENCIES, **parse_route_values(args.latency, str)}
+        self.latency = {route: parse_distribution(spec) for route, spec in latencies.items()}
+        self.error_rates = parse_route_values(args.error_rate, float)
+        self.speedup = args.speedup
+        self.burst_every = args.burst_every
+        self.burst_length = args.burst_length
+        self.hf_loading_rate = args.hf_loading_rate
+        self.started = time.monotonic()
+        self.png = render_png('stub outfit')
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def delay(self, route):
+        return self.latency[route]() / self.speedup
+
+    def in_burst(self):
+        """True during the periodic windows in which OpenAI routes answer 429"""
+        if not self.burst_every:
+            return False
+        return (time.monotonic() - self.started) % self.burst_every < self.burst_length
+
+    def should_fail(self, route):
+        return random.random() < self.error_rates.get(route, 0.0)
+
+    def count(self, route, status):
+        with self.lock:
+            key = f"{route} {status}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+def chat_reply(payload):
+    """(route, content) for a chat completion request"""
+    messages = payload.get('messages') or []
+    parts = [part for message in messages if isinstance(message.get('content'), list) for part in message['content']]
+    has_image = any(part.get('type') == 'image_url' for part in parts)
+    text = ' '.join(part.get('text', '') for part in parts if part.get('type') == 'text')
+
+    if not has_image:
+        # Prompt analysis
+        return 'chat', json.dumps({
+            "type_categories": ["top", "bottom", "footwear"],
+            "styles": random.sample(STYLES, 2),
+            "colors": random.sample(COLORS, 1),
+            "occasions": random.sample(OCCASIONS, 1),
+            "seasons": [],
+        })
+    if 'assign the following tags' in text:
+        # Wardrobe item tagging
+        return 'vision', json.dumps({
+            **random.choice(GARMENTS),
+            "color": random.choice(COLORS),
+            "style": random.sample(STYLES, 2),
+            "season": random.sample(SEASONS, 1),
+            "occasion": random.sample(OCCASIONS, 2),
+        })
+    # Collage outfit description
+    return 'vision', DESCRIPTION
+
+
+def usage_for(payload, content):
+    prompt_tokens = len(json.dumps(payload.get('messages', []))) // 40 + 85
+    completion_tokens = max(1, len(content) // 4)
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # StubState, set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_png(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(self.state.png)))
+        self.end_headers()
+        self.wfile.write(self.state.png)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            return {}
+
+    def fail_if_configured(self, route, openai=True):
+        """Answer with a 429 burst or an injected 500; True if a failure was sent"""
+        if openai and self.state.in_burst():
+            self.state.count(route, 429)
+            self.send_json(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'requests'}},
+                           {'Retry-After': '1'})
+            return True
+        if self.state.should_fail(route):
+            self.state.count(route, 500)
+            self.send_json(500, {'error': {'message': 'Injected failure (stub)', 'type': 'server_error'}})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path == '/__stats':
+            with self.state.lock:
+                counts = dict(self.state.counts)
+            self.send_json(200, counts)
+        elif self.path.startswith('/prompt/'):
+            time.sleep(self.state.delay('pollinations'))
+            if not self.fail_if_configured('pollinations', openai=False):
+                self.state.count('pollinations', 200)
+                self.send_png()
+        elif self.path.startswith('/images/'):
+            self.send_png()
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        payload = self.read_json()
+        if self.path == '/v1/chat/completions':
+            self.chat_completion(payload)
+        elif self.path == '/v1/images/generations':
+            self.image_generation()
+        elif self.path.startswith('/models/'):
+            self.huggingface_inference()
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def chat_completion(self, payload):
+        route, content = chat_reply(payload)
+        if self.fail_if_configured(route):
+            return
+        latency = self.state.delay(route)
+        usage = usage_for(payload, content)
+
+        if not payload.get('stream'):
+            time.sleep(latency)
+            self.state.count(route, 200)
+            self.send_json(200, {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion',
+                'model': payload.get('model', 'gpt-4o'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+            return
+
+        # Stream: first token after ~30% of the latency, the rest spread over the remainder
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        words = content.split(' ')
+        time.sleep(latency * 0.3)
+        for i, word in enumerate(words):
+            piece = word if i == 0 else ' ' + word
+            chunk = {'choices': [{'index': 0, 'delta': {'content': piece}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(latency * 0.7 / len(words))
+        if (payload.get('stream_options') or {}).get('include_usage'):
+            self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.state.count(route, 200)
+
+    def image_generation(self):
+        if self.fail_if_configured('images'):
+            return
+        time.sleep(self.state.delay('images'))
+        self.state.count('images', 200)
+        host = self.headers.get('Host', '127.0.0.1')
+        self.send_json(200, {'created': int(time.time()), 'data': [{'url': f"http://{host}/images/{random.getrandbits(32):08x}.png"}]})
+
+    def huggingface_inference(self):
+        if random.random() < self.state.hf_loading_rate:
+            self.state.count('huggingface', 503)
+            self.send_json(503, {'error': 'Model is currently loading (stub)', 'estimated_time': 2.0 / self.state.speedup})
+            return
+        if self.fail_if_configured('huggingface', openai=False):
+            return
+        time.sleep(self.state.delay('huggingface'))
+        self.state.count('huggingface', 200)
+        self.send_png()
+
+
+def make_server(args):
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'state': StubState(args)})
+    return ThreadingHTTPServer((args.host, args.port), handler)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Stub OpenAI / Hugging Face / Pollinations server for load tests')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', action='append', metavar='ROUTE=DIST',
+                        help='chat|vision|images|huggingface|pollinations = fixed:S | uniform:A:B | lognormal:MEDIAN:SIGMA')
+    parser.add_argument('--error-rate', action='append', metavar='ROUTE=RATE', help='share of requests answered with 500')
+    parser.add_argument('--speedup', type=float, default=1.0, help='divide every latency by this factor')
+    parser.add_argument('--burst-every', type=float, default=0, help='seconds between 429 bursts on OpenAI routes (0 = none)')
+    parser.add_argument('--burst-length', type=float, default=3, help='seconds each 429 burst lasts')
+    parser.add_argument('--hf-loading-rate', type=float, default=0.0, help='share of Hugging Face calls answered "model loading"')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    server = make_server(args)
+    print(f"Stub AI services listening on http://{args.host}:{args.port}")
+    print(f"  OPENAI_API_BASE=http://{args.host}:{args.port}/v1")
+    print(f"  HUGGINGFACE_API_BASE=http://{args.host}:{args.port}")
+    print(f"  POLLINATIONS_BASE_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
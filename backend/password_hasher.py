@@ -0,0 +1,145 @@
+"""
+Password hashing off the request threads
+Hashes and verifies passwords in a small process pool so CPU-heavy key
+derivation doesn't hold the GIL of the worker serving other requests. The
+pool's backlog is bounded: when it is full, callers get PasswordHasherBusy
+straight away instead of queueing behind a login spike.
+
+PASSWORD_HASH_METHOD is any Werkzeug method string, e.g.
+"pbkdf2:sha256:600000" or "scrypt:32768:8:1". Hashes made with other
+parameters still verify and are upgraded on the next successful login.
+"""
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pending = 0
+_stats = {'hashed': 0, 'verified': 0, 'rejected': 0, 'rehashed': 0}
+_method_prefixes = {}
+
+
+class PasswordHasherBusy(Exception):
+    """The hashing pool is saturated; the request should be retried later"""
+
+
+def hash_method():
+    return os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+
+
+def _workers():
+    return int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+
+
+def _max_pending():
+    # Calls running plus calls waiting for a worker
+    return int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(max(1, _workers()) * 4)))
+
+
+def _timeout():
+    return float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+
+
+def _mp_context():
+    """forkserver on POSIX, spawn elsewhere (Windows)
+
+    Forking the server process itself would copy whatever locks its other
+    threads (logging, database pools, HTTP clients) happen to hold. Workers are
+    forked from a clean single-threaded server process instead, with Werkzeug's
+    hashing already imported so they still start quickly.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['werkzeug.security'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _get_pool():
+    """The process pool of this process, recreated after a fork"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ProcessPoolExecutor(max_workers=_workers(), mp_context=_mp_context())
+            _pool_pid = pid
+        return _pool
+
+
+def start_password_hasher():
+    """Start the worker processes now, before the server starts its request threads"""
+    if _workers() > 0:
+        _get_pool().submit(len, '').result()
+
+
+def _run(func, *args):
+    """Run func in the pool, or inline when PASSWORD_HASH_WORKERS=0"""
+    global _pending
+    if _workers() <= 0:
+        return func(*args)
+
+    with _pool_lock:
+        if _pending >= _max_pending():
+            _stats['rejected'] += 1
+            raise PasswordHasherBusy('Too many logins in progress, please try again in a moment')
+        _pending += 1
+
+    def release(_):
+        global _pending
+        with _pool_lock:
+            _pending -= 1
+
+    try:
+        future = _get_pool().submit(func, *args)
+    except BaseException:
+        release(None)
+        raise
+    future.add_done_callback(release)
+    try:
+        return future.result(timeout=_timeout())
+    except FutureTimeoutError:
+        raise PasswordHasherBusy('Password hashing timed out, please try again in a moment')
+
+
+def hash_password(password):
+    """Hash a password with the configured method"""
+    pwhash = _run(generate_password_hash, password, hash_method())
+    _stats['hashed'] += 1
+    return pwhash
+
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash of any supported method"""
+    result = _run(check_password_hash, pwhash, password)
+    _stats['verified'] += 1
+    return result
+
+
+def _method_prefix(method):
+    """The prefix Werkzeug writes for method, with its defaults filled in
+
+    "pbkdf2" is stored as "pbkdf2:sha256:600000", so the configured string can't
+    be compared as is. Hashes a dummy password once per method string.
+    """
+    if method not in _method_prefixes:
+        _method_prefixes[method] = _run(generate_password_hash, '', method).split('$', 1)[0]
+    return _method_prefixes[method]
+
+
+def needs_rehash(pwhash):
+    """True if a hash was made with a different method or cost than configured"""
+    return pwhash.split('$', 1)[0] != _method_prefix(hash_method())
+
+
+def record_rehash():
+    _stats['rehashed'] += 1
+
+
+def get_password_hasher_stats():
+    with _pool_lock:
+        return {**_stats, 'pending': _pending, 'workers': _workers(), 'method': hash_method().split(':')[0]}
@@ -0,0 +1,248 @@
+import asyncio
+from asgiref.wsgi import WsgiToAsgi
+from flask import jsonify
+from services.collage_service import (
+    select_items_for_collage, create_collage, save_collage, make_collage_filename, describe_selected_items,
+    warm_up_wardrobe
+)
+from services.prompt_cache import resolve_analysis_handle
+from services.async_outfit_service import (
+    run_blocking, analyze_prompt_for_tags_async, generate_outfit_from_collage_async
+)
+from services.http_client import close_async_client
+from services.logs import get_logger, start_request, finish_request, log_payload
+from services.profiling import start_profile, finish_profile
+from services.uploads import too_large_message
+from .auth_routes import require_login, get_current_user_id
+
+logger = get_logger('async_routes')
+
+
+class AsyncOutfitApp:
+    """ASGI application serving the outfit generation endpoints natively async
+
+    Every other route is handed to the Flask app through asgiref's WSGI
+    adapter. Authentication, database access and collage rendering run in the
+    blocking thread pool inside a Flask request context, so the same session
+    handling, CORS headers and models apply as on the WSGI path.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self.routes = {
+            ('POST', '/generate-complete-outfit'): self.generate_complete_outfit,
+            ('POST', '/generate-collage'): self.generate_collage,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        handler = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            await self.wsgi_app(scope, receive, send)
+            return
+
+        body = await self.read_body(receive, self.flask_app.config['MAX_CONTENT_LENGTH'])
+        environ = self.request_environ(scope, body or b'')
+        # The request line is logged by Flask's after_request hook when the response is finalized
+        headers = dict(environ['headers'])
+        start_request(headers.get('x-request-id'))
+        # The event loop thread serves every request, so only the thread pool work is sampled
+        start_profile(scope['method'], scope['path'], headers.get('x-profile'), attach=False)
+        try:
+            try:
+                if body is None:
+                    status, payload = 413, {'error': too_large_message(self.flask_app.config['MAX_CONTENT_LENGTH'])}
+                else:
+                    status, payload = await handler(environ)
+            except Exception as e:
+                logger.exception("Error in async %s: %s", scope['path'], e)
+                status, payload = 500, {'error': str(e)}
+            await self.send_response(send, environ, status, payload)
+        finally:
+            finish_profile()
+            finish_request()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_async_client()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def read_body(receive, limit=None):
+        """The request body, or None as soon as it grows past limit bytes"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit is not None and size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    @staticmethod
+    def request_environ(scope, body):
+        """Arguments for flask_app.test_request_context() rebuilding this request"""
+        headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+        return {
+            'path': scope['path'],
+            'method': scope['method'],
+            'query_string': scope.get('query_string', b'').decode('latin-1'),
+            'headers': headers,
+            'data': body,
+        }
+
+    async def send_response(self, send, environ, status, payload):
+        """Finalize the response through Flask so after_request hooks (CORS, session) still apply"""
+        status, headers, body = await run_blocking(self.finalize_response, environ, status, payload)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def finalize_response(self, environ, status, payload):
+        with self.flask_app.test_request_context(**environ):
+            response = self.flask_app.make_response((jsonify(payload), status))
+            response = self.flask_app.process_response(response)
+            return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+    def authenticate(self, environ):
+        """Check the session and parse the JSON body
+
+        Returns (error, user_id, data, handle_tags) where error is a
+        (status, payload) tuple or None.
+        """
+        with self.flask_app.test_request_context(**environ) as ctx:
+            auth_error = require_login()
+            if auth_error:
+                response, status = auth_error
+                return (status, response.get_json()), None, None, None
+
+            data = ctx.request.get_json(silent=True) or {}
+            user_prompt = data.get('prompt', '')
+            if not user_prompt:
+                return (400, {'error': 'No prompt provided'}), None, None, None
+
+            handle_tags = resolve_analysis_handle(data.get('analysis_id'), user_prompt)
+            return None, get_current_user_id(), data, handle_tags
+
+    def warm_up(self, user_id, user_prompt):
+        with self.flask_app.app_context():
+            return warm_up_wardrobe(user_id, user_prompt)
+
+    def build_collage(self, target_tags, user_id):
+        """Select items, render and save the collage (blocking, runs in the thread pool)"""
+        with self.flask_app.app_context():
+            selected_items = select_items_for_collage(target_tags, user_id)
+            logger.debug("Selected items: %s", [(k, len(v)) for k, v in selected_items.items()])
+            item_count = sum(len(items) for items in selected_items.values())
+            if item_count == 0:
+                return None
+
+            collage_image = create_collage(selected_items)
+            collage_filename = make_collage_filename()
+            collage_path = save_collage(collage_image, collage_filename)
+            return {
+                'collage_filename': collage_filename,
+                'collage_path': collage_path,
+                'items_details': describe_selected_items(selected_items),
+                'item_count': item_count,
+            }
+
+    async def generate_complete_outfit(self, environ):
+        """Async /generate-complete-outfit"""
+        error, user_id, data, target_tags = await run_blocking(self.authenticate, environ)
+        if error:
+            return error
+
+        user_prompt = data['prompt']
+        image_model = data.get('model', 'dalle')
+        logger.info("Generating complete outfit using model: %s", image_model)
+        log_payload(logger, 'Outfit prompt', user_prompt)
+
+        if target_tags is None:
+            # Decode likely tiles in the thread pool while GPT-4o analyses the prompt, if it has to
+            warmups = []
+
+            def start_warmup():
+                warmups.append(asyncio.ensure_future(run_blocking(self.warm_up, user_id, user_prompt)))
+
+            try:
+                target_tags = await analyze_prompt_for_tags_async(user_prompt, on_llm_call=start_warmup)
+            except BaseException:
+                for warmup in warmups:
+                    warmup.cancel()
+                raise
+
+            for warmup in warmups:
+                try:
+                    await warmup
+                except Exception as e:
+                    logger.warning("Wardrobe warm-up did not finish: %s", e)
+        logger.debug("Target tags: %s", target_tags)
+
+        collage = await run_blocking(self.build_collage, target_tags, user_id)
+        if collage is None:
+            return 404, {'error': 'No matching items found in your wardrobe for this prompt'}
+
+        logger.debug("Generating outfit image with %s", image_model)
+        outfit_image_url = await generate_outfit_from_collage_async(collage['collage_path'], user_prompt, image_model)
+        log_payload(logger, 'Outfit generated', outfit_image_url)
+
+        return 200, {
+            'collage_url': f"/uploads/{collage['collage_filename']}",
+            'outfit_image_url': outfit_image_url,
+            'target_tags': target_tags,
+            'selected_items': collage['items_details'],
+            'message': f"Complete outfit generated with {collage['item_count']} items"
+        }
+
+    async def generate_collage(self, environ):
+        """Async /generate-collage (legacy route)"""
+        error, user_id, data, target_tags = await run_blocking(self.authenticate, environ)
+        if error:
+            return error
+
+        user_prompt = data['prompt']
+        logger.info("Generating collage")
+        log_payload(logger, 'Collage prompt', user_prompt)
+
+        if target_tags is None:
+            target_tags = await analyze_prompt_for_tags_async(user_prompt)
+        logger.debug("Target tags: %s", target_tags)
+
+        collage = await run_blocking(self.build_collage, target_tags, user_id)
+        if collage is None:
+            # The WSGI route renders a "No matching items found" collage in this case
+            collage = await run_blocking(self.build_empty_collage)
+
+        return 200, {
+            'collage_url': f"/uploads/{collage['collage_filename']}",
+            'target_tags': target_tags,
+            'selected_items': collage['items_details'],
+            'message': f"Collage generated with {collage['item_count']} items"
+        }
+
+    @staticmethod
+    def build_empty_collage():
+        collage_filename = make_collage_filename()
+        save_collage(create_collage({}), collage_filename)
+        return {'collage_filename': collage_filename, 'items_details': {}, 'item_count': 0}
+
+
+def create_asgi_app(flask_app):
+    """Wrap the Flask app in an ASGI app with async outfit generation"""
+    return AsyncOutfitApp(flask_app)
@@ -1,6 +1,19 @@
-from flask import request, jsonify, session, send_from_directory
+from flask import request, jsonify, session, send_from_directory, g
 from db.models import User, db
+from password_hasher import PasswordHasherBusy, record_rehash
+from services.logs import set_request_user
+from collections import namedtuple
+import os
 import re
+import time
+import threading
+
+# What require_login needs to know about a user, cached across requests
+CachedUser = namedtuple('CachedUser', ['id', 'email', 'display_name', 'is_active'])
+
+_user_cache = {}  # user_id -> (CachedUser or None, expires_at)
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {'hits': 0, 'misses': 0}
 
 def setup_auth_routes(app):
     
@@ -70,6 +83,9 @@ def setup_auth_routes(app):
                 'user': new_user.to_dict()
             }), 201
             
+        except PasswordHasherBusy as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': f'Registration failed: {str(e)}'}), 500
@@ -94,6 +110,12 @@ def setup_auth_routes(app):
             if not user.is_active:
                 return jsonify({'error': 'Account is deactivated'}), 401
             
+            # Upgrade hashes made with an older method or cost while we have the password
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
+                record_rehash()
+            
             # Log in the user
             session['user_id'] = user.id
             session['user_email'] = user.email
@@ -104,11 +126,15 @@ def setup_auth_routes(app):
                 'user': user.to_dict()
             }), 200
             
+        except PasswordHasherBusy as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
         except Exception as e:
             return jsonify({'error': f'Login failed: {str(e)}'}), 500
     
     @app.route('/logout', methods=['POST'])
     def logout():
+        invalidate_cached_user(session.get('user_id'))
         session.clear()
         return jsonify({'message': 'Logged out successfully'}), 200
     
@@ -124,16 +150,53 @@ def setup_auth_routes(app):
         
         return jsonify({'user': user.to_dict()}), 200
 
+def _user_cache_ttl():
+    return float(os.getenv('AUTH_USER_CACHE_TTL', '30'))
+
+def get_cached_user(user_id):
+    """The user as of at most AUTH_USER_CACHE_TTL seconds ago; None if it doesn't exist"""
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry and entry[1] > now:
+            _user_cache_stats['hits'] += 1
+            return entry[0]
+        _user_cache_stats['misses'] += 1
+    
+    user = User.query.get(user_id)
+    cached = CachedUser(user.id, user.email, user.display_name, user.is_active) if user else None
+    with _user_cache_lock:
+        _user_cache[user_id] = (cached, now + _user_cache_ttl())
+        # Drop expired entries now and then so the cache stays bounded by active users
+        if len(_user_cache) > 10000:
+            for key in [k for k, (_, expires) in _user_cache.items() if expires <= now]:
+                del _user_cache[key]
+    return cached
+
+def invalidate_cached_user(user_id):
+    """Forget a cached user, e.g. after it was changed or deactivated"""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+def get_user_cache_stats():
+    with _user_cache_lock:
+        return {**_user_cache_stats, 'size': len(_user_cache)}
+
 def require_login():
     """Helper function to check if user is logged in"""
     if 'user_id' not in session:
         return jsonify({'error': 'Authentication required. Please log in.'}), 401
     
-    user = User.query.get(session['user_id'])
+    # Checked once per request, then at most every AUTH_USER_CACHE_TTL seconds per user
+    if getattr(g, 'current_user', None) is None or g.current_user.id != session['user_id']:
+        g.current_user = get_cached_user(session['user_id'])
+    user = g.current_user
     if not user or not user.is_active:
+        g.current_user = None
         session.clear()
         return jsonify({'error': 'Invalid session. Please log in again.'}), 401
     
+    set_request_user(user.id)
     return None  # No error, user is authenticated
 
 def get_current_user_id():
@@ -1,18 +1,110 @@
 from flask import request, jsonify, session, send_from_directory
 from db.models import User, db
 import re
-from flask import send_from_directory, request, jsonify
-from services.services import resize_image, tag_image, parse_tags
+from flask import send_from_directory, request, jsonify, Response, stream_with_context
+from services.services import resize_image, tag_image_file
 from db.models import WardrobeItem, Tag, WardrobeItemTag, SavedOutfit, db
 import os
-from rembg import remove
 from PIL import Image
-import base64
-import io
+from werkzeug.exceptions import RequestEntityTooLarge
+import uuid
+import json
+import hmac
 from datetime import datetime
-from services.collage_service import analyze_prompt_for_tags, select_items_for_collage, create_collage, save_collage, generate_outfit_from_collage
+from services.collage_service import analyze_prompt_for_tags, select_items_for_collage, create_collage, save_collage, generate_outfit_from_collage, make_collage_filename, describe_selected_items, WardrobeWarmup, stream_outfit_description, generate_outfit_image
+from services.prompt_analyzer import get_analyzer_report
+from services.prompt_cache import create_analysis_handle, Uncacheable
+from services.http_client import get_http_metrics
+from services.outfit_planner import plan_outfits, max_plan_prompts
+from services.rate_limiter import request_priority, get_rate_limiter_stats, BACKGROUND
+from services.vision_payload import get_vision_report
+from services.provider_router import get_provider_health
+from services.file_deleter import schedule_file_removal
+from services.background_removal import remove_background
+from services.uploads import open_upload_image, UploadRejected, too_large_message
+from services.tag_catalog import tag_id_for
+from services.metrics import stage_timer, render_metrics
+from services.logs import get_logger, log_payload
+from services.usage import usage_rollup, flush_usage
+from services.profiling import (
+    admin_token_matches, profiling_settings, update_profiling_settings, get_profiling_stats,
+    list_profiles, load_profile, folded_stacks
+)
 from .auth_routes import require_login, get_current_user_id
 
+logger = get_logger('routes')
+
+def bearer_token_matches(token):
+    """Whether the request carries `Authorization: Bearer <token>`, compared in constant time"""
+    authorization = request.headers.get('Authorization', '')
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+def format_sse(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def delete_wardrobe_rows(user_id, *criteria):
+    """Delete a user's wardrobe items matching criteria, and their tag links, in two statements
+
+    Returns the image URLs of the deleted items; the caller commits.
+    """
+    matching = db.and_(WardrobeItem.user_id == user_id, *criteria)
+    db.session.execute(
+        db.delete(WardrobeItemTag)
+        .where(WardrobeItemTag.wardrobe_item_id.in_(db.select(WardrobeItem.id).where(matching)))
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(
+        db.delete(WardrobeItem)
+        .where(matching)
+        .returning(WardrobeItem.image_url)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+def save_wardrobe_item(user_id, image_url, tags):
+    """Store an uploaded item with its tags (parsed tagging response) and commit
+
+    Tag ids come from the tag catalog; tags that don't exist yet are created.
+    """
+    wardrobe_item = WardrobeItem(
+        user_id=user_id,
+        image_url=image_url,
+        type_category=tags.get('type_category', 'unknown'),
+        timestamp=datetime.utcnow()
+    )
+    db.session.add(wardrobe_item)
+    db.session.commit()
+
+    # Add tags to the many-to-many relationship
+    all_tags = []
+    
+    # Add type and color as single tags
+    if tags.get('type'):
+        all_tags.append(('type', tags['type']))
+    if tags.get('color'):
+        all_tags.append(('color', tags['color']))
+    
+    # Add style, season, and occasion as lists
+    for style_tag in tags.get('style', []):
+        all_tags.append(('style', style_tag))
+    for season_tag in tags.get('season', []):
+        all_tags.append(('season', season_tag))
+    for occasion_tag in tags.get('occasion', []):
+        all_tags.append(('occasion', occasion_tag))
+    
+    tag_ids = []
+    for category, tag_name in all_tags:
+        tag_id = tag_id_for(tag_name, category)
+        # Add to wardrobe item if not already added
+        if tag_id not in tag_ids:
+            tag_ids.append(tag_id)
+    
+    db.session.add_all(
+        WardrobeItemTag(wardrobe_item_id=wardrobe_item.id, tag_id=tag_id) for tag_id in tag_ids
+    )
+    db.session.commit()
+    return wardrobe_item
+
 def setup_routes(app):
     @app.route('/')
     def serve_index():
@@ -41,43 +133,37 @@ def setup_routes(app):
             if file.filename == '':
                 return jsonify({'error': 'No file selected'}), 400
 
-            # Save the uploaded image temporarily
-            filename = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.png"
-            temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(temp_path)
-            print(f"Image saved temporarily at {temp_path}")
+            # Check the image's dimensions from its header, then decode it no larger than needed
+            try:
+                with stage_timer('decoding'):
+                    image = open_upload_image(file.stream)
+            except UploadRejected as e:
+                return jsonify({'error': str(e)}), e.status
+            # Unique per upload, so uploads in the same second don't overwrite each other's files
+            filename = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.png"
 
             # Remove background using rembg
-            with open(temp_path, 'rb') as input_file:
-                input_image = input_file.read()
-            output_image = remove(input_image)
-            print("Background removed successfully")
+            img_with_transparency = remove_background(image).convert('RGBA')
+            logger.debug("Background removed")
 
-            # Convert to PIL Image and apply light background
-            # Load the image with transparent background
-            img_with_transparency = Image.open(io.BytesIO(output_image)).convert('RGBA')
-            
-            # Create a light grey background
-            background = Image.new('RGB', img_with_transparency.size, (248, 248, 248))  # Light grey
-            
-            # Composite the transparent image onto the background
-            final_image = Image.alpha_composite(
-                background.convert('RGBA'), 
-                img_with_transparency
-            ).convert('RGB')
+            with stage_timer('compositing'):
+                # Create a light grey background
+                background = Image.new('RGB', img_with_transparency.size, (248, 248, 248))  # Light grey
+                
+                # Composite the transparent image onto the background
+                final_image = Image.alpha_composite(
+                    background.convert('RGBA'), 
+                    img_with_transparency
+                ).convert('RGB')
 
-            # Save the cleaned-up image with light background
-            cleaned_path = os.path.join(app.config['UPLOAD_FOLDER'], f"cleaned_{filename}")
-            final_image.save(cleaned_path, 'PNG')
-            print(f"Cleaned image with light background saved at {cleaned_path}")
+                # Save the cleaned-up image with light background
+                cleaned_path = os.path.join(app.config['UPLOAD_FOLDER'], f"cleaned_{filename}")
+                final_image.save(cleaned_path, 'PNG')
+            logger.debug("Cleaned image with light background saved at %s", cleaned_path)
 
             # Resize and standardize the image
             resized_path = resize_image(cleaned_path)
-            print(f"Image resized and saved at {resized_path}")
-
-            # Send the image to GPT-4o for tagging
-            with open(resized_path, 'rb') as img_file:
-                img_data = base64.b64encode(img_file.read()).decode('utf-8')
+            logger.debug("Image resized and saved at %s", resized_path)
 
             # Predefined prompt for tagging
             prompt = """Tag the clothing item in this image using the following values and return them as
@@ -93,60 +179,27 @@ def setup_routes(app):
                             {"type": "", "type_category": "", "color": "", "style": [], "season": [], "occasion":
                               []}."""
 
-            tags_response = tag_image(img_data, prompt)
-            print("Tags received from GPT-4o:", tags_response)
-
-            # Parse the tags
-            tags = parse_tags(tags_response)
+            # Send the image to GPT-4o for tagging, re-encoded by the vision payload optimizer.
+            # Tagging queues behind outfit generation when the OpenAI budget is tight.
+            with request_priority(BACKGROUND):
+                tags = tag_image_file(resized_path, prompt)
 
             # Save the item and tags to the database with current user ID
-            current_user_id = get_current_user_id()
-            wardrobe_item = WardrobeItem(
-                user_id=current_user_id,  # Use actual logged-in user ID
-                image_url=f"/uploads/{os.path.basename(resized_path)}",
-                type_category=tags.get('type_category', 'unknown'),
-                timestamp=datetime.utcnow()
-            )
-            db.session.add(wardrobe_item)
-            db.session.commit()
-
-            # Add tags to the many-to-many relationship
-            all_tags = []
-            
-            # Add type and color as single tags
-            if tags.get('type'):
-                all_tags.append(('type', tags['type']))
-            if tags.get('color'):
-                all_tags.append(('color', tags['color']))
-            
-            # Add style, season, and occasion as lists
-            for style_tag in tags.get('style', []):
-                all_tags.append(('style', style_tag))
-            for season_tag in tags.get('season', []):
-                all_tags.append(('season', season_tag))
-            for occasion_tag in tags.get('occasion', []):
-                all_tags.append(('occasion', occasion_tag))
-            
-            # Save all tags
-            for category, tag_name in all_tags:
-                tag = Tag.query.filter_by(name=tag_name).first()
-                if not tag:
-                    # Create the tag if it doesn't exist
-                    tag = Tag(name=tag_name, category=category)
-                    db.session.add(tag)
-                    db.session.commit()
-                
-                # Add to wardrobe item if not already added
-                if tag not in wardrobe_item.tags:
-                    wardrobe_item.tags.append(tag)
-            
-            db.session.commit()
+            with stage_timer('db_write'):
+                save_wardrobe_item(get_current_user_id(), f"/uploads/{os.path.basename(resized_path)}", tags)
 
             return jsonify({'message': 'Clothing item uploaded successfully!'}), 200
 
+        except RequestEntityTooLarge:
+            # Answered by the 413 handler below
+            raise
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    @app.errorhandler(RequestEntityTooLarge)
+    def request_too_large(e):
+        return jsonify({'error': too_large_message(app.config['MAX_CONTENT_LENGTH'])}), 413
+
     @app.route('/wardrobe-items', methods=['GET'])
     def get_wardrobe_items():
         # Check authentication
@@ -187,41 +240,17 @@ def setup_routes(app):
         try:
             current_user_id = get_current_user_id()
             
-            # Find items with unknown type_category for current user
-            unknown_items = WardrobeItem.query.filter_by(
-                user_id=current_user_id, 
-                type_category='unknown'
-            ).all()
-            
-            # Also find items that only have 'unknown' tags for current user
-            all_items = WardrobeItem.query.filter_by(user_id=current_user_id).all()
-            items_to_delete = []
-            
-            for item in all_items:
-                # Check if item has unknown type_category
-                if item.type_category == 'unknown':
-                    items_to_delete.append(item)
-                    continue
-                    
-                # Check if item only has unknown tags
-                if item.tags:
-                    all_unknown = all(tag.name == 'unknown' for tag in item.tags)
-                    if all_unknown:
-                        items_to_delete.append(item)
-                else:
-                    # Item has no tags at all, consider it unknown
-                    items_to_delete.append(item)
-            
-            # Remove duplicates
-            items_to_delete = list(set(items_to_delete))
-            
-            deleted_count = len(items_to_delete)
-            
-            # Delete the items
-            for item in items_to_delete:
-                # Clear the many-to-many relationships first
-                item.tags.clear()
-                db.session.delete(item)
+            # Unknown type_category, or no tag other than 'unknown' (which includes no tags at all)
+            has_known_tag = db.exists().where(
+                WardrobeItemTag.wardrobe_item_id == WardrobeItem.id,
+                WardrobeItemTag.tag_id == Tag.id,
+                Tag.name != 'unknown'
+            )
+            deleted_urls = delete_wardrobe_rows(
+                current_user_id,
+                db.or_(WardrobeItem.type_category == 'unknown', ~has_known_tag)
+            )
+            deleted_count = len(deleted_urls)
             
             db.session.commit()
             
@@ -254,12 +283,164 @@ def setup_routes(app):
             
             return jsonify({
                 'suggested_tags': suggested_tags,
-                'prompt': user_prompt
+                'prompt': user_prompt,
+                # Pass back to the generate endpoints to skip analysing the prompt again (not for a fallback)
+                'analysis_id': None if isinstance(suggested_tags, Uncacheable) else create_analysis_handle(user_prompt, suggested_tags)
             }), 200
             
         except Exception as e:
             return jsonify({'error': str(e)}), 500
-    
+
+    @app.route('/prompt-analyzer/report', methods=['GET'])
+    def prompt_analyzer_report():
+        """Report local prompt analyzer hit rate and agreement with GPT-4o"""
+        # Check authentication
+        auth_error = require_login()
+        if auth_error:
+            return auth_error
+
+        return jsonify(get_analyzer_report()), 200
+
+    @app.route('/external-calls/metrics', methods=['GET'])
+    def external_call_metrics():
+        """Report latency, retries and errors of calls to external AI services"""
+        # Check authentication
+        auth_error = require_login()
+        if auth_error:
+            return auth_error
+
+        return jsonify(get_http_metrics()), 200
+
+    @app.route('/external-calls/rate-limit', methods=['GET'])
+    def external_call_rate_limit():
+        """Report the shared OpenAI rate limit budget, queue and wait times"""
+        # Check authentication
+        auth_error = require_login()
+        if auth_error:
+            return auth_error
+
+        return jsonify(get_rate_limiter_stats()), 200
+
+    @app.route('/vision-payload/report', methods=['GET'])
+    def vision_payload_report():
+        """Report token usage, latency and validity of GPT-4o vision calls per payload setting"""
+        # Check authentication
+        auth_error = require_login()
+        if auth_error:
+            return auth_error
+
+        return jsonify(get_vision_report()), 200
+
+    @app.route('/image-providers/health', methods=['GET'])
+    def image_provider_health():
+        """Report latency, error rate and circuit breaker state of each image provider"""
+        # Check authentication
+        auth_error = require_login()
+        if auth_error:
+            return auth_error
+
+        return jsonify(get_provider_health()), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Stage timings, cache, pool and queue metrics in Prometheus text format"""
+        # Scrapers authenticate with METRICS_TOKEN; without one configured, a login is required
+        token = os.getenv('METRICS_TOKEN')
+        if token:
+            if not bearer_token_matches(token):
+                return jsonify({'error': 'Invalid metrics token'}), 401
+        else:
+            # Check authentication
+            auth_error = require_login()
+            if auth_error:
+                return auth_error
+
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/usage', methods=['GET'])
+    def usage():
+        """Calls, tokens, images, latency and estimated cost of external AI calls, rolled up
+
+        Users see their own usage. With USAGE_ADMIN_TOKEN as a bearer token, every user's
+        usage can be rolled up (?by=user,day) or filtered (?user=<id>).
+        """
+        admin_token = os.getenv('USAGE_ADMIN_TOKEN')
+        if admin_token and bearer_token_matches(admin_token):
+            user_id = request.args.get('user', type=int)
+        else:
+            # Check authentication
+            auth_error = require_login()
+            if auth_error:
+                return auth_error
+            user_id = get_current_user_id()
+
+        group_by = [group for group in request.args.get('by', 'day,call_type').split(',') if group]
+        days = min(request.args.get('days', 7, type=int), 366)
+        # Include this worker's calls that haven't been written yet
+        flush_usage()
+        try:
+            rows = usage_rollup(group_by, days=days, user_id=user_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'days': days, 'group_by': group_by, 'usage': rows}), 200
+
+    def require_profile_admin():
+        # Profiling is administered with PROFILE_ADMIN_TOKEN, not a user session
+        if not os.getenv('PROFILE_ADMIN_TOKEN'):
+            return jsonify({'error': 'Profiling admin is disabled (PROFILE_ADMIN_TOKEN is not set)'}), 403
+        authorization = request.headers.get('Authorization', '')
+        if not admin_token_matches(authorization.removeprefix('Bearer ')):
+            return jsonify({'error': 'Invalid profiling admin token'}), 401
+        return None
+
+    @app.route('/admin/profiles', methods=['GET'])
+    def admin_profiles():
+        """Profiling settings and summaries of the saved slow-request profiles, newest first"""
+        auth_error = require_profile_admin()
+        if auth_error:
+            return auth_error
+
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        return jsonify({
+            'settings': profiling_settings(),
+            'stats': get_profiling_stats(),
+            'profiles': list_profiles(limit),
+        }), 200
+
+    @app.route('/admin/profiles/<profile_id>', methods=['GET'])
+    def admin_profile(profile_id):
+        """One saved profile as JSON, or its stacks for flamegraph.pl/speedscope with ?format=folded"""
+        auth_error = require_profile_admin()
+        if auth_error:
+            return auth_error
+
+        document = load_profile(profile_id)
+        if document is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        if request.args.get('format') == 'folded':
+            return Response(folded_stacks(document), mimetype='text/plain')
+        return jsonify(document), 200
+
+    @app.route('/admin/profiling', methods=['POST'])
+    def admin_update_profiling():
+        """Change the profiling settings of every worker without a restart
+
+        Takes any of enabled, sample_rate, threshold_ms and interval_ms; an empty
+        object goes back to the environment settings.
+        """
+        auth_error = require_profile_admin()
+        if auth_error:
+            return auth_error
+
+        overrides = request.get_json(silent=True)
+        if not isinstance(overrides, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        try:
+            settings = update_profiling_settings(overrides)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'settings': settings}), 200
+
     @app.route('/generate-complete-outfit', methods=['POST'])
     def generate_complete_outfit():
         """Generate both collage and final outfit in one step for current user only"""
@@ -276,45 +457,40 @@ def setup_routes(app):
             if not user_prompt:
                 return jsonify({'error': 'No prompt provided'}), 400
             
-            print(f"Generating complete outfit for prompt: {user_prompt} using model: {image_model}")
+            logger.info("Generating complete outfit using model: %s", image_model)
+            log_payload(logger, 'Outfit prompt', user_prompt)
+            
+            # Load the wardrobe and decode tiles while GPT-4o analyses the prompt, if it has to
+            current_user_id = get_current_user_id()
+            warmup = WardrobeWarmup(app, current_user_id, user_prompt)
             
-            # Step 1: Analyze prompt to get target tags
-            target_tags = analyze_prompt_for_tags(user_prompt)
-            print(f"Target tags: {target_tags}")
+            # Step 1: Analyze prompt to get target tags (reusing a prior analysis if provided)
+            target_tags = analyze_prompt_for_tags(user_prompt, data.get('analysis_id'), on_llm_call=warmup.start)
+            logger.debug("Target tags: %s", target_tags)
             
             # Step 2: Select items from current user's wardrobe only
-            current_user_id = get_current_user_id()
             selected_items = select_items_for_collage(target_tags, current_user_id)
-            print(f"Selected items: {[(k, len(v)) for k, v in selected_items.items()]}")
+            logger.debug("Selected items: %s", [(k, len(v)) for k, v in selected_items.items()])
             
             if not selected_items or sum(len(items) for items in selected_items.values()) == 0:
                 return jsonify({'error': 'No matching items found in your wardrobe for this prompt'}), 404
             
-            # Step 3: Create collage image
+            # Step 3: Create collage image (tiles decoded by the warm-up are reused)
+            warmup.wait()
             collage_image = create_collage(selected_items)
             
             # Step 4: Save collage
-            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-            collage_filename = f"collage_{timestamp}.png"
+            collage_filename = make_collage_filename()
             collage_path = save_collage(collage_image, collage_filename)
-            print(f"Collage saved: {collage_path}")
+            logger.debug("Collage saved: %s", collage_path)
             
             # Step 5: Generate outfit image from collage using user's selected model
-            print(f"Generating outfit image with {image_model}...")
+            logger.debug("Generating outfit image with %s", image_model)
             outfit_image_url = generate_outfit_from_collage(collage_path, user_prompt, image_model)
-            print(f"Outfit generated: {outfit_image_url}")
+            log_payload(logger, 'Outfit generated', outfit_image_url)
             
             # Step 6: Prepare response with selected items details
-            items_details = {}
-            for category, items in selected_items.items():
-                items_details[category] = []
-                for item in items:
-                    items_details[category].append({
-                        'id': item.id,
-                        'image_url': item.image_url,
-                        'type_category': item.type_category,
-                        'tags': [tag.name for tag in item.tags]
-                    })
+            items_details = describe_selected_items(selected_items)
             
             return jsonify({
                 'collage_url': f"/uploads/{collage_filename}",
@@ -325,9 +501,128 @@ def setup_routes(app):
             }), 200
             
         except Exception as e:
-            print(f"Error generating complete outfit: {e}")
+            logger.exception("Error generating complete outfit: %s", e)
             return jsonify({'error': str(e)}), 500
     
+    @app.route('/generate-complete-outfit/stream', methods=['POST'])
+    def generate_complete_outfit_stream():
+        """Generate a complete outfit, streaming progress and the stylist's description as server-sent events"""
+        # Check authentication
+        auth_error = require_login()
+        if auth_error:
+            return auth_error
+        
+        data = request.get_json(silent=True) or {}
+        user_prompt = data.get('prompt', '')
+        image_model = data.get('model', 'dalle')
+        
+        if not user_prompt:
+            return jsonify({'error': 'No prompt provided'}), 400
+        
+        current_user_id = get_current_user_id()
+        
+        def events():
+            try:
+                warmup = WardrobeWarmup(app, current_user_id, user_prompt)
+                
+                # Step 1: Analyze prompt to get target tags
+                target_tags = analyze_prompt_for_tags(user_prompt, data.get('analysis_id'), on_llm_call=warmup.start)
+                yield format_sse('analysis', {'target_tags': target_tags})
+                
+                # Step 2: Select items from current user's wardrobe only
+                selected_items = select_items_for_collage(target_tags, current_user_id)
+                item_count = sum(len(items) for items in selected_items.values())
+                if item_count == 0:
+                    warmup.wait()
+                    yield format_sse('error', {'error': 'No matching items found in your wardrobe for this prompt', 'status': 404})
+                    return
+                
+                # Steps 3-4: Create and save collage
+                warmup.wait()
+                collage_filename = make_collage_filename()
+                collage_path = save_collage(create_collage(selected_items), collage_filename)
+                items_details = describe_selected_items(selected_items)
+                yield format_sse('collage', {
+                    'collage_url': f"/uploads/{collage_filename}",
+                    'selected_items': items_details
+                })
+                
+                # Step 5: Forward the stylist's description as it is generated
+                description_parts = []
+                for token in stream_outfit_description(collage_path, user_prompt):
+                    description_parts.append(token)
+                    yield format_sse('token', {'text': token})
+                clothing_description = ''.join(description_parts)
+                log_payload(logger, 'Selected outfit description', clothing_description)
+                yield format_sse('description', {'text': clothing_description})
+                
+                # Step 6: Generate the outfit image from the accumulated description
+                outfit_image_url = generate_outfit_image(clothing_description, user_prompt, image_model)
+                yield format_sse('outfit', {
+                    'collage_url': f"/uploads/{collage_filename}",
+                    'outfit_image_url': outfit_image_url,
+                    'target_tags': target_tags,
+                    'selected_items': items_details,
+                    'description': clothing_description,
+                    'message': f'Complete outfit generated with {item_count} items'
+                })
+            except Exception as e:
+                logger.exception("Error streaming complete outfit: %s", e)
+                yield format_sse('error', {'error': str(e), 'status': 500})
+        
+        return Response(
+            stream_with_context(events()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    @app.route('/generate-outfit-plan', methods=['POST'])
+    def generate_outfit_plan():
+        """Generate outfits for several prompts at once, streaming each as server-sent events when it completes"""
+        # Check authentication
+        auth_error = require_login()
+        if auth_error:
+            return auth_error
+        
+        data = request.get_json(silent=True) or {}
+        prompts = data.get('prompts')
+        image_model = data.get('model', 'dalle')
+        avoid_repeats = data.get('avoid_repeats', True)
+        
+        if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p.strip() for p in prompts):
+            return jsonify({'error': 'prompts must be a non-empty list of prompts'}), 400
+        if len(prompts) > max_plan_prompts():
+            return jsonify({'error': f'At most {max_plan_prompts()} prompts per plan'}), 400
+        
+        current_user_id = get_current_user_id()
+        
+        def events():
+            yield format_sse('plan', {'count': len(prompts)})
+            completed = failed = 0
+            try:
+                for index, result, error in plan_outfits(app, current_user_id, prompts, image_model, avoid_repeats):
+                    if error is None:
+                        completed += 1
+                        yield format_sse('outfit', result)
+                    else:
+                        failed += 1
+                        yield format_sse('error', {
+                            'index': index,
+                            'prompt': prompts[index],
+                            'error': str(error),
+                            'status': getattr(error, 'status', 500)
+                        })
+            except Exception as e:
+                logger.exception("Error generating outfit plan: %s", e)
+                yield format_sse('error', {'error': str(e), 'status': 500})
+            yield format_sse('done', {'completed': completed, 'failed': failed})
+        
+        return Response(
+            stream_with_context(events()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
     # Keep the original generate-collage route for backward compatibility
     @app.route('/generate-collage', methods=['POST'])
     def generate_outfit_collage():
@@ -344,36 +639,27 @@ def setup_routes(app):
             if not user_prompt:
                 return jsonify({'error': 'No prompt provided'}), 400
             
-            print(f"Generating collage for prompt: {user_prompt}")
+            logger.info("Generating collage")
+            log_payload(logger, 'Collage prompt', user_prompt)
             
-            # Step 1: Analyze prompt to get target tags
-            target_tags = analyze_prompt_for_tags(user_prompt)
-            print(f"Target tags: {target_tags}")
+            # Step 1: Analyze prompt to get target tags (reusing a prior analysis if provided)
+            target_tags = analyze_prompt_for_tags(user_prompt, data.get('analysis_id'))
+            logger.debug("Target tags: %s", target_tags)
             
             # Step 2: Select items from current user's wardrobe only
             current_user_id = get_current_user_id()
             selected_items = select_items_for_collage(target_tags, current_user_id)
-            print(f"Selected items: {[(k, len(v)) for k, v in selected_items.items()]}")
+            logger.debug("Selected items: %s", [(k, len(v)) for k, v in selected_items.items()])
             
             # Step 3: Create collage image
             collage_image = create_collage(selected_items)
             
             # Step 4: Save collage
-            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-            collage_filename = f"collage_{timestamp}.png"
+            collage_filename = make_collage_filename()
             collage_path = save_collage(collage_image, collage_filename)
             
             # Step 5: Return collage info and selected items details
-            items_details = {}
-            for category, items in selected_items.items():
-                items_details[category] = []
-                for item in items:
-                    items_details[category].append({
-                        'id': item.id,
-                        'image_url': item.image_url,
-                        'type_category': item.type_category,
-                        'tags': [tag.name for tag in item.tags]
-                    })
+            items_details = describe_selected_items(selected_items)
             
             return jsonify({
                 'collage_url': f"/uploads/{collage_filename}",
@@ -383,7 +669,7 @@ def setup_routes(app):
             }), 200
             
         except Exception as e:
-            print(f"Error generating collage: {e}")
+            logger.exception("Error generating collage: %s", e)
             return jsonify({'error': str(e)}), 500
 
     @app.route('/save-outfit', methods=['POST'])
@@ -432,7 +718,7 @@ def setup_routes(app):
             }), 201
             
         except Exception as e:
-            print(f"Error saving outfit: {e}")
+            logger.exception("Error saving outfit: %s", e)
             return jsonify({'error': str(e)}), 500
 
     @app.route('/saved-outfits', methods=['GET'])
@@ -455,7 +741,7 @@ def setup_routes(app):
             }), 200
             
         except Exception as e:
-            print(f"Error retrieving saved outfits: {e}")
+            logger.exception("Error retrieving saved outfits: %s", e)
             return jsonify({'error': str(e)}), 500
 
     @app.route('/delete-outfit/<int:outfit_id>', methods=['DELETE'])
@@ -468,13 +754,15 @@ def setup_routes(app):
             
         try:
             current_user_id = get_current_user_id()
-            outfit = SavedOutfit.query.filter_by(id=outfit_id, user_id=current_user_id).first()
+            deleted_count = db.session.execute(
+                db.delete(SavedOutfit)
+                .where(SavedOutfit.id == outfit_id, SavedOutfit.user_id == current_user_id)
+                .execution_options(synchronize_session=False)
+            ).rowcount
             
-            if not outfit:
+            if not deleted_count:
                 return jsonify({'error': 'Outfit not found'}), 404
             
-            # Delete the outfit
-            db.session.delete(outfit)
             db.session.commit()
             
             return jsonify({'message': 'Outfit deleted successfully!'}), 200
@@ -492,26 +780,16 @@ def setup_routes(app):
             
         try:
             current_user_id = get_current_user_id()
-            item = WardrobeItem.query.filter_by(id=item_id, user_id=current_user_id).first()
+            deleted_urls = delete_wardrobe_rows(current_user_id, WardrobeItem.id == item_id)
             
-            if not item:
+            if not deleted_urls:
                 return jsonify({'error': 'Item not found'}), 404
             
-            # Delete the image file if it exists
-            try:
-                if item.image_url:
-                    # Remove leading slash if present
-                    relative_path = item.image_url.lstrip('/')
-                    full_path = os.path.join(os.path.dirname(__file__), '..', relative_path)
-                    if os.path.exists(full_path):
-                        os.remove(full_path)
-            except Exception as e:
-                print(f"Error deleting image file: {e}")
-            
-            # Delete the item from database
-            db.session.delete(item)
             db.session.commit()
             
+            # Delete the image file in the background
+            schedule_file_removal(deleted_urls)
+            
             return jsonify({'message': 'Item deleted successfully!'}), 200
             
         except Exception as e:
@@ -535,31 +813,17 @@ def setup_routes(app):
                 return jsonify({'error': 'Invalid item IDs format'}), 400
             
             current_user_id = get_current_user_id()
-            items = WardrobeItem.query.filter(
-                WardrobeItem.id.in_(item_ids),
-                WardrobeItem.user_id == current_user_id
-            ).all()
+            deleted_urls = delete_wardrobe_rows(current_user_id, WardrobeItem.id.in_(item_ids))
             
-            if not items:
+            if not deleted_urls:
                 return jsonify({'error': 'No items found'}), 404
             
-            deleted_count = 0
-            for item in items:
-                try:
-                    # Delete the image file if it exists
-                    if item.image_url:
-                        relative_path = item.image_url.lstrip('/')
-                        full_path = os.path.join(os.path.dirname(__file__), '..', relative_path)
-                        if os.path.exists(full_path):
-                            os.remove(full_path)
-                except Exception as e:
-                    print(f"Error deleting image file: {e}")
-                
-                db.session.delete(item)
-                deleted_count += 1
-            
+            deleted_count = len(deleted_urls)
             db.session.commit()
             
+            # Delete the image files in the background
+            schedule_file_removal(deleted_urls)
+            
             return jsonify({'message': f'{deleted_count} items deleted successfully!'}), 200
             
         except Exception as e:
@@ -588,19 +852,15 @@ def setup_routes(app):
                 return jsonify({'error': 'Invalid outfit IDs format'}), 400
             
             current_user_id = get_current_user_id()
-            outfits = SavedOutfit.query.filter(
-                SavedOutfit.id.in_(outfit_ids),
-                SavedOutfit.user_id == current_user_id
-            ).all()
+            deleted_count = db.session.execute(
+                db.delete(SavedOutfit)
+                .where(SavedOutfit.id.in_(outfit_ids), SavedOutfit.user_id == current_user_id)
+                .execution_options(synchronize_session=False)
+            ).rowcount
             
-            if not outfits:
+            if not deleted_count:
                 return jsonify({'error': 'No outfits found'}), 404
             
-            deleted_count = 0
-            for outfit in outfits:
-                db.session.delete(outfit)
-                deleted_count += 1
-            
             db.session.commit()
             
             return jsonify({'message': f'{deleted_count} outfits deleted successfully!'}), 200
@@ -645,10 +905,9 @@ def setup_routes(app):
     @app.route('/health')
     def health_check():
         """Health check endpoint for testing connectivity"""
-        from config import Config
         return jsonify({
             'status': 'healthy',
-            'api_host': Config.API_HOST,
-            'api_port': Config.API_PORT,
+            'api_host': app.config['API_HOST'],
+            'api_port': app.config['API_PORT'],
             'timestamp': datetime.utcnow().isoformat()
         })
\ No newline at end of file
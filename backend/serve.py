@@ -0,0 +1,136 @@
+"""
+Production server
+Runs the Flask app in several gunicorn worker processes, each with a pool of
+request threads. The app is built once in the parent before forking: the
+schema is migrated, rembg (onnxruntime, numpy) is imported and the tag
+catalog is loaded. The heap is then frozen (gc.freeze), so workers share
+those pages copy-on-write. Each worker loads its own rembg model session
+after the fork, since ONNX Runtime sessions aren't fork-safe.
+
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+
+Reloads drain in-flight requests (uploads, streams) for up to
+--graceful-timeout seconds before old workers exit:
+- kill -HUP <pid>: restart the workers with the app already loaded in the parent
+- kill -USR2 <pid>, then -TERM the old parent: start a new parent with new code
+Requires gunicorn (requirements-prod.txt), which doesn't run on Windows.
+"""
+
+import gc
+import os
+import sys
+import argparse
+import tempfile
+import multiprocessing
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def build_preloaded_app():
+    """Create the app and do all shared start-up work in the parent process"""
+    from app import create_app
+    from db.migrations import upgrade_database
+    from services.background_removal import import_background_removal
+    from services.tag_catalog import load_tag_catalog
+    from services.logs import get_logger
+
+    app = create_app()
+    with app.app_context():
+        upgrade_database()
+        load_tag_catalog()
+    import_background_removal()
+
+    # Move everything loaded so far out of the collector's reach, so collections in the
+    # workers don't write to (and un-share) the parent's pages
+    gc.collect()
+    gc.freeze()
+    get_logger('serve').info("Preloaded app; %d objects frozen before forking", gc.get_freeze_count())
+    return app
+
+
+def post_fork(server, worker):
+    """Per-worker set-up, before the worker starts its request threads"""
+    from db import db
+    from password_hasher import start_password_hasher
+    from services.background_removal import preload_background_removal
+
+    # Connections opened by the parent (migrations, tag catalog) must not be shared
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=False)
+    start_password_hasher()
+    # The ONNX Runtime session (and its thread pool) is created here, not in the parent
+    preload_background_removal()
+
+
+def default_workers():
+    return int(os.getenv('SERVE_WORKERS', str(multiprocessing.cpu_count())))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Serve the Senera backend with pre-forked gunicorn workers')
+    parser.add_argument('--bind', default=os.getenv('SERVE_BIND', f"0.0.0.0:{os.getenv('API_PORT', '5000')}"))
+    parser.add_argument('--workers', type=int, default=default_workers(), help='worker processes')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('SERVE_THREADS', '8')),
+                        help='request threads per worker')
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.getenv('SERVE_GRACEFUL_TIMEOUT', '120')),
+                        help='seconds in-flight requests may take to finish on reload or shutdown')
+    parser.add_argument('--timeout', type=int, default=int(os.getenv('SERVE_TIMEOUT', '120')),
+                        help='seconds before an unresponsive worker is restarted')
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('SERVE_MAX_REQUESTS', '0')),
+                        help='recycle a worker after this many requests (0 = never)')
+    return parser
+
+
+if BaseApplication is not None:
+    class SeneraServer(BaseApplication):
+        """gunicorn application that builds the app itself instead of importing a module path"""
+
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return build_preloaded_app()
+
+
+def prepare_metrics_dir():
+    """Directory where every worker leaves its metrics snapshot for /metrics to add up"""
+    directory = os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"senera-metrics-{os.getpid()}"))
+    os.makedirs(directory, exist_ok=True)
+    # Counters start from zero with every server start
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            os.remove(os.path.join(directory, filename))
+    return directory
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if BaseApplication is None:
+        sys.exit('serve.py needs gunicorn: pip install -r requirements-prod.txt (on Windows use python app.py)')
+    prepare_metrics_dir()
+
+    SeneraServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'preload_app': True,
+        'graceful_timeout': args.graceful_timeout,
+        'timeout': args.timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'post_fork': post_fork,
+        'accesslog': '-',
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
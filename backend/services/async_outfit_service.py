@@ -0,0 +1,172 @@
+"""
+Async outfit generation
+Non-blocking versions of prompt analysis, the GPT-4o collage analysis and the
+image providers, for the ASGI entry point. Blocking work (file reads, image
+rendering) runs in a thread pool so the event loop only waits on the network.
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from services import http_client, provider_router
+from services.metrics import timed_stage
+from services.logs import get_logger, bind_request_context, log_payload
+from services.collage_service import (
+    OPENAI_CHAT_URL, OPENAI_IMAGES_URL, HF_API_URL, openai_headers,
+    build_prompt_analysis_payload, parse_prompt_analysis,
+    build_outfit_analysis_payload, build_dalle_payload, build_huggingface_payload,
+    save_generated_image, generate_outfit_with_replicate
+)
+from services.prompt_analyzer import (
+    analyze_prompt_locally, is_confident, local_analyzer_enabled, should_shadow_sample,
+    record_local_hit, record_llm_call
+)
+from services.prompt_cache import get_or_compute_async
+from services.vision_payload import vision_ladder, encode_image_for_vision, is_valid_description, record_vision_call
+
+logger = get_logger('async_outfit_service')
+
+_executor = None
+
+
+def get_executor():
+    """Thread pool for blocking work (collage rendering, file I/O, database)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('ASYNC_BLOCKING_WORKERS', '16')),
+            thread_name_prefix='senera-blocking'
+        )
+    return _executor
+
+
+async def run_blocking(func, *args):
+    """Run a blocking function in the thread pool without blocking the event loop"""
+    # run_in_executor doesn't carry context variables over, so pass the request id explicitly
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), bind_request_context(func), *args)
+
+
+async def analyze_prompt_with_llm_async(user_prompt):
+    """Send user prompt to GPT-4o to extract relevant tags for outfit selection"""
+    response = await http_client.async_post(
+        'openai_chat',
+        OPENAI_CHAT_URL,
+        headers=openai_headers(),
+        json=build_prompt_analysis_payload(user_prompt)
+    )
+
+    if response.status_code == 200:
+        tags_content = response.json()['choices'][0]['message']['content']
+        return parse_prompt_analysis(tags_content)
+    else:
+        raise Exception(f"GPT-4o error: {response.text}")
+
+
+@timed_stage('prompt_analysis')
+async def analyze_prompt_for_tags_async(user_prompt, on_llm_call=None):
+    """Extract target tags, using the local analyzer first and the shared cache for GPT-4o"""
+    if not local_analyzer_enabled():
+        return await get_or_compute_async(user_prompt, analyze_prompt_with_llm_async, on_miss=on_llm_call)
+
+    local_tags, confidence = analyze_prompt_locally(user_prompt)
+    shadow = False
+    if is_confident(user_prompt, confidence):
+        if not should_shadow_sample():
+            record_local_hit()
+            return local_tags
+        shadow = True
+
+    llm_tags = await get_or_compute_async(user_prompt, analyze_prompt_with_llm_async, on_miss=on_llm_call)
+    record_llm_call(local_tags, llm_tags, shadow=shadow)
+    return llm_tags
+
+
+@timed_stage('vision_call')
+async def describe_outfit_from_collage_async(collage_path, user_prompt):
+    """Ask GPT-4o to pick the best items from a collage and describe the outfit"""
+    for level, setting in vision_ladder('collage'):
+        encoded_image, mime_type = await run_blocking(encode_image_for_vision, collage_path, setting)
+
+        analyze_response = await http_client.async_post(
+            'openai_vision',
+            OPENAI_CHAT_URL,
+            headers=openai_headers(),
+            json=build_outfit_analysis_payload(encoded_image, user_prompt, setting['detail'], mime_type)
+        )
+
+        if analyze_response.status_code != 200:
+            raise Exception(f"GPT-4o analysis error: {analyze_response.text}")
+
+        response_data = analyze_response.json()
+        clothing_description = response_data['choices'][0]['message']['content']
+        valid = is_valid_description(clothing_description)
+        record_vision_call('collage', level, response_data.get('usage'), analyze_response.total_latency, valid)
+        if valid:
+            break
+        logger.info("Outfit description at %s was not usable, escalating", setting['name'])
+
+    log_payload(logger, 'Selected outfit description', clothing_description)
+    return clothing_description
+
+
+async def generate_outfit_with_dalle_async(clothing_description, user_prompt):
+    """Generate outfit using DALL-E 3"""
+    logger.debug("Using DALL-E 3 for image generation")
+
+    dalle_response = await http_client.async_post(
+        'openai_images',
+        OPENAI_IMAGES_URL,
+        headers=openai_headers(),
+        json=build_dalle_payload(clothing_description, user_prompt)
+    )
+
+    if dalle_response.status_code == 200:
+        return dalle_response.json()['data'][0]['url']
+    else:
+        raise Exception(f"DALL-E error: {dalle_response.text}")
+
+
+async def generate_outfit_with_huggingface_async(clothing_description, user_prompt):
+    """Generate outfit using Hugging Face Stable Diffusion (free tier)"""
+    try:
+        hf_token = os.getenv('HUGGINGFACE_API_KEY')
+        if not hf_token:
+            logger.warning("Hugging Face API key not found in environment variables")
+            return None
+
+        response = await http_client.async_post(
+            'huggingface',
+            HF_API_URL,
+            headers={"Authorization": f"Bearer {hf_token}"},
+            json=build_huggingface_payload(clothing_description, user_prompt)
+        )
+
+        if response.status_code == 200:
+            return await run_blocking(save_generated_image, response.content)
+        elif response.status_code == 503:
+            logger.warning("Hugging Face model is still loading after retries")
+            return None
+        else:
+            logger.warning("Hugging Face API error %s: %s", response.status_code, response.text[:500])
+            return None
+
+    except Exception as e:
+        logger.warning("Hugging Face generation error: %s", e)
+        return None
+
+
+async def generate_outfit_with_replicate_async(clothing_description, user_prompt):
+    """Generate outfit using Replicate (not configured, see generate_outfit_with_replicate)"""
+    return generate_outfit_with_replicate(clothing_description, user_prompt)
+
+
+@timed_stage('image_generation')
+async def generate_outfit_image_async(clothing_description, user_prompt, image_service="dalle"):
+    """Generate the outfit photo with the chosen service, falling back to DALL-E"""
+    return await provider_router.generate_image_async(clothing_description, user_prompt, image_service)
+
+
+async def generate_outfit_from_collage_async(collage_path, user_prompt, image_service="dalle"):
+    """Describe the collage with GPT-4o, then generate the outfit photo"""
+    clothing_description = await describe_outfit_from_collage_async(collage_path, user_prompt)
+    return await generate_outfit_image_async(clothing_description, user_prompt, image_service)
@@ -0,0 +1,51 @@
+"""
+Background removal for uploaded garments
+rembg pulls in onnxruntime and numpy, which take seconds to import, so it is
+imported on the first upload (or by preload_background_removal at server
+start) instead of when the routes are loaded. The model session is created
+once per process and reused, rather than reloaded for every image. ONNX
+Runtime sessions don't survive a fork (their thread pool stays behind in the
+parent), so a forking server imports rembg before forking and creates the
+session in each worker.
+"""
+
+import os
+import threading
+from services.metrics import timed_stage
+from services.logs import get_logger
+
+logger = get_logger('background_removal')
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    """The model session of this process, created again after a fork"""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            from rembg import new_session
+            _session = new_session(os.getenv('REMBG_MODEL', 'u2net'))
+            _session_pid = os.getpid()
+            logger.info("Background removal model loaded (%s)", os.getenv('REMBG_MODEL', 'u2net'))
+        return _session
+
+
+@timed_stage('background_removal')
+def remove_background(image_data):
+    """The image (PIL image or encoded bytes) with the background made transparent, of the same type"""
+    session = _get_session()
+    from rembg import remove
+    return remove(image_data, session=session)
+
+
+def import_background_removal():
+    """Import rembg without loading a model, e.g. in a server's parent before it forks"""
+    import rembg  # noqa: F401
+
+
+def preload_background_removal():
+    """Import rembg and load its model now, in the process that will use it"""
+    _get_session()
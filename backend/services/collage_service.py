@@ -1,21 +1,36 @@
 import os
 import json
-import requests
 from PIL import Image, ImageDraw, ImageFont
-from db.models import WardrobeItem, Tag, db
-from services.services import tag_image
-from collections import defaultdict
+from db.models import WardrobeItem, Tag, WardrobeItemTag, db
+from sqlalchemy import func, case, and_, literal
+from sqlalchemy.orm import selectinload
+from services.services import tag_image, OPENAI_API_BASE
+from services import http_client, provider_router
+from services.vision_payload import vision_ladder, encode_image_for_vision, is_valid_description, record_vision_call
+from services.prompt_analyzer import (
+    analyze_prompt_locally, is_confident, local_analyzer_enabled, should_shadow_sample,
+    record_local_hit, record_llm_call, DEFAULT_TYPE_CATEGORIES
+)
+from services.prompt_cache import get_or_compute, resolve_analysis_handle, Uncacheable
+from services.metrics import timed_stage, observe_stage
+from services.logs import get_logger, log_payload
+from services.usage import record_usage
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import base64
+import copy
+import time
+import uuid
+from datetime import datetime
 
-def analyze_prompt_for_tags(user_prompt):
-    """Send user prompt to GPT-4o to extract relevant tags for outfit selection"""
-    api_key = os.getenv('OPENAI_API_KEY')
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json'
-    }
+logger = get_logger('collage_service')
 
-    system_prompt = """You are a fashion stylist AI. Analyze the user's outfit request and return relevant clothing tags that would fit their needs. 
+OPENAI_CHAT_URL = f'{OPENAI_API_BASE}/chat/completions'
+OPENAI_IMAGES_URL = f'{OPENAI_API_BASE}/images/generations'
+POLLINATIONS_BASE_URL = os.getenv('POLLINATIONS_BASE_URL', 'https://image.pollinations.ai').rstrip('/')
+
+PROMPT_ANALYSIS_SYSTEM_PROMPT = """You are a fashion stylist AI. Analyze the user's outfit request and return relevant clothing tags that would fit their needs. 
 
 Return a JSON object with these categories:
 - "type_categories": array of clothing types needed (e.g., ["top", "bottom", "footwear"])
@@ -35,44 +50,102 @@ Example:
 User: "casual coffee outfit"
 Response: {"type_categories": ["top", "bottom", "footwear"], "styles": ["casual", "classic"], "colors": [], "occasions": ["casual"], "seasons": []}"""
 
-    payload = {
+# Used when GPT-4o does not answer with valid JSON
+FALLBACK_TARGET_TAGS = {
+    "type_categories": ["top", "bottom", "footwear"],
+    "styles": ["casual"],
+    "colors": [],
+    "occasions": ["casual"],
+    "seasons": []
+}
+
+# Decoded wardrobe tiles, keyed by (path, mtime)
+_tile_cache = OrderedDict()
+_tile_cache_lock = threading.Lock()
+_tile_cache_stats = {'hits': 0, 'misses': 0}
+
+# Background warm-up of wardrobe tiles while a prompt is being analysed
+_warmup_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('TILE_WARMUP_WORKERS', '4')),
+    thread_name_prefix='senera-warmup'
+)
+
+@timed_stage('prompt_analysis')
+def analyze_prompt_for_tags(user_prompt, analysis_id=None, on_llm_call=None):
+    """Extract relevant tags for outfit selection
+
+    A valid analysis handle from /analyze-prompt is reused as-is. Short keyword
+    prompts are answered by the local analyzer; anything it is not confident
+    about goes to GPT-4o through the shared prompt cache. on_llm_call is called
+    just before waiting on GPT-4o, so work can overlap the call.
+    """
+    handle_tags = resolve_analysis_handle(analysis_id, user_prompt)
+    if handle_tags is not None:
+        return handle_tags
+
+    if not local_analyzer_enabled():
+        return get_or_compute(user_prompt, analyze_prompt_with_llm, on_miss=on_llm_call)
+
+    local_tags, confidence = analyze_prompt_locally(user_prompt)
+    shadow = False
+    if is_confident(user_prompt, confidence):
+        if not should_shadow_sample():
+            record_local_hit()
+            return local_tags
+        shadow = True
+
+    llm_tags = get_or_compute(user_prompt, analyze_prompt_with_llm, on_miss=on_llm_call)
+    record_llm_call(local_tags, llm_tags, shadow=shadow)
+    return llm_tags
+
+def openai_headers():
+    """Authorization headers for the OpenAI API"""
+    api_key = os.getenv('OPENAI_API_KEY')
+    return {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+
+def build_prompt_analysis_payload(user_prompt):
+    """Chat completion payload asking GPT-4o for the target tags of a prompt"""
+    return {
         "model": "gpt-4o",
         "messages": [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": PROMPT_ANALYSIS_SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ],
         "max_tokens": 200
     }
 
-    response = requests.post(
-        'https://api.openai.com/v1/chat/completions',
-        headers=headers,
-        json=payload
+def parse_prompt_analysis(tags_content):
+    """Parse GPT-4o's target tags, falling back to a casual outfit if it isn't JSON"""
+    try:
+        # Clean markdown formatting if present
+        if tags_content.startswith('```json'):
+            tags_content = tags_content[7:-3]
+        elif tags_content.startswith('```'):
+            tags_content = tags_content[3:-3]
+        
+        return json.loads(tags_content.strip())
+    except json.JSONDecodeError:
+        logger.warning("Failed to parse GPT-4o response, using the fallback tags")
+        log_payload(logger, 'Unparsable GPT-4o response', tags_content)
+        # Not cached: the next request for this prompt asks again
+        return Uncacheable(copy.deepcopy(FALLBACK_TARGET_TAGS))
+
+def analyze_prompt_with_llm(user_prompt):
+    """Send user prompt to GPT-4o to extract relevant tags for outfit selection"""
+    response = http_client.post(
+        'openai_chat',
+        OPENAI_CHAT_URL,
+        headers=openai_headers(),
+        json=build_prompt_analysis_payload(user_prompt)
     )
 
     if response.status_code == 200:
         response_data = response.json()
         tags_content = response_data['choices'][0]['message']['content']
-        
-        # Parse JSON response
-        try:
-            # Clean markdown formatting if present
-            if tags_content.startswith('```json'):
-                tags_content = tags_content[7:-3]
-            elif tags_content.startswith('```'):
-                tags_content = tags_content[3:-3]
-            
-            tags_data = json.loads(tags_content.strip())
-            return tags_data
-        except json.JSONDecodeError:
-            print(f"Failed to parse GPT-4o response: {tags_content}")
-            return {
-                "type_categories": ["top", "bottom", "footwear"],
-                "styles": ["casual"],
-                "colors": [],
-                "occasions": ["casual"],
-                "seasons": []
-            }
+        return parse_prompt_analysis(tags_content)
     else:
         raise Exception(f"GPT-4o error: {response.text}")
 
@@ -93,37 +166,211 @@ def score_item_relevance(item, target_tags):
     
     return score
 
+@timed_stage('selection')
 def select_items_for_collage(target_tags, user_id, max_per_category=5):
-    """Select wardrobe items based on target tags for specific user only"""
-    # Get items by type category for the specific user
+    """Select wardrobe items based on target tags for specific user only
+
+    Candidate filtering, scoring (+10 for a matching type category, +5 per
+    matching tag) and the per-category top-k all run in a single SQL query,
+    so only the winning items are loaded, with their tags preloaded.
+    """
+    type_categories = [c for c in target_tags.get('type_categories', []) if c]
+    if not type_categories:
+        return {}
+
+    # Weight each tag name by how many target categories ask for it,
+    # mirroring score_item_relevance which adds 5 points per occurrence
+    tag_weights = defaultdict(int)
+    for category, tag_list in target_tags.items():
+        if category == 'type_categories':
+            continue
+        for tag_name in tag_list:
+            tag_weights[tag_name] += 5
+
+    # Every candidate already matches a requested type category (+10)
+    if tag_weights:
+        tag_score = func.coalesce(func.sum(case(
+            *[(Tag.name == name, weight) for name, weight in tag_weights.items()],
+            else_=0
+        )), 0)
+    else:
+        tag_score = literal(0)
+
+    scored = (
+        db.session.query(
+            WardrobeItem.id.label('item_id'),
+            WardrobeItem.type_category.label('type_category'),
+            (literal(10) + tag_score).label('score')
+        )
+        .outerjoin(WardrobeItemTag, WardrobeItemTag.wardrobe_item_id == WardrobeItem.id)
+        .outerjoin(Tag, and_(Tag.id == WardrobeItemTag.tag_id, Tag.name.in_(list(tag_weights))))
+        .filter(
+            WardrobeItem.user_id == user_id,
+            WardrobeItem.type_category.in_(type_categories)
+        )
+        .group_by(WardrobeItem.id, WardrobeItem.type_category)
+        .subquery()
+    )
+
+    # Rank items within each category, highest score first (ties keep insertion order)
+    ranked = (
+        db.session.query(
+            scored.c.item_id,
+            scored.c.type_category,
+            func.row_number().over(
+                partition_by=scored.c.type_category,
+                order_by=(scored.c.score.desc(), scored.c.item_id)
+            ).label('rank')
+        )
+        .subquery()
+    )
+
+    winners = (
+        db.session.query(WardrobeItem)
+        .join(ranked, ranked.c.item_id == WardrobeItem.id)
+        .filter(ranked.c.rank <= max_per_category)
+        .options(selectinload(WardrobeItem.tags))
+        .order_by(ranked.c.type_category, ranked.c.rank)
+        .all()
+    )
+
     items_by_category = defaultdict(list)
-    
-    # Query wardrobe items for the specific user only
-    all_items = WardrobeItem.query.filter_by(user_id=user_id).all()
-    
-    for item in all_items:
+    for item in winners:
         items_by_category[item.type_category].append(item)
-    
+
+    # Keep the order in which the categories were requested
     selected_items = {}
-    
-    # For each requested type category, select best matching items
-    for type_category in target_tags.get('type_categories', []):
-        available_items = items_by_category.get(type_category, [])
-        
-        if available_items:
-            # Score and sort items by relevance
-            scored_items = []
-            for item in available_items:
-                score = score_item_relevance(item, target_tags)
-                scored_items.append((score, item))
-            
-            # Sort by score (highest first) and take top items
-            scored_items.sort(key=lambda x: x[0], reverse=True)
-            selected_count = min(max_per_category, len(scored_items))
-            selected_items[type_category] = [item for _, item in scored_items[:selected_count]]
-    
+    for type_category in type_categories:
+        if items_by_category.get(type_category):
+            selected_items[type_category] = items_by_category[type_category]
+
+    return selected_items
+
+def load_wardrobe(user_id):
+    """All wardrobe items of a user with their tags preloaded, for repeated in-memory selection"""
+    return (
+        WardrobeItem.query
+        .filter_by(user_id=user_id)
+        .options(selectinload(WardrobeItem.tags))
+        .order_by(WardrobeItem.id)
+        .all()
+    )
+
+@timed_stage('selection')
+def rank_wardrobe_items(wardrobe, target_tags, max_per_category=5, avoid_ids=()):
+    """In-memory select_items_for_collage over a wardrobe from load_wardrobe
+
+    Scores and ties match the SQL selection. Items in avoid_ids are only used
+    when a category would otherwise be empty.
+    """
+    type_categories = [c for c in target_tags.get('type_categories', []) if c]
+    ranked_by_category = defaultdict(list)
+    for item in wardrobe:
+        if item.type_category in type_categories:
+            ranked_by_category[item.type_category].append((-score_item_relevance(item, target_tags), item.id, item))
+
+    selected_items = {}
+    for type_category in type_categories:
+        ranked = [item for _, _, item in sorted(ranked_by_category.get(type_category, []), key=lambda r: r[:2])]
+        fresh = [item for item in ranked if item.id not in avoid_ids]
+        chosen = (fresh or ranked)[:max_per_category]
+        if chosen:
+            selected_items[type_category] = chosen
     return selected_items
 
+def load_tile(item_path):
+    """Decoded wardrobe image, cached by path and modification time
+
+    The cached image is shared, so callers must not modify it in place.
+    """
+    key = (item_path, os.path.getmtime(item_path))
+    with _tile_cache_lock:
+        tile = _tile_cache.get(key)
+        if tile is not None:
+            _tile_cache.move_to_end(key)
+            _tile_cache_stats['hits'] += 1
+            return tile
+        _tile_cache_stats['misses'] += 1
+
+    tile = Image.open(item_path)
+    tile.load()
+
+    max_tiles = int(os.getenv('TILE_CACHE_MAX_ITEMS', '64'))
+    with _tile_cache_lock:
+        _tile_cache[key] = tile
+        while len(_tile_cache) > max_tiles:
+            _tile_cache.popitem(last=False)
+    return tile
+
+def get_tile_cache_stats():
+    """Tile cache hit/miss counters and current size"""
+    with _tile_cache_lock:
+        return {**_tile_cache_stats, 'size': len(_tile_cache)}
+
+def clear_tile_cache():
+    """Drop every decoded tile"""
+    with _tile_cache_lock:
+        _tile_cache.clear()
+
+@timed_stage('wardrobe_warmup')
+def warm_up_wardrobe(user_id, user_prompt):
+    """Pre-decode the tiles of the likely collage candidates for a user
+
+    Runs the normal selection with the local analyzer's tags while the real
+    analysis is still in flight. It only warms the tile cache, so the final
+    selection is unaffected; when the local analysis turns out to be the
+    final one, exactly the needed tiles are already decoded.
+    """
+    local_tags, _ = analyze_prompt_locally(user_prompt)
+    if not local_tags.get('type_categories'):
+        local_tags['type_categories'] = list(DEFAULT_TYPE_CATEGORIES)
+
+    warmed = 0
+    # Unwrapped, so the speculative query isn't counted as the request's selection stage
+    for items in select_items_for_collage.__wrapped__(local_tags, user_id).values():
+        for item in items:
+            item_path = os.path.join('uploads', os.path.basename(item.image_url))
+            try:
+                if os.path.exists(item_path):
+                    load_tile(item_path)
+                    warmed += 1
+            except Exception as e:
+                logger.warning("Tile warm-up failed for %s: %s", item_path, e)
+    return warmed
+
+class WardrobeWarmup:
+    """warm_up_wardrobe in the background, started only when something is worth overlapping
+
+    Pass start as analyze_prompt_for_tags' on_llm_call: a prompt answered by a
+    handle, the cache or the local analyzer doesn't wait long enough for an
+    extra wardrobe query to pay off.
+    """
+
+    def __init__(self, app, user_id, user_prompt):
+        self.app = app
+        self.user_id = user_id
+        self.user_prompt = user_prompt
+        self.future = None
+
+    def _run(self):
+        with self.app.app_context():
+            return warm_up_wardrobe(self.user_id, self.user_prompt)
+
+    def start(self):
+        if self.future is None:
+            self.future = _warmup_executor.submit(self._run)
+
+    def wait(self, timeout=5):
+        """Join the warm-up if it was started; failures only cost the cache"""
+        if self.future is None:
+            return 0
+        try:
+            return self.future.result(timeout=timeout)
+        except Exception as e:
+            logger.warning("Wardrobe warm-up did not finish: %s", e)
+            return 0
+
+@timed_stage('collage_render')
 def create_collage(selected_items, collage_size=(1024, 768)):
     """Create an optimized collage image for GPT-4o analysis"""
     # Create blank canvas with white background
@@ -228,7 +475,7 @@ def create_collage(selected_items, collage_size=(1024, 768)):
                 # Load and process item image
                 item_path = os.path.join('uploads', os.path.basename(item.image_url))
                 if os.path.exists(item_path):
-                    item_img = Image.open(item_path)
+                    item_img = load_tile(item_path)
                     
                     # Resize to fit space while maintaining aspect ratio
                     # Leave small margin for text
@@ -279,7 +526,7 @@ def create_collage(selected_items, collage_size=(1024, 768)):
                     draw.text((text_x, text_y), "No Image", fill='gray', font=tag_font)
                 
             except Exception as e:
-                print(f"Error processing item {item.id}: {e}")
+                logger.warning("Error processing item %s: %s", item.id, e)
                 # Calculate position for error placeholder (simplified)
                 if num_items <= 3:
                     current_x = margin + i * (item_width + spacing)
@@ -306,6 +553,25 @@ def create_collage(selected_items, collage_size=(1024, 768)):
     
     return collage
 
+def make_collage_filename():
+    """Unique collage filename, safe when several collages are saved in the same second"""
+    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    return f"collage_{timestamp}_{uuid.uuid4().hex[:8]}.png"
+
+def describe_selected_items(selected_items):
+    """Serialize selected items per category for API responses"""
+    items_details = {}
+    for category, items in selected_items.items():
+        items_details[category] = []
+        for item in items:
+            items_details[category].append({
+                'id': item.id,
+                'image_url': item.image_url,
+                'type_category': item.type_category,
+                'tags': [tag.name for tag in item.tags]
+            })
+    return items_details
+
 def save_collage(collage_image, filename="collage.png"):
     """Save collage image to uploads folder with optimized settings"""
     uploads_dir = 'uploads'
@@ -316,27 +582,15 @@ def save_collage(collage_image, filename="collage.png"):
     collage_image.save(filepath, 'PNG', optimize=True, compress_level=6)
     return filepath
 
-def generate_outfit_from_collage(collage_path, user_prompt, image_service="dalle"):
-    """Send collage image to AI service to generate outfit photo
-    
-    Args:
-        collage_path: Path to the collage image
-        user_prompt: User's outfit request
-        image_service: Which service to use ("dalle", "pollinations", "huggingface", "replicate")
-    """
-    api_key = os.getenv('OPENAI_API_KEY')
-    
-    # Encode image to base64
-    with open(collage_path, "rb") as image_file:
-        encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-    
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json'
-    }
-    
+def encode_image_file(image_path):
+    """Read an image file and return it base64-encoded"""
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+def build_outfit_analysis_payload(encoded_image, user_prompt, detail=None, mime_type='image/png'):
+    """GPT-4o vision payload that selects and describes an outfit from a collage"""
     # Enhanced GPT-4o analysis to SELECT the best matching items
-    analyze_payload = {
+    payload = {
         "model": "gpt-4o",
         "messages": [
             {
@@ -365,7 +619,7 @@ Focus on creating ONE perfect outfit that matches the "{user_prompt}" style. Wit
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{encoded_image}"
+                            "url": f"data:{mime_type};base64,{encoded_image}"
                         }
                     }
                 ]
@@ -373,44 +627,110 @@ Focus on creating ONE perfect outfit that matches the "{user_prompt}" style. Wit
         ],
         "max_tokens": 450
     }
-    
-    # Get detailed clothing description from GPT-4o
-    analyze_response = requests.post(
-        'https://api.openai.com/v1/chat/completions',
-        headers=headers,
-        json=analyze_payload
+    if detail:
+        payload["messages"][0]["content"][1]["image_url"]["detail"] = detail
+    return payload
+
+@timed_stage('vision_call')
+def describe_outfit_from_collage(collage_path, user_prompt):
+    """Ask GPT-4o to pick the best items from a collage and describe the outfit"""
+    for level, setting in vision_ladder('collage'):
+        encoded_image, mime_type = encode_image_for_vision(collage_path, setting)
+        
+        # Get detailed clothing description from GPT-4o
+        analyze_response = http_client.post(
+            'openai_vision',
+            OPENAI_CHAT_URL,
+            headers=openai_headers(),
+            json=build_outfit_analysis_payload(encoded_image, user_prompt, setting['detail'], mime_type)
+        )
+        
+        if analyze_response.status_code != 200:
+            raise Exception(f"GPT-4o analysis error: {analyze_response.text}")
+        
+        response_data = analyze_response.json()
+        clothing_description = response_data['choices'][0]['message']['content']
+        valid = is_valid_description(clothing_description)
+        record_vision_call('collage', level, response_data.get('usage'), analyze_response.total_latency, valid)
+        if valid:
+            break
+        logger.info("Outfit description at %s was not usable, escalating", setting['name'])
+    
+    log_payload(logger, 'Selected outfit description', clothing_description)
+    return clothing_description
+
+def stream_outfit_description(collage_path, user_prompt):
+    """Yield GPT-4o's outfit description piece by piece as it is generated"""
+    call_started = time.perf_counter()
+    # Streamed tokens can't be taken back, so only the starting setting is used
+    level, setting = vision_ladder('collage')[0]
+    encoded_image, mime_type = encode_image_for_vision(collage_path, setting)
+    payload = build_outfit_analysis_payload(encoded_image, user_prompt, setting['detail'], mime_type)
+    payload["stream"] = True
+    payload["stream_options"] = {"include_usage": True}
+    
+    analyze_response = http_client.post(
+        'openai_vision',
+        OPENAI_CHAT_URL,
+        headers=openai_headers(),
+        json=payload,
+        stream=True
     )
     
     if analyze_response.status_code != 200:
         raise Exception(f"GPT-4o analysis error: {analyze_response.text}")
     
-    clothing_description = analyze_response.json()['choices'][0]['message']['content']
-    print(f"Selected outfit description: {clothing_description}")
-    
-    # Choose image generation service
-    if image_service.lower() == "pollinations":
-        print("Using Pollinations.ai for image generation...")
-        return generate_outfit_with_pollinations(clothing_description, user_prompt)
-    
-    elif image_service.lower() == "huggingface":
-        print("Using Hugging Face for image generation...")
-        result = generate_outfit_with_huggingface(clothing_description, user_prompt)
-        if result:
-            return result
-        else:
-            print("Hugging Face failed, falling back to DALL-E...")
-    
-    elif image_service.lower() == "replicate":
-        print("Using Replicate for image generation...")
-        result = generate_outfit_with_replicate(clothing_description, user_prompt)
-        if result:
-            return result
-        else:
-            print("Replicate failed, falling back to DALL-E...")
-    
-    # Default to DALL-E or fallback
-    print("Using DALL-E 3 for image generation...")
+    started = time.perf_counter()
+    usage = None
+    pieces = []
+    completed = False
+    try:
+        # Server-sent events: "data: {json chunk}" lines, terminated by "data: [DONE]"
+        for line in analyze_response.iter_lines():
+            line = line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            chunk = json.loads(data)
+            # The final chunk carries token usage and no choices
+            usage = chunk.get('usage') or usage
+            choices = chunk.get('choices') or []
+            if choices:
+                content = (choices[0].get('delta') or {}).get('content')
+                if content:
+                    pieces.append(content)
+                    yield content
+        completed = True
+    finally:
+        analyze_response.close()
+        latency = analyze_response.total_latency + (time.perf_counter() - started)
+        record_vision_call('collage', level, usage, latency, is_valid_description(''.join(pieces)))
+        # The HTTP client leaves streamed calls to the caller, as usage arrives with the last chunk
+        record_usage('openai_vision', payload['model'], latency, outcome='ok' if completed else 'incomplete',
+                     usage=usage, call_type='vision_call')
+        observe_stage('vision_call', time.perf_counter() - call_started)
+
+def generate_outfit_from_collage(collage_path, user_prompt, image_service="dalle"):
+    """Send collage image to AI service to generate outfit photo
     
+    Args:
+        collage_path: Path to the collage image
+        user_prompt: User's outfit request
+        image_service: Which service to use ("dalle", "pollinations", "huggingface", "replicate")
+    """
+    clothing_description = describe_outfit_from_collage(collage_path, user_prompt)
+    return generate_outfit_image(clothing_description, user_prompt, image_service)
+
+@timed_stage('image_generation')
+def generate_outfit_image(clothing_description, user_prompt, image_service="dalle"):
+    """Generate the outfit photo with the chosen service, falling back to DALL-E"""
+    # Failover, hedging and circuit breaking across providers live in the provider router
+    return provider_router.generate_image(clothing_description, user_prompt, image_service)
+
+def build_dalle_payload(clothing_description, user_prompt):
+    """DALL-E 3 request for a model wearing the described outfit"""
     # Updated DALL-E prompt with enhanced styling instructions
     dalle_prompt = f"""Full-body photo of a single female fashion model **wearing the following outfit**: {clothing_description}
 
@@ -426,10 +746,9 @@ Instructions:
 Style theme: {user_prompt}
 """
     
-    print(f"DALL-E prompt: {dalle_prompt}")
+    log_payload(logger, 'DALL-E prompt', dalle_prompt)
     
-    # Generate outfit image with DALL-E 3
-    dalle_payload = {
+    return {
         "model": "dall-e-3",
         "prompt": dalle_prompt,
         "size": "1024x1024",
@@ -437,11 +756,16 @@ Style theme: {user_prompt}
         "style": "natural",
         "n": 1
     }
-    
-    dalle_response = requests.post(
-        'https://api.openai.com/v1/images/generations',
-        headers=headers,
-        json=dalle_payload
+
+def generate_outfit_with_dalle(clothing_description, user_prompt):
+    """Generate outfit using DALL-E 3"""
+    logger.debug("Using DALL-E 3 for image generation")
+    
+    dalle_response = http_client.post(
+        'openai_images',
+        OPENAI_IMAGES_URL,
+        headers=openai_headers(),
+        json=build_dalle_payload(clothing_description, user_prompt)
     )
     
     if dalle_response.status_code == 200:
@@ -470,28 +794,17 @@ Instructions:
     encoded_prompt = urllib.parse.quote(prompt)
     
     # Pollinations.ai API endpoint
-    pollinations_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=1024&height=1024&model=flux&nologo=true&enhance=true"
+    pollinations_url = f"{POLLINATIONS_BASE_URL}/prompt/{encoded_prompt}?width=1024&height=1024&model=flux&nologo=true&enhance=true"
     
     return pollinations_url
 
-def generate_outfit_with_huggingface(clothing_description, user_prompt):
-    """Generate outfit using Hugging Face Stable Diffusion (free tier)"""
-    try:
-        import requests
-        import io
-        from datetime import datetime
-        
-        # Get Hugging Face API key from environment
-        hf_token = os.getenv('HUGGINGFACE_API_KEY')
-        if not hf_token:
-            print("Hugging Face API key not found in environment variables")
-            return None
-        
-        # Hugging Face API endpoint for Stable Diffusion
-        HF_API_URL = "https://api-inference.huggingface.co/models/runwayml/stable-diffusion-v1-5"
-        
-        # Enhanced prompt for Hugging Face with dress handling
-        prompt = f"""Fashion catalog photo: single female model wearing {clothing_description}, {user_prompt} style.
+# Hugging Face API endpoint for Stable Diffusion
+HF_API_URL = f"{os.getenv('HUGGINGFACE_API_BASE', 'https://api-inference.huggingface.co').rstrip('/')}/models/runwayml/stable-diffusion-v1-5"
+
+def build_huggingface_payload(clothing_description, user_prompt):
+    """Stable Diffusion inference payload for a model wearing the described outfit"""
+    # Enhanced prompt for Hugging Face with dress handling
+    prompt = f"""Fashion catalog photo: single female model wearing {clothing_description}, {user_prompt} style.
 
 Instructions:
 - Head-to-toe full body view, standing pose
@@ -499,54 +812,66 @@ Instructions:
 - If outfit includes a full-length dress or maxi dress, do NOT add separate bottoms
 - Show complete outfit from head to feet including footwear
 - One person only, no duplicates, realistic fashion photography"""
-        
-        negative_prompt = "multiple people, busy background, shadows, blurry, low quality, cropped, duplicates, side-by-side, collage, floating clothes"
-        
-        payload = {
-            "inputs": prompt,
-            "parameters": {
-                "negative_prompt": negative_prompt,
-                "num_inference_steps": 30,
-                "guidance_scale": 8.0,
-                "width": 1024,
-                "height": 1024
-            }
+    
+    negative_prompt = "multiple people, busy background, shadows, blurry, low quality, cropped, duplicates, side-by-side, collage, floating clothes"
+    
+    log_payload(logger, 'Hugging Face prompt', prompt)
+    
+    return {
+        "inputs": prompt,
+        "parameters": {
+            "negative_prompt": negative_prompt,
+            "num_inference_steps": 30,
+            "guidance_scale": 8.0,
+            "width": 1024,
+            "height": 1024
         }
+    }
+
+def save_generated_image(image_bytes, prefix="hf_outfit"):
+    """Save a generated image to uploads and return the URL the frontend can access"""
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    filename = f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.png"
+    filepath = os.path.join('uploads', filename)
+    
+    # Ensure uploads directory exists
+    os.makedirs('uploads', exist_ok=True)
+    
+    # Save the image data
+    with open(filepath, 'wb') as f:
+        f.write(image_bytes)
+    
+    # Return the full URL that the frontend can access
+    base_url = f"http://{os.getenv('API_HOST', '192.168.100.14')}:{os.getenv('API_PORT', '5000')}"
+    return f"{base_url}/uploads/{filename}"
+
+def generate_outfit_with_huggingface(clothing_description, user_prompt):
+    """Generate outfit using Hugging Face Stable Diffusion (free tier)"""
+    try:
+        # Get Hugging Face API key from environment
+        hf_token = os.getenv('HUGGINGFACE_API_KEY')
+        if not hf_token:
+            logger.warning("Hugging Face API key not found in environment variables")
+            return None
         
         headers = {"Authorization": f"Bearer {hf_token}"}
-        
-        print(f"Hugging Face prompt: {prompt}")
+        payload = build_huggingface_payload(clothing_description, user_prompt)
         
         # Make API request
-        response = requests.post(HF_API_URL, headers=headers, json=payload, timeout=120)
+        response = http_client.post('huggingface', HF_API_URL, headers=headers, json=payload)
         
         if response.status_code == 200:
-            # Save the generated image
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            filename = f"hf_outfit_{timestamp}.png"
-            filepath = os.path.join('uploads', filename)
-            
-            # Ensure uploads directory exists
-            os.makedirs('uploads', exist_ok=True)
-            
-            # Save the image data
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            
-            # Return the full URL that the frontend can access
-            from config import Config
-            base_url = f"http://{os.getenv('API_HOST', '192.168.100.14')}:{os.getenv('API_PORT', '5000')}"
-            return f"{base_url}/uploads/{filename}"
+            return save_generated_image(response.content)
             
         elif response.status_code == 503:
-            print("Hugging Face model is loading, please try again in a few moments")
+            logger.warning("Hugging Face model is still loading after retries")
             return None
         else:
-            print(f"Hugging Face API error {response.status_code}: {response.text}")
+            logger.warning("Hugging Face API error %s: %s", response.status_code, response.text[:500])
             return None
         
     except Exception as e:
-        print(f"Hugging Face generation error: {e}")
+        logger.warning("Hugging Face generation error: %s", e)
         return None
 
 def generate_outfit_with_replicate(clothing_description, user_prompt):
@@ -575,5 +900,5 @@ def generate_outfit_with_replicate(clothing_description, user_prompt):
         return None
         
     except Exception as e:
-        print(f"Replicate generation error: {e}")
+        logger.warning("Replicate generation error: %s", e)
         return None
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""
+Background file removal
+Deleting wardrobe items removes their rows in one statement; the image files
+are handed to a single background thread so the request doesn't wait on the
+filesystem. Files still queued at shutdown are removed before exit.
+"""
+
+import os
+import queue
+import atexit
+import threading
+from services.logs import get_logger
+
+logger = get_logger('file_deleter')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_queue = queue.Queue()
+_thread = None
+_thread_lock = threading.Lock()
+_stats = {'queued': 0, 'removed': 0, 'missing': 0, 'errors': 0}
+
+
+def upload_file_path(image_url):
+    """Filesystem path of a stored "/uploads/..." image URL, or None for external URLs"""
+    if not image_url or image_url.startswith('http'):
+        return None
+    return os.path.join(BACKEND_DIR, image_url.lstrip('/'))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        _stats['removed'] += 1
+    except FileNotFoundError:
+        _stats['missing'] += 1
+    except Exception as e:
+        _stats['errors'] += 1
+        logger.warning("Error deleting image file: %s", e)
+
+
+def _worker():
+    while True:
+        path = _queue.get()
+        try:
+            if path is None:
+                return
+            _remove(path)
+        finally:
+            _queue.task_done()
+
+
+def _drain():
+    """Remove whatever is still queued when the process exits"""
+    if _thread is not None and _thread.is_alive():
+        _queue.put(None)
+        _thread.join(timeout=10)
+
+
+def _ensure_worker():
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_worker, name='senera-file-deleter', daemon=True)
+            _thread.start()
+
+
+def schedule_file_removal(image_urls):
+    """Queue the files behind stored image URLs for removal; returns how many were queued"""
+    paths = [path for path in map(upload_file_path, image_urls) if path]
+    if not paths:
+        return 0
+    _ensure_worker()
+    for path in paths:
+        _queue.put(path)
+    _stats['queued'] += len(paths)
+    return len(paths)
+
+
+def wait_for_file_removal():
+    """Block until every queued file has been handled"""
+    _queue.join()
+
+
+def get_file_deleter_stats():
+    return {**_stats, 'pending': _queue.qsize()}
+
+
+atexit.register(_drain)
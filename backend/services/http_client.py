@@ -0,0 +1,396 @@
+"""
+Shared HTTP client for external AI services
+One pooled requests.Session per process (and one httpx.AsyncClient per event
+loop for the async path) with per-endpoint connect/read timeouts, retries
+with jittered exponential backoff for 429/5xx responses, and per-call
+latency metrics. Calls that aren't idempotent (image generation, billed per
+image) are only retried when they can't have run: a 429 or a failure to
+connect.
+"""
+
+import os
+import time
+import asyncio
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from services import rate_limiter
+from services.metrics import observe
+from services.logs import span
+from services.profiling import record_external_call
+from services.usage import record_call
+
+# (connect timeout, read timeout) in seconds for each logical endpoint
+DEFAULT_TIMEOUTS = {
+    'openai_chat': (5, 60),
+    'openai_vision': (5, 90),
+    'openai_images': (5, 120),
+    'huggingface': (5, 120),
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Whether a call may be repeated after the server might already have acted on it.
+# A 5xx or a dropped connection can arrive after an image was generated and billed.
+IDEMPOTENT_ENDPOINTS = {
+    'openai_chat': True,
+    'openai_vision': True,
+    'openai_images': False,
+    'huggingface': True,
+}
+
+# Endpoints whose responses report token usage
+TOKEN_ENDPOINTS = {'openai_chat', 'openai_vision'}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_async_clients = {}  # event loop -> httpx.AsyncClient
+
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+def get_timeout(endpoint):
+    """Timeout tuple for an endpoint, overridable with HTTP_TIMEOUT_<ENDPOINT>=connect,read"""
+    override = os.getenv(f'HTTP_TIMEOUT_{endpoint.upper()}')
+    if override:
+        connect, read = override.split(',')
+        return float(connect), float(read)
+    return DEFAULT_TIMEOUTS.get(endpoint, (5, 60))
+
+
+def get_session():
+    """Return the process-wide pooled session, recreating it after a fork"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            pool_size = _env_int('HTTP_POOL_SIZE', 20)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def is_idempotent(endpoint):
+    """Endpoints not listed in IDEMPOTENT_ENDPOINTS are treated as not idempotent"""
+    return IDEMPOTENT_ENDPOINTS.get(endpoint, False)
+
+
+def _should_retry_status(endpoint, status):
+    # A 429 is a refusal, so nothing ran; other statuses only for idempotent calls
+    return status == 429 or (status in RETRY_STATUSES and is_idempotent(endpoint))
+
+
+def _connect_failed(error):
+    """Whether a requests ConnectionError happened before the request was sent"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # MaxRetryError wraps the underlying urllib3 error
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def _retry_after_seconds(response):
+    """Delay requested by the server, from Retry-After or Hugging Face's estimated_time"""
+    header = response.headers.get('Retry-After')
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(header)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    # Hugging Face answers 503 with {"error": "... is currently loading", "estimated_time": 20.0}
+    if response.status_code == 503:
+        try:
+            estimated = response.json().get('estimated_time')
+            if estimated is not None:
+                return float(estimated)
+        except (ValueError, AttributeError):
+            pass
+    return None
+
+
+def _backoff_delay(attempt):
+    """Exponential backoff with full jitter"""
+    base = _env_float('HTTP_RETRY_BASE_DELAY', 0.5)
+    cap = _env_float('HTTP_RETRY_MAX_DELAY', 20.0)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _record(endpoint, latency, status, attempts, error=False):
+    observe('senera_external_call_duration_seconds', latency, endpoint=endpoint)
+    with _metrics_lock:
+        stats = _metrics.setdefault(endpoint, {
+            'calls': 0,
+            'errors': 0,
+            'retries': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+            'status_codes': {},
+            'recent_latencies': deque(maxlen=500),
+        })
+        stats['calls'] += 1
+        stats['retries'] += attempts - 1
+        stats['total_latency'] += latency
+        stats['max_latency'] = max(stats['max_latency'], latency)
+        stats['recent_latencies'].append(latency)
+        if error:
+            stats['errors'] += 1
+        key = str(status) if status is not None else 'exception'
+        stats['status_codes'][key] = stats['status_codes'].get(key, 0) + 1
+
+
+def request(method, endpoint, url, **kwargs):
+    """Send a request through the shared session, retrying transient failures
+
+    Retries 429 and 5xx responses (including Hugging Face's 503 while a model
+    loads) and connection failures; endpoints that aren't idempotent only on
+    429 and failures to connect. The final response is returned whatever
+    its status so callers keep their own error handling. The response gets
+    `attempts`, `total_latency` and `usage` (chat token usage) attributes.
+    """
+    with span('http', endpoint=endpoint) as fields:
+        started = time.perf_counter()
+        try:
+            response = _request_with_retries(method, endpoint, url, **kwargs)
+        except Exception as e:
+            record_call(endpoint, url, kwargs.get('json'), None, time.perf_counter() - started, error=e)
+            record_external_call(endpoint, time.perf_counter() - started, failed=True)
+            raise
+        fields.update(status=response.status_code, attempts=response.attempts)
+        record_external_call(endpoint, response.total_latency, failed=response.status_code >= 400)
+        # Streamed responses are recorded by the caller once the stream (and its usage) is read
+        if not kwargs.get('stream'):
+            record_call(endpoint, url, kwargs.get('json'), response, response.total_latency)
+        return response
+
+
+def _request_with_retries(method, endpoint, url, **kwargs):
+    max_retries = _env_int('HTTP_MAX_RETRIES', 3)
+    max_delay = _env_float('HTTP_RETRY_MAX_DELAY', 20.0)
+    kwargs.setdefault('timeout', get_timeout(endpoint))
+    session = get_session()
+
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            # Wait for a turn within the shared OpenAI budget (no-op for other services)
+            estimated_tokens = rate_limiter.acquire(endpoint, kwargs.get('json'))
+        except rate_limiter.RateLimitTimeout:
+            _record(endpoint, time.perf_counter() - started, None, attempt, error=True)
+            raise
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            connect_failed = _connect_failed(e)
+            if connect_failed:
+                rate_limiter.refund(estimated_tokens)
+            if attempt > max_retries or not (connect_failed or is_idempotent(endpoint)):
+                _record(endpoint, time.perf_counter() - started, None, attempt, error=True)
+                raise
+            time.sleep(_backoff_delay(attempt - 1))
+            continue
+        except requests.exceptions.RequestException:
+            _record(endpoint, time.perf_counter() - started, None, attempt, error=True)
+            raise
+
+        if _should_retry_status(endpoint, response.status_code) and attempt <= max_retries:
+            delay = _retry_after_seconds(response)
+            if delay is None:
+                delay = _backoff_delay(attempt - 1)
+            if response.status_code == 429:
+                # Hold every queued OpenAI request, not just this one
+                rate_limiter.pause(min(delay, max_delay))
+            # Hand a streamed connection back to the pool, and this attempt's tokens back to the budget
+            response.close()
+            rate_limiter.refund(estimated_tokens)
+            time.sleep(min(delay, max_delay))
+            continue
+        break
+
+    latency = time.perf_counter() - started
+    _record(endpoint, latency, response.status_code, attempt, error=response.status_code >= 400)
+    if response.status_code != 200:
+        rate_limiter.refund(estimated_tokens)
+    usage = None
+    if response.status_code == 200 and not kwargs.get('stream'):
+        usage = _settle_usage(endpoint, estimated_tokens, response)
+    response.attempts = attempt
+    response.total_latency = latency
+    response.usage = usage
+    return response
+
+
+def _settle_usage(endpoint, estimated_tokens, response):
+    """Read the token usage of a chat completion and give it to the rate limiter"""
+    if endpoint not in TOKEN_ENDPOINTS:
+        return None
+    try:
+        usage = response.json().get('usage')
+    except (ValueError, AttributeError):
+        return None
+    if estimated_tokens:
+        rate_limiter.settle(estimated_tokens, usage)
+    return usage
+
+
+def post(endpoint, url, **kwargs):
+    """POST through the shared session (see request)"""
+    return request('POST', endpoint, url, **kwargs)
+
+
+def get_async_client():
+    """Return the pooled httpx.AsyncClient for the running event loop"""
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        max_connections = _env_int('ASYNC_HTTP_MAX_CONNECTIONS', 200)
+        client = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        ))
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client():
+    """Close the async client of the running event loop (on ASGI shutdown)"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def async_request(method, endpoint, url, **kwargs):
+    """Async counterpart of request(), with the same retries and metrics"""
+    with span('http', endpoint=endpoint) as fields:
+        started = time.perf_counter()
+        try:
+            response = await _async_request_with_retries(method, endpoint, url, **kwargs)
+        except Exception as e:
+            record_call(endpoint, url, kwargs.get('json'), None, time.perf_counter() - started, error=e)
+            record_external_call(endpoint, time.perf_counter() - started, failed=True)
+            raise
+        fields.update(status=response.status_code, attempts=response.attempts)
+        record_external_call(endpoint, response.total_latency, failed=response.status_code >= 400)
+        record_call(endpoint, url, kwargs.get('json'), response, response.total_latency)
+        return response
+
+
+async def _async_request_with_retries(method, endpoint, url, **kwargs):
+    import httpx
+
+    max_retries = _env_int('HTTP_MAX_RETRIES', 3)
+    max_delay = _env_float('HTTP_RETRY_MAX_DELAY', 20.0)
+    connect_timeout, read_timeout = kwargs.pop('timeout', None) or get_timeout(endpoint)
+    kwargs['timeout'] = httpx.Timeout(read_timeout, connect=connect_timeout)
+    client = get_async_client()
+
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            estimated_tokens = await rate_limiter.acquire_async(endpoint, kwargs.get('json'))
+        except rate_limiter.RateLimitTimeout:
+            _record(endpoint, time.perf_counter() - started, None, attempt, error=True)
+            raise
+        try:
+            response = await client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # Raised before the request was sent, so retrying is safe for every endpoint
+            rate_limiter.refund(estimated_tokens)
+            if attempt > max_retries:
+                _record(endpoint, time.perf_counter() - started, None, attempt, error=True)
+                raise
+            await asyncio.sleep(_backoff_delay(attempt - 1))
+            continue
+        except httpx.HTTPError:
+            _record(endpoint, time.perf_counter() - started, None, attempt, error=True)
+            raise
+
+        if _should_retry_status(endpoint, response.status_code) and attempt <= max_retries:
+            delay = _retry_after_seconds(response)
+            if delay is None:
+                delay = _backoff_delay(attempt - 1)
+            if response.status_code == 429:
+                rate_limiter.pause(min(delay, max_delay))
+            await response.aclose()
+            rate_limiter.refund(estimated_tokens)
+            await asyncio.sleep(min(delay, max_delay))
+            continue
+        break
+
+    latency = time.perf_counter() - started
+    _record(endpoint, latency, response.status_code, attempt, error=response.status_code >= 400)
+    if response.status_code != 200:
+        rate_limiter.refund(estimated_tokens)
+    usage = None
+    if response.status_code == 200:
+        usage = _settle_usage(endpoint, estimated_tokens, response)
+    response.attempts = attempt
+    response.total_latency = latency
+    response.usage = usage
+    return response
+
+
+async def async_post(endpoint, url, **kwargs):
+    """POST through the event loop's async client (see async_request)"""
+    return await async_request('POST', endpoint, url, **kwargs)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return round(ordered[index], 4)
+
+
+def get_http_metrics():
+    """Per-endpoint call counts, retries, errors and latency percentiles"""
+    with _metrics_lock:
+        report = {}
+        for endpoint, stats in _metrics.items():
+            recent = list(stats['recent_latencies'])
+            report[endpoint] = {
+                'calls': stats['calls'],
+                'errors': stats['errors'],
+                'retries': stats['retries'],
+                'status_codes': dict(stats['status_codes']),
+                'avg_latency': round(stats['total_latency'] / stats['calls'], 4) if stats['calls'] else None,
+                'max_latency': round(stats['max_latency'], 4),
+                'p50_latency': _percentile(recent, 0.50),
+                'p95_latency': _percentile(recent, 0.95),
+                'p99_latency': _percentile(recent, 0.99),
+            }
+        return report
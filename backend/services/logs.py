@@ -0,0 +1,356 @@
+"""
+Logging
+Structured logs for the backend. Records are put on a queue by the request
+thread and written by a listener thread, so a slow terminal or log pipe
+never holds up a request. Every request gets an id (taken from an incoming
+X-Request-ID header, or generated), which is added to each record logged
+while handling it, including from worker threads, and returned as the
+X-Request-ID response header.
+
+Spans time external API calls and pipeline stages within a request; DB
+statements are counted per request and reported with it. LOG_SAMPLE_RATE
+keeps the info-level records (request lines, spans) of only a share of
+requests; warnings and errors are always kept. Prompts and model responses
+are logged only with LOG_PAYLOADS=true.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener
+
+ROOT_LOGGER = 'senera'
+
+_request = contextvars.ContextVar('senera_request', default=None)
+_span = contextvars.ContextVar('senera_span', default=None)
+
+_handler = None
+_listener = None
+_config_lock = threading.Lock()
+
+
+def get_logger(name):
+    """Logger under the app's root logger, e.g. get_logger('routes') -> senera.routes"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+logger = get_logger('requests')
+
+
+class RequestTrace:
+    """What is known about the request being handled in this context"""
+
+    __slots__ = ('request_id', 'sampled', 'started', 'db_statements', 'db_seconds', 'user_id')
+
+    def __init__(self, request_id, sampled):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.user_id = None
+        self.started = time.perf_counter()
+        self.db_statements = 0
+        self.db_seconds = 0.0
+
+
+def sample_rate():
+    return float(os.getenv('LOG_SAMPLE_RATE', '1'))
+
+
+def payload_logging_enabled():
+    return os.getenv('LOG_PAYLOADS', 'false').lower() == 'true'
+
+
+def current_request_id():
+    trace = _request.get()
+    return trace.request_id if trace is not None else None
+
+
+def current_request_user():
+    trace = _request.get()
+    return trace.user_id if trace is not None else None
+
+
+def set_request_user(user_id):
+    """Remember the logged-in user of the current request (for the request line and usage records)"""
+    trace = _request.get()
+    if trace is not None:
+        trace.user_id = user_id
+
+
+def request_db_usage():
+    """(statements, seconds) spent in the database by the current request so far"""
+    trace = _request.get()
+    return (trace.db_statements, trace.db_seconds) if trace is not None else (0, 0.0)
+
+
+def start_request(request_id=None):
+    """Begin tracing a request in the current context and return its id"""
+    # Accept a caller's id so one request can be followed through a proxy or the mobile app
+    if not request_id or len(request_id) > 64:
+        request_id = uuid.uuid4().hex[:16]
+    _request.set(RequestTrace(request_id, random.random() < sample_rate()))
+    return request_id
+
+
+def log_request(method, path, status):
+    """Log the request line; server errors are logged whether or not the request is sampled"""
+    trace = _request.get()
+    if trace is None:
+        return
+    fields = {
+        'method': method,
+        'path': path,
+        'status': status,
+        'user_id': trace.user_id,
+        'duration_ms': round((time.perf_counter() - trace.started) * 1000, 1),
+        'db_statements': trace.db_statements,
+        'db_ms': round(trace.db_seconds * 1000, 1),
+    }
+    level = logging.WARNING if status >= 500 else logging.INFO
+    logger.log(level, 'request', extra={'fields': fields})
+
+
+def finish_request():
+    """Stop tracing; records logged afterwards in this context have no request id"""
+    _request.set(None)
+
+
+def bind_request_context(func):
+    """Wrap func so it runs with the caller's request id when called from another thread
+
+    The thread running it is also sampled when the request is being profiled.
+    """
+    from services.profiling import attached_thread
+
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        with attached_thread():
+            return func(*args, **kwargs)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so each call gets its own copy
+        return context.copy().run(run, *args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def span(name, **fields):
+    """Time a block within the current request and log it as a span
+
+    Yields the span's fields, so the block can add to them (e.g. a response status).
+    """
+    trace = _request.get()
+    if trace is None or not trace.sampled or not logger.isEnabledFor(logging.INFO):
+        yield fields
+        return
+    span_id = uuid.uuid4().hex[:8]
+    parent = _span.get()
+    token = _span.set(span_id)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield fields
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _span.reset(token)
+        fields.update(span=name, span_id=span_id, parent_span_id=parent,
+                      duration_ms=round((time.perf_counter() - started) * 1000, 1))
+        if error:
+            fields['error'] = error
+        get_logger('spans').info('span', extra={'fields': fields})
+
+
+def log_payload(log, label, payload):
+    """Log a prompt or model response, only when LOG_PAYLOADS=true"""
+    if not payload_logging_enabled():
+        return
+    limit = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000'))
+    text = payload if isinstance(payload, str) else repr(payload)
+    if len(text) > limit:
+        text = text[:limit] + f"... ({len(text) - limit} more characters)"
+    log.info('%s: %s', label, text, extra={'fields': {'payload': label}})
+
+
+class RequestFilter(logging.Filter):
+    """Tag records with the request id and drop info records of unsampled requests"""
+
+    def filter(self, record):
+        trace = _request.get()
+        record.request_id = trace.request_id if trace is not None else None
+        record.span_id = _span.get()
+        if trace is not None and not trace.sampled and record.levelno < logging.WARNING:
+            return False
+        return True
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: records are dropped (and counted) when the queue is full"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Render the message and traceback now (args may change or be unpicklable later);
+        # formatting the line is left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            BackgroundQueueHandler.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'span_id', None):
+            # The span the record was logged in; span records carry their own ids in fields
+            entry['span_id'] = record.span_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable lines for development: time, level, logger, request id, message, fields"""
+
+    def format(self, record):
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.name}"
+        if getattr(record, 'request_id', None):
+            line += f" [{record.request_id}]"
+        line += f" {record.getMessage()}"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items()
+                                   if value is not None and key != 'payload')
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+def _start_listener():
+    global _listener
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', 'text').lower() == 'json' else TextFormatter())
+    _handler.queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+    _listener = QueueListener(_handler.queue, stream)
+    _listener.start()
+
+
+def get_log_stats():
+    """Records waiting to be written and records dropped because the queue was full"""
+    return {
+        'queued': _handler.queue.qsize() if _handler is not None else 0,
+        'dropped': BackgroundQueueHandler.dropped,
+    }
+
+
+def _stop_listener():
+    # Write out whatever is still queued when the process exits
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def configure_logging():
+    """Send the app's logs through the background queue; safe to call more than once"""
+    global _handler
+    with _config_lock:
+        if _handler is not None:
+            return
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        root.propagate = False
+
+        _handler = BackgroundQueueHandler(None)
+        _handler.addFilter(RequestFilter())
+        root.addHandler(_handler)
+        _start_listener()
+
+        # The listener thread doesn't survive a fork (serve.py workers); start one per process
+        os.register_at_fork(after_in_child=_start_listener)
+        atexit.register(_stop_listener)
+
+
+def init_request_logging(app):
+    """Give every request of this Flask app an id and log it when it completes"""
+    from flask import request
+    from db import db
+
+    configure_logging()
+    with app.app_context():
+        instrument_engine(db.engine)
+
+    @app.before_request
+    def start_request_trace():
+        start_request(request.headers.get('X-Request-ID'))
+
+    @app.after_request
+    def log_request_line(response):
+        request_id = current_request_id()
+        if request_id is not None:
+            response.headers['X-Request-ID'] = request_id
+            log_request(request.method, request.path, response.status_code)
+        return response
+
+    # Streamed responses (stream_with_context) tear down after the stream ends, so
+    # records logged while streaming keep the request id
+    @app.teardown_request
+    def finish_request_trace(exc):
+        finish_request()
+
+
+def instrument_engine(engine):
+    """Count each request's SQL statements and time spent in them; log statements at DEBUG"""
+    from sqlalchemy import event
+
+    db_logger = get_logger('db')
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('senera_query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['senera_query_started'].pop()
+        trace = _request.get()
+        if trace is None:
+            return
+        elapsed = time.perf_counter() - started
+        trace.db_statements += 1
+        trace.db_seconds += elapsed
+        if db_logger.isEnabledFor(logging.DEBUG):
+            db_logger.debug('span', extra={'fields': {
+                'span': 'db', 'statement': ' '.join(statement.split())[:200],
+                'duration_ms': round(elapsed * 1000, 2),
+            }})
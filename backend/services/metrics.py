@@ -0,0 +1,407 @@
+"""
+Metrics
+Timing histograms for every stage of uploads and outfit generation, plus
+the counters and gauges the services already keep (cache hits, pool and
+queue sizes, rate limiter waits), rendered in Prometheus text format for
+/metrics.
+
+Under serve.py every worker process has its own numbers. When METRICS_DIR is
+set (serve.py sets it), each process writes a snapshot there every
+METRICS_SNAPSHOT_INTERVAL seconds and /metrics adds up all of them, so a
+scrape sees the whole server whichever worker answers it. Counters and
+histograms of exited workers keep counting; their gauges are dropped.
+"""
+
+import os
+import json
+import time
+import atexit
+import inspect
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from services.logs import get_logger, span
+
+logger = get_logger('metrics')
+
+# Seconds; covers both in-process stages (ms) and external AI calls (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+HISTOGRAM_HELP = {
+    'senera_stage_duration_seconds': 'Time spent in each stage of uploads and outfit generation',
+    'senera_external_call_duration_seconds': 'Latency of calls to external APIs, including retries',
+    'senera_request_duration_seconds': 'Time until the response (or the start of a stream) was returned',
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> {'buckets': [...], 'sum': float, 'count': int}
+_collectors = []
+_stage = contextvars.ContextVar('senera_stage', default=None)
+_snapshot_thread = None
+_snapshot_pid = None
+
+
+def buckets():
+    spec = os.getenv('METRICS_BUCKETS')
+    return tuple(float(b) for b in spec.split(',')) if spec else DEFAULT_BUCKETS
+
+
+def observe(name, seconds, **labels):
+    """Add one observation to a histogram"""
+    key = (name, tuple(sorted(labels.items())))
+    bounds = buckets()
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * (len(bounds) + 1), 'sum': 0.0, 'count': 0}
+        histogram['buckets'][bisect_left(bounds, seconds)] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+    _ensure_snapshots()
+
+
+def current_stage():
+    """The stage being timed in this context (e.g. tag_api), or None"""
+    return _stage.get()
+
+
+def observe_stage(stage, seconds):
+    observe('senera_stage_duration_seconds', seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a block as one stage, whether it succeeds or raises"""
+    started = time.perf_counter()
+    token = _stage.set(stage)
+    try:
+        with span(stage):
+            yield
+    finally:
+        _stage.reset(token)
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def timed_stage(stage):
+    """Decorator timing every call of a function (sync or async) as one stage"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_collector(collector):
+    """Add a function returning [(name, type, help, labels, value, aggregate)] at scrape time
+
+    type is 'counter' or 'gauge'. aggregate is 'sum' to add the value up over
+    worker processes, or 'local' for values that are already shared between
+    processes (e.g. the rate limiter's SQLite buckets).
+    """
+    _collectors.append(collector)
+    return collector
+
+
+def _collect():
+    samples = []
+    for collector in _collectors:
+        try:
+            samples.extend(collector())
+        except Exception as e:
+            logger.warning("Metrics collector %s failed: %s", collector.__name__, e)
+    return samples
+
+
+def local_snapshot():
+    """This process's histograms and collected samples, as JSON-friendly data"""
+    with _lock:
+        histograms = [
+            {'name': name, 'labels': dict(labels), **{k: (list(v) if k == 'buckets' else v) for k, v in h.items()}}
+            for (name, labels), h in _histograms.items()
+        ]
+    samples = [
+        {'name': name, 'type': kind, 'help': help_text, 'labels': labels, 'value': value, 'aggregate': aggregate}
+        for name, kind, help_text, labels, value, aggregate in _collect()
+    ]
+    return {'pid': os.getpid(), 'written_at': time.time(), 'buckets': list(buckets()),
+            'histograms': histograms, 'samples': samples}
+
+
+def _metrics_dir():
+    return os.getenv('METRICS_DIR')
+
+
+def _snapshot_interval():
+    return float(os.getenv('METRICS_SNAPSHOT_INTERVAL', '5'))
+
+
+def write_snapshot():
+    directory = _metrics_dir()
+    if not directory:
+        return
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(local_snapshot(), f)
+    os.replace(temp_path, path)
+
+
+def _snapshot_loop():
+    while True:
+        time.sleep(_snapshot_interval())
+        try:
+            write_snapshot()
+        except Exception as e:
+            logger.warning("Could not write metrics snapshot: %s", e)
+
+
+def _ensure_snapshots():
+    """Start this process's snapshot writer (once per process, so also after a fork)"""
+    global _snapshot_thread, _snapshot_pid
+    if not _metrics_dir() or _snapshot_pid == os.getpid():
+        return
+    with _lock:
+        if _snapshot_pid == os.getpid():
+            return
+        os.makedirs(_metrics_dir(), exist_ok=True)
+        _snapshot_pid = os.getpid()
+        _snapshot_thread = threading.Thread(target=_snapshot_loop, name='senera-metrics', daemon=True)
+        _snapshot_thread.start()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _all_snapshots():
+    """Snapshots of every process: live data for this one, files for the others"""
+    snapshots = [local_snapshot()]
+    directory = _metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return snapshots
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json') or filename == f"{os.getpid()}.json":
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snapshot['alive'] = _process_alive(snapshot['pid'])
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """Prometheus text exposition of every process's metrics"""
+    snapshots = _all_snapshots()
+    local_pid = os.getpid()
+
+    histograms = {}  # name -> {labels tuple: {'buckets', 'sum', 'count', 'bounds'}}
+    families = {}  # name -> {'type', 'help', 'values': {labels tuple: value}}
+    for snapshot in snapshots:
+        for h in snapshot['histograms']:
+            labels = tuple(sorted(h['labels'].items()))
+            by_labels = histograms.setdefault(h['name'], {})
+            merged = by_labels.get(labels)
+            if merged is None:
+                merged = by_labels[labels] = {
+                    'bounds': snapshot['buckets'], 'buckets': [0] * len(h['buckets']), 'sum': 0.0, 'count': 0
+                }
+            elif merged['bounds'] != snapshot['buckets']:
+                continue  # METRICS_BUCKETS differs between processes; keep the first layout
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], h['buckets'])]
+            merged['sum'] += h['sum']
+            merged['count'] += h['count']
+
+        is_local = snapshot['pid'] == local_pid
+        for sample in snapshot['samples']:
+            if sample['aggregate'] == 'local' and not is_local:
+                continue
+            if sample['type'] == 'gauge' and not (is_local or snapshot.get('alive')):
+                continue
+            family = families.setdefault(sample['name'], {'type': sample['type'], 'help': sample['help'], 'values': {}})
+            labels = tuple(sorted(sample['labels'].items()))
+            if sample['aggregate'] == 'local':
+                family['values'][labels] = sample['value']
+            else:
+                family['values'][labels] = family['values'].get(labels, 0) + sample['value']
+            if isinstance(family['values'][labels], float):
+                family['values'][labels] = round(family['values'][labels], 6)
+
+    lines = []
+    for name in sorted(histograms):
+        lines.append(f"# HELP {name} {HISTOGRAM_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, h in sorted(histograms[name].items()):
+            labels = dict(labels)
+            cumulative = 0
+            for bound, count in zip(list(h['bounds']) + [float('inf')], h['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(round(h['sum'], 6))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {h['count']}")
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in sorted(family['values'].items()):
+            lines.append(f"{name}{_format_labels(dict(labels))} {_format_value(value)}")
+    lines.append("# HELP senera_metrics_processes Worker processes whose metrics are included")
+    lines.append("# TYPE senera_metrics_processes gauge")
+    lines.append(f"senera_metrics_processes {sum(1 for s in snapshots if s['pid'] == local_pid or s.get('alive'))}")
+    return '\n'.join(lines) + '\n'
+
+
+def _counter(name, help_text, value, **labels):
+    return (name, 'counter', help_text, labels, value, 'sum')
+
+
+def _gauge(name, help_text, value, aggregate='sum', **labels):
+    return (name, 'gauge', help_text, labels, value, aggregate)
+
+
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+@register_collector
+def service_metrics():
+    """Counters and gauges the services already keep, read at scrape time"""
+    from password_hasher import get_password_hasher_stats
+    from routes.auth_routes import get_user_cache_stats
+    from services.prompt_cache import get_cache_stats
+    from services.collage_service import get_tile_cache_stats
+    from services.http_client import get_http_metrics
+    from services.file_deleter import get_file_deleter_stats
+    from services.provider_router import get_provider_health
+    from services.rate_limiter import get_rate_limiter_stats
+    from services.logs import get_log_stats
+    from services.usage import get_usage_stats
+
+    samples = []
+    for cache, stats in (('prompt', get_cache_stats()), ('tile', get_tile_cache_stats()), ('user', get_user_cache_stats())):
+        samples.append(_counter('senera_cache_hits_total', 'Cache lookups answered from the cache', stats['hits'], cache=cache))
+        samples.append(_counter('senera_cache_misses_total', 'Cache lookups that had to compute the value', stats['misses'], cache=cache))
+        samples.append(_gauge('senera_cache_entries', 'Entries currently cached', stats['size'], cache=cache))
+    prompt_stats = get_cache_stats()
+    samples.append(_counter('senera_cache_coalesced_total', 'Lookups that waited for an identical in-flight computation',
+                            prompt_stats['coalesced'], cache='prompt'))
+
+    for endpoint, stats in get_http_metrics().items():
+        samples.append(_counter('senera_external_calls_total', 'Calls to external APIs', stats['calls'], endpoint=endpoint))
+        samples.append(_counter('senera_external_call_errors_total', 'External API calls that failed', stats['errors'], endpoint=endpoint))
+        samples.append(_counter('senera_external_call_retries_total', 'Retries of external API calls', stats['retries'], endpoint=endpoint))
+
+    limiter = get_rate_limiter_stats()
+    for priority, stats in limiter['priorities'].items():
+        samples.append(_counter('senera_rate_limit_acquired_total', 'OpenAI calls admitted by the rate limiter',
+                                stats['acquired'], priority=priority))
+        samples.append(_counter('senera_rate_limit_timeouts_total', 'OpenAI calls that gave up waiting for budget',
+                                stats['timeouts'], priority=priority))
+        samples.append(_counter('senera_rate_limit_wait_seconds_total', 'Time spent waiting for OpenAI budget',
+                                stats['total_wait'], priority=priority))
+    # Buckets and waiters live in the shared SQLite file, so every process sees the same values
+    for priority, count in limiter.get('queued', {}).items():
+        samples.append(_gauge('senera_rate_limit_queued', 'Calls waiting for OpenAI budget', count, 'local', priority=priority))
+    for bucket, stats in limiter.get('buckets', {}).items():
+        samples.append(_gauge('senera_rate_limit_available', 'Budget left in each OpenAI rate limit bucket',
+                              stats['available'], 'local', bucket=bucket))
+
+    for provider, health in get_provider_health().items():
+        samples.append(_counter('senera_image_provider_calls_total', 'Image generation calls per provider', health['calls'], provider=provider))
+        samples.append(_counter('senera_image_provider_failures_total', 'Failed image generation calls per provider',
+                                health['failures'], provider=provider))
+        samples.append(_gauge('senera_image_provider_breaker_state', 'Circuit breaker: 0 closed, 1 half open, 2 open',
+                              BREAKER_STATES.get(health['state'], 0), provider=provider))
+
+    hasher = get_password_hasher_stats()
+    for key in ('hashed', 'verified', 'rejected', 'rehashed'):
+        samples.append(_counter('senera_password_hashes_total', 'Password hashing pool calls', hasher[key], result=key))
+    samples.append(_gauge('senera_password_hash_pending', 'Hashes running or waiting in the pool', hasher['pending']))
+    samples.append(_gauge('senera_password_hash_workers', 'Password hashing worker processes', hasher['workers']))
+
+    deleter = get_file_deleter_stats()
+    for key in ('removed', 'missing', 'errors'):
+        samples.append(_counter('senera_file_deletions_total', 'Image files handled by the background deleter', deleter[key], result=key))
+    samples.append(_gauge('senera_file_deletions_pending', 'Image files waiting for the background deleter', deleter['pending']))
+
+    log_stats = get_log_stats()
+    samples.append(_counter('senera_log_records_dropped_total', 'Log records dropped because the log queue was full', log_stats['dropped']))
+    samples.append(_gauge('senera_log_records_queued', 'Log records waiting to be written', log_stats['queued']))
+
+    usage = get_usage_stats()
+    for key in ('recorded', 'written', 'dropped'):
+        samples.append(_counter('senera_usage_records_total', 'Usage records of external AI calls', usage[key], result=key))
+    samples.append(_gauge('senera_usage_records_pending', 'Usage records waiting to be written', usage['pending']))
+    return samples
+
+
+def init_metrics(app):
+    """Time every request and report the database connection pool of this app"""
+    from flask import g, request
+    from db import db
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        _ensure_snapshots()
+
+    @app.after_request
+    def record_request_time(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe('senera_request_duration_seconds', time.perf_counter() - started,
+                    endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+    @register_collector
+    def database_pool_metrics():
+        with app.app_context():
+            pool = db.engine.pool
+        if not hasattr(pool, 'checkedout'):
+            return []
+        return [
+            _gauge('senera_db_pool_checked_out', 'Database connections in use', pool.checkedout()),
+            _gauge('senera_db_pool_size', 'Database connections kept open by the pool', pool.size()),
+        ]
+
+
+def _write_final_snapshot():
+    # Keep this process's counters after it exits (e.g. a worker replaced on reload)
+    if _snapshot_pid == os.getpid():
+        write_snapshot()
+
+
+atexit.register(_write_final_snapshot)
@@ -0,0 +1,98 @@
+"""
+Outfit planning
+Generates outfits for several prompts (e.g. one per day of the week) in one
+request. The wardrobe is loaded once and every prompt is selected from it in
+memory. Analysis, collage and generation run concurrently up to a cap, and
+results are yielded as each prompt completes. Garments from the previous
+day's collage are avoided when there is an alternative.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services.collage_service import (
+    analyze_prompt_for_tags, load_wardrobe, rank_wardrobe_items, create_collage, save_collage,
+    make_collage_filename, describe_selected_items, generate_outfit_from_collage
+)
+from services.logs import get_logger, bind_request_context
+
+logger = get_logger('outfit_planner')
+
+
+def max_plan_prompts():
+    return int(os.getenv('OUTFIT_PLAN_MAX_PROMPTS', '14'))
+
+
+def plan_concurrency():
+    return int(os.getenv('OUTFIT_PLAN_CONCURRENCY', '3'))
+
+
+class OutfitPlanError(Exception):
+    """A single prompt of a plan failed; carries the HTTP-style status for the client"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+def plan_outfits(app, user_id, prompts, image_model='dalle', avoid_repeats=True):
+    """Yield (index, result, error) for each prompt, in completion order
+
+    Must be called inside an app context (the wardrobe is loaded up front).
+    Each prompt waits for the previous prompt's selection before selecting,
+    so consecutive days never share a garment unless a category has no
+    alternative. Everything else overlaps.
+    """
+    wardrobe = load_wardrobe(user_id)
+    logger.info("Planning %d outfits from %d wardrobe items", len(prompts), len(wardrobe))
+
+    selected_ids = [set() for _ in prompts]
+    selection_done = [threading.Event() for _ in prompts]
+
+    def run(index, user_prompt):
+        with app.app_context():
+            try:
+                target_tags = analyze_prompt_for_tags(user_prompt)
+
+                avoid_ids = set()
+                if avoid_repeats and index > 0:
+                    # Tasks start in submission order, so the previous day is never queued behind this one
+                    selection_done[index - 1].wait()
+                    avoid_ids = selected_ids[index - 1]
+                selected_items = rank_wardrobe_items(wardrobe, target_tags, avoid_ids=avoid_ids)
+                selected_ids[index] = {item.id for items in selected_items.values() for item in items}
+            finally:
+                selection_done[index].set()
+
+            item_count = sum(len(items) for items in selected_items.values())
+            if item_count == 0:
+                raise OutfitPlanError('No matching items found in your wardrobe for this prompt', 404)
+
+            collage_filename = make_collage_filename()
+            collage_path = save_collage(create_collage(selected_items), collage_filename)
+            outfit_image_url = generate_outfit_from_collage(collage_path, user_prompt, image_model)
+
+            return {
+                'index': index,
+                'prompt': user_prompt,
+                'collage_url': f"/uploads/{collage_filename}",
+                'outfit_image_url': outfit_image_url,
+                'target_tags': target_tags,
+                'selected_items': describe_selected_items(selected_items),
+                'message': f'Complete outfit generated with {item_count} items'
+            }
+
+    executor = ThreadPoolExecutor(max_workers=plan_concurrency(), thread_name_prefix='senera-plan')
+    try:
+        traced_run = bind_request_context(run)
+        futures = {executor.submit(traced_run, index, prompt): index for index, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield index, future.result(), None
+            except Exception as e:
+                logger.warning("Outfit plan prompt %d failed: %s", index, e)
+                yield index, None, e
+    finally:
+        # Stop queued prompts if the client went away; running ones finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
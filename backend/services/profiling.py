@@ -0,0 +1,403 @@
+"""
+Request profiling
+A sampling profiler for slow requests. While a profiled request runs, a
+background thread records the wall-clock stack of every thread working on it
+(the request thread and the pool threads it hands work to) each
+PROFILE_INTERVAL_MS. When the request took longer than PROFILE_THRESHOLD_MS,
+the stacks are written to PROFILE_DIR with the request's SQL statement count
+and a breakdown of its external API calls; faster requests are discarded.
+
+PROFILING=true profiles PROFILE_SAMPLE_RATE of requests. A request sent with
+the admin token in an X-Profile header is always profiled and kept. The
+settings can be changed at runtime through POST /admin/profiling, which every
+worker process picks up, and the dumps are read through GET /admin/profiles.
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from services.logs import get_logger, current_request_id, request_db_usage
+
+logger = get_logger('profiling')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_STACK_DEPTH = 100
+# Distinct stacks kept per request; later new stacks are counted as truncated
+MAX_STACKS = 5000
+
+_profile = contextvars.ContextVar('senera_profile', default=None)
+
+_lock = threading.Lock()
+# Thread ident -> (profile, thread name) for the threads currently working on a profiled request
+_threads = {}
+_wake = threading.Event()
+_sampler_pid = None
+_settings_cache = {'checked': 0.0, 'mtime': None, 'overrides': {}}
+_stats = {'profiled': 0, 'dumped': 0, 'dump_errors': 0}
+
+
+class RequestProfile:
+    """Stacks and external calls collected for one request"""
+
+    __slots__ = ('request_id', 'method', 'path', 'status', 'error', 'forced', 'started_at', 'started',
+                 'stacks', 'samples', 'truncated', 'calls')
+
+    def __init__(self, request_id, method, path, forced):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.status = None
+        self.error = None
+        self.forced = forced
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+        self.samples = 0
+        self.truncated = 0
+        self.calls = {}
+
+
+def profile_dir():
+    return os.getenv('PROFILE_DIR', 'profiles')
+
+
+def _settings_path():
+    return os.path.join(profile_dir(), 'settings.json')
+
+
+def _overrides():
+    # Re-read the runtime settings file at most once a second, and only when it changed
+    now = time.monotonic()
+    if now - _settings_cache['checked'] < 1:
+        return _settings_cache['overrides']
+    _settings_cache['checked'] = now
+    try:
+        mtime = os.path.getmtime(_settings_path())
+    except OSError:
+        _settings_cache.update(mtime=None, overrides={})
+        return {}
+    if mtime != _settings_cache['mtime']:
+        try:
+            with open(_settings_path()) as f:
+                _settings_cache.update(mtime=mtime, overrides=json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read profiling settings: %s", e)
+    return _settings_cache['overrides']
+
+
+def profiling_settings():
+    """Environment settings with the runtime overrides from POST /admin/profiling applied"""
+    settings = {
+        'enabled': os.getenv('PROFILING', 'false').lower() == 'true',
+        'sample_rate': float(os.getenv('PROFILE_SAMPLE_RATE', '1')),
+        'threshold_ms': float(os.getenv('PROFILE_THRESHOLD_MS', '5000')),
+        'interval_ms': float(os.getenv('PROFILE_INTERVAL_MS', '10')),
+    }
+    settings.update(_overrides())
+    return settings
+
+
+def update_profiling_settings(overrides):
+    """Persist runtime overrides for every worker; an empty dict goes back to the environment"""
+    unknown = set(overrides) - {'enabled', 'sample_rate', 'threshold_ms', 'interval_ms'}
+    if unknown:
+        raise ValueError(f"Unknown profiling settings: {', '.join(sorted(unknown))}")
+    if 'enabled' in overrides and not isinstance(overrides['enabled'], bool):
+        raise ValueError("enabled must be true or false")
+    for key in ('sample_rate', 'threshold_ms', 'interval_ms'):
+        if key in overrides and (isinstance(overrides[key], bool) or not isinstance(overrides[key], (int, float))
+                                 or overrides[key] < 0):
+            raise ValueError(f"{key} must be a non-negative number")
+    if overrides.get('interval_ms') == 0:
+        raise ValueError("interval_ms must be greater than 0")
+
+    os.makedirs(profile_dir(), exist_ok=True)
+    temp_path = f"{_settings_path()}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(overrides, f)
+    os.replace(temp_path, _settings_path())
+    _settings_cache['checked'] = 0.0
+    return profiling_settings()
+
+
+def admin_token_matches(value):
+    """Whether value is the PROFILE_ADMIN_TOKEN (never true when no token is set)"""
+    token = os.getenv('PROFILE_ADMIN_TOKEN')
+    return bool(token) and hmac.compare_digest((value or '').encode(), token.encode())
+
+
+def start_profile(method, path, profile_header=None, attach=True):
+    """Decide whether to profile the current request and start collecting its stacks
+
+    attach=False leaves the current thread out (an event loop thread is shared by
+    many requests); work handed to the thread pool is sampled either way.
+    """
+    forced = admin_token_matches(profile_header)
+    if not forced:
+        settings = profiling_settings()
+        if not settings['enabled'] or random.random() >= settings['sample_rate']:
+            return None
+    profile = RequestProfile(current_request_id(), method, path, forced)
+    _profile.set(profile)
+    _stats['profiled'] += 1
+    if attach:
+        _attach(profile)
+    return profile
+
+
+def set_profile_status(status):
+    profile = _profile.get()
+    if profile is not None:
+        profile.status = status
+
+
+def finish_profile(error=None):
+    """Stop sampling the current request and write its profile if it was slow; returns the file name or None"""
+    profile = _profile.get()
+    if profile is None:
+        return None
+    _profile.set(None)
+    _detach(threading.get_ident())
+
+    duration_ms = (time.perf_counter() - profile.started) * 1000
+    if error is not None:
+        profile.error = type(error).__name__
+    if not profile.forced and duration_ms < profiling_settings()['threshold_ms']:
+        return None
+    try:
+        return _write_profile(profile, duration_ms)
+    except OSError as e:
+        _stats['dump_errors'] += 1
+        logger.warning("Could not write profile of request %s: %s", profile.request_id, e)
+        return None
+
+
+@contextmanager
+def attached_thread():
+    """Sample the current thread for the profiled request of this context, if any"""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    ident = threading.get_ident()
+    _attach(profile)
+    try:
+        yield
+    finally:
+        _detach(ident)
+
+
+def record_external_call(endpoint, seconds, failed=False):
+    """Add an external API call (including its retries) to the current request's breakdown"""
+    profile = _profile.get()
+    if profile is None:
+        return
+    with _lock:
+        entry = profile.calls.setdefault(endpoint, {'calls': 0, 'seconds': 0.0, 'failures': 0})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        if failed:
+            entry['failures'] += 1
+
+
+def _attach(profile):
+    with _lock:
+        _threads[threading.get_ident()] = (profile, threading.current_thread().name)
+    _ensure_sampler()
+    _wake.set()
+
+
+def _detach(ident):
+    with _lock:
+        _threads.pop(ident, None)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(BACKEND_DIR):
+        filename = os.path.relpath(filename, BACKEND_DIR)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[-1]
+    else:
+        filename = os.path.basename(filename)
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({filename}:{frame.f_lineno})"
+
+
+def _fold(frame, thread_name):
+    """Folded stack (root first, frames separated by ;) of a thread's current frame"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ';'.join(reversed(labels))
+
+
+def _sample():
+    frames = sys._current_frames()
+    with _lock:
+        for ident, (profile, thread_name) in _threads.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = _fold(frame, thread_name)
+            profile.samples += 1
+            if stack in profile.stacks or len(profile.stacks) < MAX_STACKS:
+                profile.stacks[stack] += 1
+            else:
+                profile.truncated += 1
+    # Don't keep other threads' frames (and their locals) alive until the next sample
+    del frames
+
+
+def _sampler_loop():
+    while True:
+        with _lock:
+            idle = not _threads
+        if idle:
+            # Nothing to sample: sleep until a profiled request attaches a thread
+            _wake.wait()
+            _wake.clear()
+            continue
+        time.sleep(profiling_settings()['interval_ms'] / 1000)
+        _sample()
+
+
+def _ensure_sampler():
+    # One sampler per process: threads don't survive the fork into serve.py workers
+    global _sampler_pid
+    pid = os.getpid()
+    if _sampler_pid == pid:
+        return
+    with _lock:
+        if _sampler_pid != pid:
+            threading.Thread(target=_sampler_loop, name='senera-profiler', daemon=True).start()
+            _sampler_pid = pid
+
+
+def _write_profile(profile, duration_ms):
+    settings = profiling_settings()
+    db_statements, db_seconds = request_db_usage()
+    with _lock:
+        stacks = profile.stacks.most_common()
+        calls = {endpoint: dict(entry) for endpoint, entry in profile.calls.items()}
+    for entry in calls.values():
+        entry['ms'] = round(entry.pop('seconds') * 1000, 1)
+
+    # Request ids can come from a client's X-Request-ID header, so keep them to safe characters
+    request_id = ''.join(char for char in profile.request_id or '' if char.isalnum() or char in '-_')[:32]
+    profile_id = f"{profile.started_at:%Y%m%dT%H%M%S}-{os.getpid()}-{request_id or 'none'}"
+    document = {
+        'id': profile_id,
+        'request_id': profile.request_id,
+        'method': profile.method,
+        'path': profile.path,
+        'status': profile.status,
+        'error': profile.error,
+        'forced': profile.forced,
+        'started_at': profile.started_at.isoformat(timespec='milliseconds') + 'Z',
+        'duration_ms': round(duration_ms, 1),
+        'pid': os.getpid(),
+        'interval_ms': settings['interval_ms'],
+        'samples': profile.samples,
+        'truncated_samples': profile.truncated,
+        'db_statements': db_statements,
+        'db_ms': round(db_seconds * 1000, 1),
+        'external_calls': calls,
+        'external_ms': round(sum(entry['ms'] for entry in calls.values()), 1),
+        'stacks': [{'stack': stack, 'count': count} for stack, count in stacks],
+    }
+
+    os.makedirs(profile_dir(), exist_ok=True)
+    path = os.path.join(profile_dir(), f"profile-{profile_id}.json")
+    with open(path, 'w') as f:
+        json.dump(document, f)
+    _stats['dumped'] += 1
+    _prune()
+    logger.warning('request profiled', extra={'fields': {
+        'profile': profile_id, 'path': profile.path, 'duration_ms': document['duration_ms'],
+        'samples': profile.samples, 'db_statements': db_statements, 'external_ms': document['external_ms'],
+    }})
+    return os.path.basename(path)
+
+
+def _profile_files():
+    try:
+        names = [name for name in os.listdir(profile_dir()) if name.startswith('profile-') and name.endswith('.json')]
+    except OSError:
+        return []
+    # Names start with the request's start time, so this is oldest first
+    return sorted(names)
+
+
+def _prune():
+    keep = int(os.getenv('PROFILE_MAX_DUMPS', '100'))
+    for name in _profile_files()[:-keep or None]:
+        try:
+            os.remove(os.path.join(profile_dir(), name))
+        except OSError:
+            pass
+
+
+def list_profiles(limit=50):
+    """Summaries of the saved profiles, newest first"""
+    summaries = []
+    for name in reversed(_profile_files()[-limit:] if limit else []):
+        try:
+            with open(os.path.join(profile_dir(), name)) as f:
+                document = json.load(f)
+        except (OSError, ValueError):
+            continue
+        document.pop('stacks', None)
+        summaries.append(document)
+    return summaries
+
+
+def load_profile(profile_id):
+    """A saved profile by id, or None"""
+    if not profile_id or not all(char.isalnum() or char in '-_' for char in profile_id):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), f"profile-{profile_id}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def folded_stacks(document):
+    """A profile's stacks in the folded format read by flamegraph.pl and speedscope"""
+    return ''.join(f"{entry['stack']} {entry['count']}\n" for entry in document['stacks'])
+
+
+def get_profiling_stats():
+    with _lock:
+        active = len(_threads)
+    return {**_stats, 'sampled_threads': active}
+
+
+def init_profiling(app):
+    """Profile this Flask app's requests; call after init_request_logging so requests have an id"""
+    from flask import request
+
+    @app.before_request
+    def start_request_profile():
+        start_profile(request.method, request.path, request.headers.get('X-Profile'))
+
+    @app.after_request
+    def record_profile_status(response):
+        set_profile_status(response.status_code)
+        return response
+
+    # Like the request trace, a streamed response is profiled until the stream ends
+    @app.teardown_request
+    def finish_request_profile(exc):
+        finish_profile(exc)
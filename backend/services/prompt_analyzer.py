@@ -0,0 +1,293 @@
+"""
+Local rule-based prompt analyzer
+Maps short, keyword-style outfit prompts onto the fixed tag vocabulary without
+calling GPT-4o. Ambiguous prompts are left to the LLM.
+"""
+
+import os
+import re
+import random
+import threading
+from collections import deque
+
+# Fixed vocabulary, identical to the values GPT-4o is allowed to return
+VOCABULARY = {
+    'type_categories': ['top', 'bottom', 'footwear', 'accessory', 'outerwear', 'headwear'],
+    'styles': ['casual', 'formal', 'sporty', 'business', 'streetwear', 'vintage', 'bohemian', 'chic',
+               'preppy', 'edgy', 'classic', 'minimalistic', 'elegant', 'punk', 'hip-hop', 'athleisure'],
+    'colors': ['red', 'blue', 'black', 'white', 'gray', 'green', 'yellow', 'orange', 'purple', 'pink',
+               'brown', 'beige', 'navy', 'teal', 'maroon', 'olive', 'gold', 'silver'],
+    'occasions': ['work', 'party', 'outdoor', 'travel', 'casual', 'formal', 'date', 'gym', 'beach',
+                  'festival', 'wedding', 'holiday'],
+    'seasons': ['summer', 'winter', 'spring', 'fall', 'all-season'],
+}
+
+# Categories picked when the prompt does not mention specific garments
+DEFAULT_TYPE_CATEGORIES = ['top', 'bottom', 'footwear']
+
+# Synonyms and phrases mapped onto vocabulary values
+SYNONYMS = {
+    # Styles
+    'sport': [('styles', 'sporty')], 'sports': [('styles', 'sporty')], 'athletic': [('styles', 'sporty')],
+    'street': [('styles', 'streetwear')], 'street style': [('styles', 'streetwear')],
+    'boho': [('styles', 'bohemian')], 'retro': [('styles', 'vintage')],
+    'minimal': [('styles', 'minimalistic')], 'minimalist': [('styles', 'minimalistic')],
+    'classy': [('styles', 'elegant')], 'fancy': [('styles', 'elegant')], 'smart': [('styles', 'classic')],
+    'hiphop': [('styles', 'hip-hop')], 'hip hop': [('styles', 'hip-hop')],
+    'relaxed': [('styles', 'casual')], 'comfy': [('styles', 'casual')], 'comfortable': [('styles', 'casual')],
+    'smart casual': [('styles', 'casual'), ('styles', 'classic')],
+    'business casual': [('styles', 'business'), ('styles', 'casual'), ('occasions', 'work')],
+    # Occasions
+    'office': [('occasions', 'work'), ('styles', 'business')],
+    'interview': [('occasions', 'work'), ('styles', 'business'), ('styles', 'formal')],
+    'meeting': [('occasions', 'work'), ('styles', 'business')],
+    'workout': [('occasions', 'gym'), ('styles', 'sporty')],
+    'training': [('occasions', 'gym'), ('styles', 'sporty')],
+    'running': [('occasions', 'gym'), ('styles', 'sporty')],
+    'yoga': [('occasions', 'gym'), ('styles', 'athleisure')],
+    'hiking': [('occasions', 'outdoor'), ('styles', 'sporty')],
+    'picnic': [('occasions', 'outdoor'), ('styles', 'casual')],
+    'camping': [('occasions', 'outdoor')],
+    'vacation': [('occasions', 'holiday'), ('occasions', 'travel')],
+    'trip': [('occasions', 'travel')], 'airport': [('occasions', 'travel')], 'flight': [('occasions', 'travel')],
+    'date night': [('occasions', 'date')], 'dinner date': [('occasions', 'date')],
+    'night out': [('occasions', 'party')], 'club': [('occasions', 'party')], 'clubbing': [('occasions', 'party')],
+    'birthday': [('occasions', 'party')], 'cocktail': [('occasions', 'party'), ('styles', 'elegant')],
+    'concert': [('occasions', 'festival')], 'gala': [('occasions', 'formal'), ('styles', 'elegant')],
+    'wedding guest': [('occasions', 'wedding'), ('styles', 'elegant')],
+    'christmas': [('occasions', 'holiday'), ('seasons', 'winter')],
+    'coffee': [('occasions', 'casual')], 'brunch': [('occasions', 'casual')], 'errands': [('occasions', 'casual')],
+    # Colours
+    'grey': [('colors', 'gray')], 'navy blue': [('colors', 'navy')], 'golden': [('colors', 'gold')],
+    'burgundy': [('colors', 'maroon')], 'tan': [('colors', 'beige')], 'cream': [('colors', 'beige')],
+    # Seasons
+    'autumn': [('seasons', 'fall')], 'summery': [('seasons', 'summer')], 'hot': [('seasons', 'summer')],
+    'warm': [('seasons', 'summer')], 'cold': [('seasons', 'winter')], 'chilly': [('seasons', 'fall')],
+    'snow': [('seasons', 'winter')], 'snowy': [('seasons', 'winter')], 'all season': [('seasons', 'all-season')],
+    # Garments that pull in an extra type category
+    'jacket': [('type_categories', 'outerwear')], 'coat': [('type_categories', 'outerwear')],
+    'blazer': [('type_categories', 'outerwear')], 'hat': [('type_categories', 'headwear')],
+    'cap': [('type_categories', 'headwear')], 'beanie': [('type_categories', 'headwear')],
+    'scarf': [('type_categories', 'accessory')], 'belt': [('type_categories', 'accessory')],
+    'bag': [('type_categories', 'accessory')], 'jewelry': [('type_categories', 'accessory')],
+    'accessories': [('type_categories', 'accessory')],
+    'shirt': [('type_categories', 'top')], 't-shirt': [('type_categories', 'top')],
+    'tee': [('type_categories', 'top')], 'blouse': [('type_categories', 'top')],
+    'sweater': [('type_categories', 'top')], 'jeans': [('type_categories', 'bottom')],
+    'pants': [('type_categories', 'bottom')], 'trousers': [('type_categories', 'bottom')],
+    'skirt': [('type_categories', 'bottom')], 'shorts': [('type_categories', 'bottom')],
+    'shoes': [('type_categories', 'footwear')], 'sneakers': [('type_categories', 'footwear')],
+    'boots': [('type_categories', 'footwear')], 'sandals': [('type_categories', 'footwear')],
+    'heels': [('type_categories', 'footwear')],
+}
+
+# Words that carry no tag information in an outfit request
+STOPWORDS = {
+    'a', 'an', 'the', 'for', 'to', 'in', 'on', 'at', 'of', 'and', 'with', 'my', 'me', 'i', 'some',
+    'outfit', 'outfits', 'look', 'looks', 'style', 'styled', 'wear', 'wearing', 'clothes', 'clothing',
+    'something', 'need', 'want', 'idea', 'ideas', 'day', 'please', 'today', 'tomorrow', 'weekend',
+    'this', 'that', 'go', 'going', 'vibe', 'vibes', 'fit',
+}
+
+# Words that change meaning in ways a keyword matcher cannot handle
+NEGATIONS = {'no', 'not', 'without', 'except', 'avoid', 'but', 'dont', "don't", 'never'}
+
+# Seasons that usually call for an extra layer
+LAYERING_SEASONS = {'winter', 'fall'}
+
+# Longest synonym phrase, in words
+MAX_PHRASE_WORDS = max(len(phrase.split()) for phrase in SYNONYMS)
+
+_TOKEN_PATTERN = re.compile(r"[a-z]+(?:[-'][a-z]+)*")
+
+_stats_lock = threading.Lock()
+_stats = {
+    'total': 0,
+    'local_hits': 0,
+    'llm_calls': 0,
+    'shadow_samples': 0,
+    'compared': 0,
+    'agreement_sum': 0.0,
+    'category_agreement_sum': {category: 0.0 for category in VOCABULARY},
+}
+_recent_disagreements = deque(maxlen=20)
+
+
+def _build_lookup():
+    """Index every vocabulary value and synonym phrase by its normalized text"""
+    lookup = {}
+    for category, values in VOCABULARY.items():
+        for value in values:
+            lookup.setdefault(value, []).append((category, value))
+            if '-' in value:
+                lookup.setdefault(value.replace('-', ' '), []).append((category, value))
+    for phrase, targets in SYNONYMS.items():
+        entries = lookup.setdefault(phrase, [])
+        entries.extend(target for target in targets if target not in entries)
+    return lookup
+
+
+_LOOKUP = _build_lookup()
+
+
+def normalize_prompt(user_prompt):
+    """Lowercase and tokenize a prompt, returning the list of word tokens"""
+    return _TOKEN_PATTERN.findall((user_prompt or '').lower())
+
+
+def _singular(token):
+    """Very small plural stripper (jackets -> jacket, hats -> hat)"""
+    if token.endswith('es') and token[:-2] in _LOOKUP:
+        return token[:-2]
+    if token.endswith('s') and token[:-1] in _LOOKUP:
+        return token[:-1]
+    return token
+
+
+def analyze_prompt_locally(user_prompt):
+    """Match a prompt against the tag vocabulary
+
+    Returns (tags, confidence). Confidence is the share of meaningful tokens
+    that were recognized, or 0.0 when the prompt contains negations or no
+    known tag at all.
+    """
+    tokens = normalize_prompt(user_prompt)
+    tags = {category: [] for category in VOCABULARY}
+
+    if not tokens or any(token in NEGATIONS for token in tokens):
+        return tags, 0.0
+
+    meaningful = 0
+    recognized = 0
+    matched_any = False
+    i = 0
+    while i < len(tokens):
+        # Prefer the longest phrase starting at this token
+        match = None
+        for width in range(min(MAX_PHRASE_WORDS, len(tokens) - i), 0, -1):
+            phrase = ' '.join(tokens[i:i + width])
+            if width == 1:
+                phrase = _singular(phrase)
+            if phrase in _LOOKUP:
+                match = (phrase, width)
+                break
+
+        if match:
+            phrase, width = match
+            for category, value in _LOOKUP[phrase]:
+                if value not in tags[category]:
+                    tags[category].append(value)
+            meaningful += width
+            recognized += width
+            matched_any = True
+            i += width
+            continue
+
+        if tokens[i] not in STOPWORDS:
+            meaningful += 1
+        i += 1
+
+    if not matched_any:
+        return tags, 0.0
+
+    # Garment words add to, rather than replace, the default outfit categories
+    type_categories = list(DEFAULT_TYPE_CATEGORIES)
+    if LAYERING_SEASONS.intersection(tags['seasons']):
+        type_categories.append('outerwear')
+    for category in tags['type_categories']:
+        if category not in type_categories:
+            type_categories.append(category)
+    tags['type_categories'] = type_categories
+
+    confidence = recognized / meaningful if meaningful else 0.0
+    return tags, confidence
+
+
+def is_confident(user_prompt, confidence):
+    """Decide whether a local analysis is good enough to skip the LLM"""
+    threshold = float(os.getenv('PROMPT_ANALYZER_MIN_CONFIDENCE', '1.0'))
+    max_words = int(os.getenv('PROMPT_ANALYZER_MAX_WORDS', '8'))
+    return confidence >= threshold and len(normalize_prompt(user_prompt)) <= max_words
+
+
+def local_analyzer_enabled():
+    """The fast path can be switched off with LOCAL_PROMPT_ANALYZER=false"""
+    return os.getenv('LOCAL_PROMPT_ANALYZER', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+
+def should_shadow_sample():
+    """Sample a share of confident prompts to also go to the LLM for agreement tracking"""
+    rate = float(os.getenv('PROMPT_ANALYZER_SHADOW_RATE', '0.0'))
+    return rate > 0 and random.random() < rate
+
+
+def _tag_agreement(local_tags, llm_tags):
+    """Per-category Jaccard similarity between two analyses"""
+    agreement = {}
+    for category in VOCABULARY:
+        local_values = set(local_tags.get(category) or [])
+        llm_values = set(llm_tags.get(category) or [])
+        if not local_values and not llm_values:
+            agreement[category] = 1.0
+        else:
+            agreement[category] = len(local_values & llm_values) / len(local_values | llm_values)
+    return agreement
+
+
+def record_local_hit():
+    """Count a prompt answered by the local analyzer"""
+    with _stats_lock:
+        _stats['total'] += 1
+        _stats['local_hits'] += 1
+
+
+def record_llm_call(local_tags, llm_tags, shadow=False):
+    """Count a prompt sent to the LLM and compare its answer with the local one"""
+    agreement = _tag_agreement(local_tags, llm_tags) if isinstance(llm_tags, dict) else None
+    with _stats_lock:
+        _stats['total'] += 1
+        _stats['llm_calls'] += 1
+        if shadow:
+            _stats['shadow_samples'] += 1
+        if agreement is None:
+            return
+        overall = sum(agreement.values()) / len(agreement)
+        _stats['compared'] += 1
+        _stats['agreement_sum'] += overall
+        for category, value in agreement.items():
+            _stats['category_agreement_sum'][category] += value
+        if overall < 1.0:
+            # Only the extracted tags: the report is shared across users, prompts are theirs
+            _recent_disagreements.append({
+                'local': local_tags,
+                'llm': llm_tags,
+                'agreement': round(overall, 3),
+            })
+
+
+def get_analyzer_report():
+    """Hit rate of the local fast path and its agreement with the LLM"""
+    with _stats_lock:
+        total = _stats['total']
+        compared = _stats['compared']
+        return {
+            'total_prompts': total,
+            'local_hits': _stats['local_hits'],
+            'llm_calls': _stats['llm_calls'],
+            'shadow_samples': _stats['shadow_samples'],
+            'hit_rate': round(_stats['local_hits'] / total, 3) if total else 0.0,
+            'compared_with_llm': compared,
+            'agreement': round(_stats['agreement_sum'] / compared, 3) if compared else None,
+            'category_agreement': {
+                category: round(value / compared, 3) if compared else None
+                for category, value in _stats['category_agreement_sum'].items()
+            },
+            'recent_disagreements': list(_recent_disagreements),
+        }
+
+
+if __name__ == "__main__":
+    import sys
+    for prompt in sys.argv[1:] or ["casual summer outfit", "office look in navy", "something for my cousin's wedding"]:
+        tags, confidence = analyze_prompt_locally(prompt)
+        print(f"{prompt!r}: confidence={confidence:.2f} fast_path={is_confident(prompt, confidence)} tags={tags}")
@@ -0,0 +1,206 @@
+"""
+Prompt analysis cache
+Caches normalized prompt -> target tags for all users, coalesces concurrent
+identical lookups into one GPT-4o call, and issues signed analysis handles
+that let the generate endpoints skip analysis entirely.
+"""
+
+import os
+import copy
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # key -> (tags, expires_at)
+_in_flight = {}         # key -> _InFlight
+_async_in_flight = {}   # (event loop, key) -> asyncio.Future
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+
+class _InFlight:
+    """A single pending analysis that concurrent callers wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _ttl():
+    return int(os.getenv('PROMPT_CACHE_TTL', '3600'))
+
+
+def _max_entries():
+    return int(os.getenv('PROMPT_CACHE_MAX_ENTRIES', '1024'))
+
+
+class Uncacheable(dict):
+    """Tags returned to the callers waiting on them but never cached, e.g. a fallback
+    for an answer that couldn't be parsed"""
+
+
+def cache_key(user_prompt):
+    """Normalize a prompt so that case, spacing and trailing punctuation don't matter
+
+    Digits, signs and non-Latin scripts are kept: "5°C" and "30°C" are different
+    prompts, and so are any two Chinese ones.
+    """
+    words = (word.rstrip('.,!?;:') for word in (user_prompt or '').casefold().split())
+    return ' '.join(word for word in words if word)
+
+
+def _store(key, tags):
+    """Insert a result, evicting the least recently used entries when full"""
+    with _lock:
+        _cache[key] = (tags, time.monotonic() + _ttl())
+        _cache.move_to_end(key)
+        while len(_cache) > _max_entries():
+            _cache.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def _lookup(key):
+    """Return (True, tags) for a fresh cache entry; caller must hold _lock"""
+    entry = _cache.get(key)
+    if entry and entry[1] > time.monotonic():
+        _cache.move_to_end(key)
+        _stats['hits'] += 1
+        return True, entry[0]
+    if entry:
+        del _cache[key]
+    return False, None
+
+
+def get_or_compute(user_prompt, compute, on_miss=None):
+    """Return cached tags for a prompt, or compute them once for all concurrent callers
+
+    on_miss, if given, is called when the tags aren't cached, before waiting
+    for them to be computed.
+    """
+    key = cache_key(user_prompt)
+
+    with _lock:
+        found, tags = _lookup(key)
+        if found:
+            return copy.deepcopy(tags)
+
+        flight = _in_flight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _InFlight()
+            _in_flight[key] = flight
+            _stats['misses'] += 1
+        else:
+            _stats['coalesced'] += 1
+
+    if on_miss is not None:
+        on_miss()
+
+    if not leader:
+        # Someone else is already asking GPT-4o about this prompt
+        flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.result)
+
+    try:
+        result = compute(user_prompt)
+        flight.result = result
+        if not isinstance(result, Uncacheable):
+            _store(key, result)
+        return copy.deepcopy(result)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            _in_flight.pop(key, None)
+        flight.event.set()
+
+
+async def get_or_compute_async(user_prompt, compute, on_miss=None):
+    """Async version of get_or_compute; compute is a coroutine function"""
+    key = cache_key(user_prompt)
+    flight_key = (asyncio.get_running_loop(), key)
+
+    with _lock:
+        found, tags = _lookup(key)
+        if found:
+            return copy.deepcopy(tags)
+
+        future = _async_in_flight.get(flight_key)
+        leader = future is None
+        if leader:
+            future = asyncio.get_running_loop().create_future()
+            _async_in_flight[flight_key] = future
+            _stats['misses'] += 1
+        else:
+            _stats['coalesced'] += 1
+
+    if on_miss is not None:
+        on_miss()
+
+    if not leader:
+        return copy.deepcopy(await asyncio.shield(future))
+
+    try:
+        result = await compute(user_prompt)
+        if not isinstance(result, Uncacheable):
+            _store(key, result)
+        future.set_result(result)
+        return copy.deepcopy(result)
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when nobody else is waiting
+        raise
+    finally:
+        with _lock:
+            _async_in_flight.pop(flight_key, None)
+
+
+def clear_prompt_cache():
+    """Drop every cached analysis"""
+    with _lock:
+        _cache.clear()
+
+
+def get_cache_stats():
+    """Cache hit/miss counters and current size"""
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses'] + _stats['coalesced']
+        return {
+            **_stats,
+            'size': len(_cache),
+            'in_flight': len(_in_flight) + len(_async_in_flight),
+            'hit_rate': round((_stats['hits'] + _stats['coalesced']) / lookups, 3) if lookups else 0.0,
+        }
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='prompt-analysis')
+
+
+def create_analysis_handle(user_prompt, tags):
+    """Sign an analysis so a later request can reuse it without re-analysing"""
+    return _serializer().dumps({'key': cache_key(user_prompt), 'tags': tags})
+
+
+def resolve_analysis_handle(analysis_id, user_prompt):
+    """Return the tags behind a handle, or None if it is invalid, expired or for another prompt"""
+    if not analysis_id:
+        return None
+    try:
+        data = _serializer().loads(analysis_id, max_age=_ttl())
+    except BadSignature:
+        return None
+    if not isinstance(data, dict) or data.get('key') != cache_key(user_prompt):
+        return None
+    tags = data.get('tags')
+    return tags if isinstance(tags, dict) else None
@@ -0,0 +1,417 @@
+"""
+Image provider routing
+Tracks an EWMA of latency and error rate per image-generation provider, opens
+a circuit breaker on providers that keep failing, and routes each request to
+the requested provider with health-ranked fallbacks. When a provider is slow
+compared to its usual latency, the next one can be started in parallel (a
+hedged request, opt-in with PROVIDER_HEDGING); the first success wins and the
+others are cancelled. A free provider is never hedged into a paid one, since
+the paid call may not be stoppable once it has started.
+
+Providers are plain callables `generate(clothing_description, user_prompt)`
+returning an image URL, or None / raising on failure. Local stand-ins with a
+configurable latency and failure rate can replace any provider for offline
+testing (IMAGE_PROVIDER_STAND_INS).
+"""
+
+import os
+import io
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image, ImageDraw
+from services.logs import get_logger, bind_request_context
+
+logger = get_logger('provider_router')
+
+_providers = {}  # name -> (generate, generate_async or None)
+_providers_lock = threading.Lock()
+_builtins_loaded = False
+
+_health = {}     # name -> ProviderHealth
+_health_lock = threading.RLock()
+
+_executor = None
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+def hedging_enabled():
+    return os.getenv('PROVIDER_HEDGING', 'false').lower() not in ('0', 'false', 'no', 'off')
+
+
+def paid_providers():
+    return {name.strip() for name in os.getenv('PAID_IMAGE_PROVIDERS', 'dalle,replicate').split(',') if name.strip()}
+
+
+def may_hedge(running, candidate):
+    """Whether a slow call to `running` may be hedged with `candidate`"""
+    if not hedging_enabled():
+        return False
+    paid = paid_providers()
+    return candidate not in paid or running in paid
+
+
+class ProviderHealth:
+    """EWMA latency/error rate and circuit breaker state of one provider"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = None        # EWMA of successful call latency in seconds
+        self.error_rate = 0.0      # EWMA of failures (1) vs successes (0)
+        self.calls = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.consecutive_failures = 0
+        self.opened_until = None   # breaker is open until this monotonic time
+
+    def state(self, now=None):
+        if self.opened_until is None:
+            return 'closed'
+        now = time.monotonic() if now is None else now
+        # Once the cooldown is over, the next call is a trial that closes or re-opens the breaker
+        return 'open' if now < self.opened_until else 'half_open'
+
+    def record(self, latency, success):
+        alpha = _env_float('PROVIDER_EWMA_ALPHA', 0.2)
+        self.calls += 1
+        self.error_rate = alpha * (0.0 if success else 1.0) + (1 - alpha) * self.error_rate
+        if success:
+            self.latency = latency if self.latency is None else alpha * latency + (1 - alpha) * self.latency
+            self.consecutive_failures = 0
+            self.opened_until = None
+            return
+
+        self.failures += 1
+        self.consecutive_failures += 1
+        half_open = self.state() == 'half_open'
+        too_many_failures = self.consecutive_failures >= int(os.getenv('PROVIDER_BREAKER_FAILURES', '3'))
+        error_rate_high = self.calls >= 5 and self.error_rate >= _env_float('PROVIDER_BREAKER_ERROR_RATE', 0.5)
+        if half_open or too_many_failures or error_rate_high:
+            if self.opened_until is None or half_open:
+                logger.warning("Circuit breaker opened for image provider %s", self.name)
+            self.opened_until = time.monotonic() + _env_float('PROVIDER_BREAKER_COOLDOWN', 30)
+
+    def hedge_delay(self):
+        """Seconds to wait on this provider before starting the next one, None if unknown"""
+        fixed = os.getenv('PROVIDER_HEDGE_DELAY')
+        if fixed:
+            return float(fixed)
+        if self.latency is None:
+            # No idea yet what "slow" means for this provider, so only fail over
+            return None
+        return max(_env_float('PROVIDER_HEDGE_MIN_DELAY', 5.0),
+                   _env_float('PROVIDER_HEDGE_FACTOR', 2.0) * self.latency)
+
+    def report(self):
+        hedge_delay = self.hedge_delay()
+        return {
+            'state': self.state(),
+            'ewma_latency': round(self.latency, 4) if self.latency is not None else None,
+            'ewma_error_rate': round(self.error_rate, 4),
+            'calls': self.calls,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'consecutive_failures': self.consecutive_failures,
+            'hedge_delay': round(hedge_delay, 4) if hedge_delay is not None else None,
+        }
+
+
+class StandInProvider:
+    """Local image provider with a configurable latency and failure rate, for offline testing"""
+
+    def __init__(self, name, latency=1.0, failure_rate=0.0):
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.image_url = None
+
+    def _delay(self):
+        # +/- 25% jitter so hedging and EWMA behave as with a real service
+        return self.latency * random.uniform(0.75, 1.25)
+
+    def _result(self):
+        if random.random() < self.failure_rate:
+            raise Exception(f"Stand-in provider {self.name} failed")
+        if self.image_url is None:
+            from services.collage_service import save_generated_image
+
+            image = Image.new('RGB', (256, 256), (248, 248, 248))
+            ImageDraw.Draw(image).text((20, 120), f"stand-in: {self.name}", fill=(60, 60, 60))
+            buffer = io.BytesIO()
+            image.save(buffer, 'PNG')
+            self.image_url = save_generated_image(buffer.getvalue(), prefix=f"standin_{self.name}")
+        return self.image_url
+
+    def __call__(self, clothing_description, user_prompt):
+        time.sleep(self._delay())
+        return self._result()
+
+    async def generate_async(self, clothing_description, user_prompt):
+        await asyncio.sleep(self._delay())
+        return self._result()
+
+
+def register_provider(name, generate, generate_async=None):
+    """Add or replace an image provider; generate_async is an optional coroutine function"""
+    with _providers_lock:
+        _providers[name] = (generate, generate_async)
+
+
+def parse_stand_ins(spec):
+    """Parse IMAGE_PROVIDER_STAND_INS, e.g. "dalle:1.5,huggingface:6:0.3" (name:latency:failure rate)"""
+    stand_ins = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, *values = entry.split(':')
+        latency = float(values[0]) if len(values) > 0 else 1.0
+        failure_rate = float(values[1]) if len(values) > 1 else 0.0
+        stand_ins.append(StandInProvider(name, latency, failure_rate))
+    return stand_ins
+
+
+def _load_builtin_providers():
+    """Register the real providers, then any configured stand-ins over them"""
+    global _builtins_loaded
+    if _builtins_loaded:
+        return
+    from services.collage_service import (
+        generate_outfit_with_dalle, generate_outfit_with_huggingface, generate_outfit_with_replicate,
+        generate_outfit_with_pollinations
+    )
+    from services.async_outfit_service import (
+        generate_outfit_with_dalle_async, generate_outfit_with_huggingface_async,
+        generate_outfit_with_replicate_async
+    )
+
+    with _providers_lock:
+        if _builtins_loaded:
+            return
+        builtins = {
+            'dalle': (generate_outfit_with_dalle, generate_outfit_with_dalle_async),
+            'huggingface': (generate_outfit_with_huggingface, generate_outfit_with_huggingface_async),
+            'replicate': (generate_outfit_with_replicate, generate_outfit_with_replicate_async),
+            'pollinations': (generate_outfit_with_pollinations, None),
+        }
+        for name, provider in builtins.items():
+            # Providers registered explicitly (e.g. by a test harness) take precedence
+            _providers.setdefault(name, provider)
+        for stand_in in parse_stand_ins(os.getenv('IMAGE_PROVIDER_STAND_INS', '')):
+            _providers[stand_in.name] = (stand_in, stand_in.generate_async)
+        _builtins_loaded = True
+
+
+def get_health(name):
+    with _health_lock:
+        health = _health.get(name)
+        if health is None:
+            health = _health[name] = ProviderHealth(name)
+        return health
+
+
+def _record(name, latency, success):
+    health = get_health(name)
+    with _health_lock:
+        health.record(latency, success)
+
+
+def _record_cancelled(name):
+    health = get_health(name)
+    with _health_lock:
+        health.cancelled += 1
+
+
+def plan_route(preferred):
+    """Providers to try in order: the requested one, then healthy fallbacks ranked by EWMA"""
+    _load_builtin_providers()
+    preferred = preferred.lower()
+    fallbacks = [name.strip() for name in os.getenv('IMAGE_PROVIDER_FALLBACKS', 'dalle').split(',') if name.strip()]
+    names = [name for name in [preferred] + fallbacks if name in _providers]
+    names = list(dict.fromkeys(names))
+
+    now = time.monotonic()
+    with _health_lock:
+        healthy = [name for name in names if get_health(name).state(now) != 'open']
+
+        def expected_cost(name):
+            health = _health[name]
+            # Unmeasured providers rank first so they get measured
+            return (health.latency or 0.0) * (1 + 4 * health.error_rate)
+
+        if preferred in healthy:
+            route = [preferred] + sorted((n for n in healthy if n != preferred), key=expected_cost)
+        else:
+            route = sorted(healthy, key=expected_cost)
+
+    # Every breaker is open: still try rather than failing without a call
+    return route or names
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('PROVIDER_WORKERS', '8')),
+            thread_name_prefix='senera-provider'
+        )
+    return _executor
+
+
+def _call_provider(name, clothing_description, user_prompt):
+    """Run one provider and record its latency and outcome"""
+    generate = _providers[name][0]
+    started = time.perf_counter()
+    try:
+        result = generate(clothing_description, user_prompt)
+    except Exception:
+        _record(name, time.perf_counter() - started, False)
+        raise
+    _record(name, time.perf_counter() - started, bool(result))
+    if not result:
+        raise Exception(f"{name} returned no image")
+    return result
+
+
+def generate_image(clothing_description, user_prompt, preferred="dalle"):
+    """Generate the outfit image, failing over and hedging across providers
+
+    Losing calls are cancelled if they have not started. A call already
+    running in a worker thread can't be interrupted; its result is ignored
+    but still counted towards the provider's health.
+    """
+    route = plan_route(preferred)
+    logger.debug("Image provider route: %s", route)
+    executor = _get_executor()
+    pending = {}  # future -> provider name
+    next_index = 0
+    hedge_at = None
+    last_error = None
+
+    def launch():
+        nonlocal next_index, hedge_at
+        name = route[next_index]
+        next_index += 1
+        logger.info("Using %s for image generation", name)
+        pending[executor.submit(bind_request_context(_call_provider), name, clothing_description, user_prompt)] = name
+        can_hedge = next_index < len(route) and may_hedge(name, route[next_index])
+        delay = get_health(name).hedge_delay() if can_hedge else None
+        hedge_at = time.monotonic() + delay if delay is not None else None
+
+    launch()
+    while pending:
+        timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            logger.info("%s is slow, hedging with %s", pending[next(iter(pending))], route[next_index])
+            launch()
+            continue
+
+        results = []
+        for future in done:
+            name = pending.pop(future)
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.warning("%s failed: %s", name, e)
+                last_error = e
+        if results:
+            for other, other_name in pending.items():
+                if other.cancel():
+                    _record_cancelled(other_name)
+            return results[0]
+
+        if next_index < len(route):
+            launch()
+
+    raise last_error or Exception("No image provider available")
+
+
+async def _call_provider_async(name, clothing_description, user_prompt):
+    """Async _call_provider; providers without an async version run in the blocking pool"""
+    from services.async_outfit_service import run_blocking
+
+    generate, generate_async = _providers[name]
+    started = time.perf_counter()
+    try:
+        if generate_async is not None:
+            result = await generate_async(clothing_description, user_prompt)
+        else:
+            result = await run_blocking(generate, clothing_description, user_prompt)
+    except asyncio.CancelledError:
+        _record_cancelled(name)
+        raise
+    except Exception:
+        _record(name, time.perf_counter() - started, False)
+        raise
+    _record(name, time.perf_counter() - started, bool(result))
+    if not result:
+        raise Exception(f"{name} returned no image")
+    return result
+
+
+async def generate_image_async(clothing_description, user_prompt, preferred="dalle"):
+    """Async generate_image; losing requests are cancelled mid-flight"""
+    route = plan_route(preferred)
+    logger.debug("Image provider route: %s", route)
+    pending = {}  # task -> provider name
+    next_index = 0
+    hedge_at = None
+    last_error = None
+
+    def launch():
+        nonlocal next_index, hedge_at
+        name = route[next_index]
+        next_index += 1
+        logger.info("Using %s for image generation", name)
+        task = asyncio.ensure_future(_call_provider_async(name, clothing_description, user_prompt))
+        pending[task] = name
+        can_hedge = next_index < len(route) and may_hedge(name, route[next_index])
+        delay = get_health(name).hedge_delay() if can_hedge else None
+        hedge_at = time.monotonic() + delay if delay is not None else None
+
+    launch()
+    try:
+        while pending:
+            timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                logger.info("%s is slow, hedging with %s", pending[next(iter(pending))], route[next_index])
+                launch()
+                continue
+
+            results = []
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    results.append(task.result())
+                except Exception as e:
+                    logger.warning("%s failed: %s", name, e)
+                    last_error = e
+            if results:
+                return results[0]
+
+            if next_index < len(route):
+                launch()
+    finally:
+        # The winner (or the caller being cancelled) stops every other request
+        for task in pending:
+            task.cancel()
+
+    raise last_error or Exception("No image provider available")
+
+
+def get_provider_health():
+    """Health, breaker state and hedge delay of every provider that has been used"""
+    with _health_lock:
+        return {name: health.report() for name, health in _health.items()}
+
+
+def reset_provider_health():
+    """Forget all latency/error history and close every breaker"""
+    with _health_lock:
+        _health.clear()
@@ -0,0 +1,440 @@
+"""
+Outbound rate limiting for OpenAI
+Token buckets for requests, tokens and images per minute, kept in a small
+SQLite file so every thread and worker process draws from the same budget.
+Callers queue by priority, then arrival, so interactive outfit generation
+goes ahead of background tagging. A caller only waits behind earlier callers
+that need one of the same buckets, so an image generation waiting for its
+per-minute allowance doesn't hold up chat calls. Waiting callers only read
+the store; a write lock is taken when a caller can actually take its share.
+A 429 from OpenAI pauses every queue for the Retry-After period.
+"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+# Image tokens charged for one image_url part, by detail level
+IMAGE_TOKEN_ESTIMATES = {'low': 85, 'high': 765, 'auto': 765}
+
+# How often a caller that isn't at the front of its queues checks again
+POLL_SECONDS = 0.05
+# Wait before retrying when another process holds the write lock past the busy timeout
+LOCK_RETRY_SECONDS = 0.1
+
+_priority = contextvars.ContextVar('openai_priority', default=INTERACTIVE)
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+_stats_lock = threading.Lock()
+_stats = {}
+_lock_retries = 0
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request waited longer than RATE_LIMIT_MAX_WAIT for its turn"""
+
+
+def limiter_enabled():
+    return os.getenv('OPENAI_RATE_LIMIT', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+
+def _store_path():
+    return os.getenv('RATE_LIMIT_DB', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'rate_limiter.db'))
+
+
+def bucket_limits(endpoint):
+    """Per-minute limits that apply to an endpoint; 0 disables a bucket"""
+    if endpoint == 'openai_images':
+        limits = {'openai_images': int(os.getenv('OPENAI_IMAGES_PER_MINUTE', '5'))}
+    elif endpoint.startswith('openai_'):
+        limits = {
+            'openai_requests': int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500')),
+            'openai_tokens': int(os.getenv('OPENAI_TOKENS_PER_MINUTE', '30000')),
+        }
+    else:
+        return {}
+    return {name: limit for name, limit in limits.items() if limit > 0}
+
+
+def estimate_tokens(payload):
+    """Rough token cost of a chat completion: ~4 characters per token, images by detail, plus max_tokens"""
+    if not isinstance(payload, dict):
+        return 0
+    chars = 0
+    image_tokens = 0
+    for message in payload.get('messages') or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get('type') == 'text':
+                chars += len(part.get('text', ''))
+            elif part.get('type') == 'image_url':
+                image_tokens += IMAGE_TOKEN_ESTIMATES.get(part['image_url'].get('detail', 'auto'), 765)
+    return chars // 4 + image_tokens + (payload.get('max_tokens') or 0)
+
+
+def get_priority():
+    return _priority.get()
+
+
+@contextmanager
+def request_priority(priority):
+    """Run the enclosed OpenAI calls at the given priority (INTERACTIVE or BACKGROUND)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _connection():
+    """One connection per thread (and per process, after a fork)"""
+    path = _store_path()
+    key = (os.getpid(), path)
+    conn = getattr(_local, 'conns', {}).get(key)
+    if conn is None:
+        busy_timeout = int(os.getenv('RATE_LIMIT_BUSY_TIMEOUT_MS', '5000')) / 1000
+        conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        with _schema_lock:
+            if path not in _schema_ready:
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL);
+                    CREATE TABLE IF NOT EXISTS queue (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT, priority INTEGER NOT NULL,
+                        buckets TEXT NOT NULL, pid INTEGER NOT NULL, enqueued REAL NOT NULL
+                    );
+                    CREATE TABLE IF NOT EXISTS pauses (name TEXT PRIMARY KEY, until REAL NOT NULL);
+                """)
+                _schema_ready.add(path)
+        if not hasattr(_local, 'conns'):
+            _local.conns = {}
+        _local.conns[key] = conn
+    return conn
+
+
+def _refill(conn, name, limit, now):
+    """Current level of a bucket after refilling it for the time since its last update"""
+    row = conn.execute('SELECT level, updated FROM buckets WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        return float(limit)
+    level, updated = row
+    return min(float(limit), level + max(0.0, now - updated) * limit / 60.0)
+
+
+def _set_level(conn, name, level, now):
+    conn.execute(
+        'INSERT INTO buckets (name, level, updated) VALUES (?, ?, ?) '
+        'ON CONFLICT(name) DO UPDATE SET level = excluded.level, updated = excluded.updated',
+        (name, level, now)
+    )
+
+
+@contextmanager
+def _write_transaction(conn):
+    """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _is_lock_timeout(error):
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def _count_lock_retry():
+    global _lock_retries
+    with _stats_lock:
+        _lock_retries += 1
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _abandoned_after():
+    # Nobody waits longer than the larger maximum wait, so older entries were left behind
+    return max(_max_wait(INTERACTIVE), _max_wait(BACKGROUND)) + 60
+
+
+def _enqueue(priority, buckets):
+    while True:
+        try:
+            cursor = _connection().execute(
+                'INSERT INTO queue (priority, buckets, pid, enqueued) VALUES (?, ?, ?, ?)',
+                (priority, ','.join(sorted(buckets)), os.getpid(), time.time())
+            )
+            return cursor.lastrowid
+        except sqlite3.OperationalError as e:
+            if not _is_lock_timeout(e):
+                raise
+            _count_lock_retry()
+            time.sleep(LOCK_RETRY_SECONDS)
+
+
+def _leave(waiter_id):
+    # An entry that can't be removed is cleaned up by later callers once it's abandoned
+    for _ in range(20):
+        try:
+            _connection().execute('DELETE FROM queue WHERE id = ?', (waiter_id,))
+            return
+        except sqlite3.OperationalError as e:
+            if not _is_lock_timeout(e):
+                raise
+            _count_lock_retry()
+            time.sleep(LOCK_RETRY_SECONDS)
+
+
+def _waiting_behind(conn, waiter_id, priority, buckets, now):
+    """Whether an earlier caller needing one of the same buckets is still queued"""
+    ahead = conn.execute(
+        'SELECT id, buckets, pid, enqueued FROM queue WHERE priority < ? OR (priority = ? AND id < ?)',
+        (priority, priority, waiter_id)
+    ).fetchall()
+    abandoned = []
+    blocked = False
+    for other_id, other_buckets, pid, enqueued in ahead:
+        if not buckets & set(other_buckets.split(',')):
+            continue
+        if now - enqueued > _abandoned_after() or not _process_alive(pid):
+            abandoned.append(other_id)
+            continue
+        blocked = True
+        break
+    if abandoned:
+        conn.executemany('DELETE FROM queue WHERE id = ?', [(other_id,) for other_id in abandoned])
+    return blocked
+
+
+def _shortfall_wait(conn, costs, now):
+    """(levels, seconds until every bucket has room for its cost)"""
+    levels = {}
+    wait = 0.0
+    for name, (limit, cost) in costs.items():
+        levels[name] = _refill(conn, name, limit, now)
+        # A single request larger than a whole minute's budget only waits for a full bucket
+        shortfall = min(cost, limit) - levels[name]
+        if shortfall > 0:
+            wait = max(wait, shortfall * 60.0 / limit)
+    return levels, wait
+
+
+def _try_acquire(waiter_id, priority, costs):
+    """Take the costs from every bucket if no earlier caller is queued for the same buckets
+
+    Returns 0 on success, otherwise the number of seconds worth waiting
+    before trying again.
+    """
+    conn = _connection()
+    buckets = set(costs)
+    try:
+        # Checked without a write lock first; most polls end here
+        now = time.time()
+        if _waiting_behind(conn, waiter_id, priority, buckets, now):
+            return POLL_SECONDS
+        pause = conn.execute("SELECT until FROM pauses WHERE name = 'openai'").fetchone()
+        if pause and pause[0] > now:
+            return pause[0] - now
+        _, wait = _shortfall_wait(conn, costs, now)
+        if wait > 0:
+            return wait
+
+        with _write_transaction(conn):
+            now = time.time()
+            if _waiting_behind(conn, waiter_id, priority, buckets, now):
+                return POLL_SECONDS
+            levels, wait = _shortfall_wait(conn, costs, now)
+            if wait > 0:
+                return wait
+            for name, (limit, cost) in costs.items():
+                _set_level(conn, name, levels[name] - min(cost, limit), now)
+            conn.execute('DELETE FROM queue WHERE id = ?', (waiter_id,))
+            return 0
+    except sqlite3.OperationalError as e:
+        # Another process held the lock past the busy timeout: wait and try again
+        if not _is_lock_timeout(e):
+            raise
+        _count_lock_retry()
+        return LOCK_RETRY_SECONDS
+
+
+def _costs(endpoint, payload):
+    limits = bucket_limits(endpoint)
+    costs = {}
+    for name, limit in limits.items():
+        cost = estimate_tokens(payload) if name == 'openai_tokens' else 1
+        costs[name] = (limit, cost)
+    return costs
+
+
+def _max_wait(priority):
+    default = '60' if priority == INTERACTIVE else '300'
+    return float(os.getenv(f'RATE_LIMIT_MAX_WAIT_{PRIORITY_NAMES[priority].upper()}', default))
+
+
+def _record_wait(priority, waited, timed_out=False):
+    with _stats_lock:
+        stats = _stats.setdefault(PRIORITY_NAMES[priority], {
+            'acquired': 0, 'timeouts': 0, 'waited': 0, 'total_wait': 0.0, 'max_wait': 0.0
+        })
+        if timed_out:
+            stats['timeouts'] += 1
+        else:
+            stats['acquired'] += 1
+        if waited > 0.001:
+            stats['waited'] += 1
+        stats['total_wait'] += waited
+        stats['max_wait'] = max(stats['max_wait'], waited)
+
+
+def acquire(endpoint, payload=None):
+    """Block until the request fits within the shared budget; returns the token estimate taken"""
+    costs = _costs(endpoint, payload) if limiter_enabled() else {}
+    if not costs:
+        return None
+
+    priority = get_priority()
+    started = time.monotonic()
+    waiter_id = _enqueue(priority, costs)
+    try:
+        while True:
+            wait = _try_acquire(waiter_id, priority, costs)
+            waited = time.monotonic() - started
+            if wait == 0:
+                _record_wait(priority, waited)
+                return costs.get('openai_tokens', (0, 0))[1]
+            if waited + wait > _max_wait(priority):
+                _record_wait(priority, waited, timed_out=True)
+                raise RateLimitTimeout(f"Timed out waiting for OpenAI rate limit capacity ({endpoint})")
+            # Check at least every second; capacity may come back sooner (settle, a cancelled caller)
+            time.sleep(min(wait, 1.0))
+    finally:
+        _leave(waiter_id)
+
+
+async def acquire_async(endpoint, payload=None):
+    """Async acquire(); the queue is polled in the default executor, waits don't block the loop"""
+    costs = _costs(endpoint, payload) if limiter_enabled() else {}
+    if not costs:
+        return None
+
+    loop = asyncio.get_running_loop()
+    priority = get_priority()
+    started = time.monotonic()
+    waiter_id = await loop.run_in_executor(None, _enqueue, priority, costs)
+    try:
+        while True:
+            wait = await loop.run_in_executor(None, _try_acquire, waiter_id, priority, costs)
+            waited = time.monotonic() - started
+            if wait == 0:
+                _record_wait(priority, waited)
+                return costs.get('openai_tokens', (0, 0))[1]
+            if waited + wait > _max_wait(priority):
+                _record_wait(priority, waited, timed_out=True)
+                raise RateLimitTimeout(f"Timed out waiting for OpenAI rate limit capacity ({endpoint})")
+            await asyncio.sleep(min(wait, 1.0))
+    finally:
+        await loop.run_in_executor(None, _leave, waiter_id)
+
+
+def settle(estimated_tokens, usage):
+    """Correct the token bucket once the real usage of a request is known"""
+    if not estimated_tokens or not usage or not limiter_enabled():
+        return
+    limit = bucket_limits('openai_chat').get('openai_tokens')
+    actual = usage.get('total_tokens')
+    if not limit or actual is None:
+        return
+    conn = _connection()
+    try:
+        with _write_transaction(conn):
+            now = time.time()
+            level = _refill(conn, 'openai_tokens', limit, now) + estimated_tokens - actual
+            _set_level(conn, 'openai_tokens', min(float(limit), level), now)
+    except sqlite3.OperationalError as e:
+        # Skipping one correction leaves the estimate charged; not worth failing the request over
+        if not _is_lock_timeout(e):
+            raise
+        _count_lock_retry()
+
+
+def refund(estimated_tokens):
+    """Give back the token estimate of an attempt that was refused or never sent"""
+    settle(estimated_tokens, {'total_tokens': 0})
+
+
+def pause(seconds):
+    """Hold every queued OpenAI request for a while, e.g. after a 429"""
+    if not limiter_enabled() or not seconds or seconds <= 0:
+        return
+    until = time.time() + seconds
+    try:
+        _connection().execute(
+            "INSERT INTO pauses (name, until) VALUES ('openai', ?) "
+            "ON CONFLICT(name) DO UPDATE SET until = MAX(until, excluded.until)",
+            (until,)
+        )
+    except sqlite3.OperationalError as e:
+        # The retrying caller still backs off for Retry-After itself
+        if not _is_lock_timeout(e):
+            raise
+        _count_lock_retry()
+
+
+def get_rate_limiter_stats():
+    """Bucket levels, queue length and wait times per priority"""
+    report = {'enabled': limiter_enabled(), 'priorities': {}, 'lock_retries': _lock_retries}
+    with _stats_lock:
+        for name, stats in _stats.items():
+            calls = stats['acquired'] + stats['timeouts']
+            report['priorities'][name] = {
+                **stats,
+                'total_wait': round(stats['total_wait'], 4),
+                'max_wait': round(stats['max_wait'], 4),
+                'avg_wait': round(stats['total_wait'] / calls, 4) if calls else None,
+            }
+    if not limiter_enabled():
+        return report
+
+    conn = _connection()
+    now = time.time()
+    limits = {**bucket_limits('openai_chat'), **bucket_limits('openai_images')}
+    report['buckets'] = {
+        name: {'limit_per_minute': limit, 'available': round(_refill(conn, name, limit, now), 1)}
+        for name, limit in limits.items()
+    }
+    report['queued'] = {
+        PRIORITY_NAMES.get(priority, str(priority)): count
+        for priority, count in conn.execute(
+            'SELECT priority, COUNT(*) FROM queue GROUP BY priority'
+        )
+    }
+    pause_row = conn.execute("SELECT until FROM pauses WHERE name = 'openai'").fetchone()
+    report['paused_for'] = round(max(0.0, pause_row[0] - now), 2) if pause_row else 0.0
+    return report
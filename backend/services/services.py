@@ -1,16 +1,25 @@
 import os
 import base64
-import requests
 from flask import request, jsonify, Flask, send_from_directory
 from PIL import Image
 from dotenv import load_dotenv
 import json  # Import json module
+from services import http_client
+from services.metrics import timed_stage
+from services.logs import get_logger, log_payload
+from services.vision_payload import vision_ladder, encode_image_for_vision, is_valid_tags, record_vision_call
 
 load_dotenv()
 
+# Point at a local stub (see loadtest/stub_server.py) to run without the real API
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1').rstrip('/')
+
+logger = get_logger('services')
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 
+@timed_stage('resizing')
 def resize_image(image_path, max_size=512):
     """Resize image to make it square with borders and apply white background."""
     with Image.open(image_path) as img:
@@ -47,12 +56,33 @@ def resize_image(image_path, max_size=512):
         square_img.paste(img_resized, (x_offset, y_offset))
         
         # Save the processed image
-        output_path = image_path.replace('.png', '_resized.jpg').replace('.jpg', '_resized.jpg')
+        output_path = os.path.splitext(image_path)[0] + '_resized.jpg'
         square_img.save(output_path, 'JPEG', quality=85, optimize=True)
         return output_path
 
 def tag_image(image_data, prompt):
     """Analyze a single clothing item image and assign tags."""
+    tags_content, _, _ = request_image_tags(image_data, prompt)
+    return tags_content  # Return the tags as a JSON string
+
+@timed_stage('tag_api')
+def tag_image_file(image_path, prompt):
+    """Tag an image file, escalating payload fidelity only when the tags are unusable."""
+    tags = None
+    for level, setting in vision_ladder('tagging'):
+        image_data, mime_type = encode_image_for_vision(image_path, setting)
+        tags_content, usage, latency = request_image_tags(image_data, prompt, setting['detail'], mime_type)
+        log_payload(logger, f"Tags received from GPT-4o ({setting['name']})", tags_content)
+        
+        tags = parse_tags(tags_content)
+        valid = is_valid_tags(tags)
+        record_vision_call('tagging', level, usage, latency, valid)
+        if valid:
+            break
+    return tags
+
+def request_image_tags(image_data, prompt, detail=None, mime_type='image/jpeg'):
+    """Send an encoded clothing image to GPT-4o; returns (tags content, usage, latency)."""
     api_key = os.getenv('OPENAI_API_KEY')
     headers = {
         'Authorization': f'Bearer {api_key}',
@@ -73,7 +103,7 @@ def tag_image(image_data, prompt):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_data}"
+                            "url": f"data:{mime_type};base64,{image_data}"
                         }
                     }
                 ]
@@ -81,10 +111,13 @@ def tag_image(image_data, prompt):
         ],
         "max_tokens": 250
     }
+    if detail:
+        analyze_payload["messages"][0]["content"][1]["image_url"]["detail"] = detail
 
     # Send the request to GPT-4o
-    response = requests.post(
-        'https://api.openai.com/v1/chat/completions',
+    response = http_client.post(
+        'openai_vision',
+        f'{OPENAI_API_BASE}/chat/completions',
         headers=headers,
         json=analyze_payload
     )
@@ -93,7 +126,7 @@ def tag_image(image_data, prompt):
         # Parse the response to extract tags
         response_data = response.json()
         tags_content = response_data['choices'][0]['message']['content']
-        return tags_content  # Return the tags as a JSON string
+        return tags_content, response_data.get('usage'), response.total_latency
     else:
         raise Exception(f"GPT-4o error: {response.text}")
 
@@ -122,8 +155,8 @@ def parse_tags(response):
         return tags
     except json.JSONDecodeError as e:
         # If the response is not JSON, return an error
-        print(f"Error: GPT-4o response is not in JSON format. Error: {e}")
-        print(f"Response content: {response}")
+        logger.warning("GPT-4o response is not in JSON format: %s", e)
+        log_payload(logger, 'GPT-4o response', response)
         return {
             'type': 'unknown',
             'type_category': 'unknown',
@@ -0,0 +1,52 @@
+"""
+Tag catalog
+Maps tag names to ids so uploads can link tags without a lookup query per
+tag. The catalog is loaded once (by the serve command, before it forks its
+workers, so they share it) and grows as new tags are created. Tags are never
+renamed or deleted, so entries never go stale.
+"""
+
+import threading
+from sqlalchemy.exc import IntegrityError
+from db.models import db, Tag
+from services.logs import get_logger
+
+logger = get_logger('tag_catalog')
+
+_catalog = {}  # name -> id
+_catalog_lock = threading.Lock()
+_loaded = False
+
+
+def load_tag_catalog():
+    """Load every tag name and id; call inside an app context"""
+    global _loaded
+    rows = db.session.execute(db.select(Tag.name, Tag.id)).all()
+    with _catalog_lock:
+        _catalog.update({name: tag_id for name, tag_id in rows})
+        _loaded = True
+    logger.info("Tag catalog loaded (%d tags)", len(rows))
+
+
+def tag_id_for(name, category):
+    """The id of the tag with this name, creating the tag if it doesn't exist yet"""
+    if not _loaded:
+        load_tag_catalog()
+    tag_id = _catalog.get(name)
+    if tag_id is not None:
+        return tag_id
+
+    tag_id = db.session.execute(db.select(Tag.id).where(Tag.name == name)).scalar()
+    if tag_id is None:
+        tag = Tag(name=name, category=category)
+        db.session.add(tag)
+        try:
+            db.session.commit()
+            tag_id = tag.id
+        except IntegrityError:
+            # Another worker created it first
+            db.session.rollback()
+            tag_id = db.session.execute(db.select(Tag.id).where(Tag.name == name)).scalar()
+    with _catalog_lock:
+        _catalog[name] = tag_id
+    return tag_id
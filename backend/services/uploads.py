@@ -0,0 +1,94 @@
+"""
+Upload ingestion
+Uploaded images are checked before anything decodes them. Request bodies are
+capped at UPLOAD_MAX_BYTES (Flask's MAX_CONTENT_LENGTH), and file parts are
+spooled to a temporary file above UPLOAD_SPOOL_BYTES instead of being held in
+memory. An image is only decoded once its header shows it is within
+UPLOAD_MAX_PIXELS. JPEGs are decoded at 1/2, 1/4 or 1/8 scale where possible;
+other formats (PNG, WebP, ...) can only be decoded at full size, so what will
+actually be decoded is capped separately at UPLOAD_MAX_DECODED_PIXELS. Every
+image is then shrunk to UPLOAD_MAX_SIDE before background removal. Decoding
+holds at most UPLOAD_MAX_DECODED_PIXELS pixels (about 48 MB at the default),
+and a request keeps a few megabytes after the shrink.
+"""
+
+import os
+import tempfile
+from flask import Request
+from PIL import Image, UnidentifiedImageError
+
+
+class UploadRejected(Exception):
+    """An upload that can't be accepted, with the HTTP status to answer it with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def too_large_message(limit_bytes):
+    """Error message for a request body over MAX_CONTENT_LENGTH"""
+    return f"The request is too large; requests up to {limit_bytes / (1024 * 1024):.3g} MB are accepted"
+
+
+def max_upload_pixels():
+    return int(os.getenv('UPLOAD_MAX_PIXELS', '40000000'))
+
+
+def max_decoded_pixels():
+    return int(os.getenv('UPLOAD_MAX_DECODED_PIXELS', '12000000'))
+
+
+def max_upload_side():
+    return int(os.getenv('UPLOAD_MAX_SIDE', '1024'))
+
+
+class UploadRequest(Request):
+    """Flask request that spools file parts to disk above UPLOAD_SPOOL_BYTES"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool_bytes = int(os.getenv('UPLOAD_SPOOL_BYTES', str(512 * 1024)))
+        return tempfile.SpooledTemporaryFile(max_size=spool_bytes, mode='rb+')
+
+
+def open_upload_image(stream):
+    """Decode an uploaded image to at most UPLOAD_MAX_SIDE pixels a side
+
+    Only the header is read before the size checks. Raises UploadRejected for files
+    that aren't images, are too large or are broken.
+    """
+    stream.seek(0)
+    try:
+        image = Image.open(stream)
+    except UnidentifiedImageError:
+        raise UploadRejected('The file is not a supported image')
+    except Image.DecompressionBombError:
+        raise UploadRejected(f"The image is too large; images up to {max_upload_pixels() / 1e6:g} megapixels are accepted", 413)
+    except (OSError, ValueError, SyntaxError):
+        # Truncated inside the header
+        raise UploadRejected('The image could not be read; it may be truncated or corrupt')
+
+    width, height = image.size
+    if width * height > max_upload_pixels():
+        raise UploadRejected(
+            f"The image is {width}x{height} pixels; images up to {max_upload_pixels() / 1e6:g} megapixels are accepted",
+            413
+        )
+
+    side = max_upload_side()
+    # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale; the size then reflects what will be decoded
+    image.draft(None, (side, side))
+    if image.size[0] * image.size[1] > max_decoded_pixels():
+        raise UploadRejected(
+            f"The image is {width}x{height} pixels; {image.format or 'this format'} images up to "
+            f"{max_decoded_pixels() / 1e6:g} megapixels are accepted (JPEGs up to {max_upload_pixels() / 1e6:g})",
+            413
+        )
+
+    try:
+        # Item images end up 512px square, so nothing is lost by shrinking before background removal
+        image.thumbnail((side, side))
+        image.load()
+    except (OSError, ValueError, SyntaxError):
+        raise UploadRejected('The image could not be read; it may be truncated or corrupt')
+    return image
@@ -0,0 +1,249 @@
+"""
+Usage accounting
+Every external AI call (prompt analysis, tagging, outfit descriptions, image
+generation) leaves a compact record: user, call type, model, tokens, images,
+latency, outcome and an estimated cost. Records are buffered in memory and
+written in batches by a background thread, so a call never waits on the
+database. usage_rollup() adds them up per user, day, call type or model
+for GET /usage and `flask --app app usage-report`.
+"""
+
+import os
+import json
+import atexit
+import threading
+from datetime import datetime, timedelta
+from services.logs import get_logger, current_request_id, current_request_user
+from services.metrics import current_stage
+
+logger = get_logger('usage')
+
+# USD per million tokens, and per generated image (1024x1024); override with USAGE_PRICES
+DEFAULT_PRICES = {
+    'gpt-4o': {'input': 2.50, 'output': 10.00},
+    'gpt-4o-mini': {'input': 0.15, 'output': 0.60},
+    'dall-e-3': {'image': 0.040, 'image_hd': 0.080},
+}
+
+GROUPS = ('user', 'day', 'call_type', 'model', 'endpoint')
+
+_lock = threading.Lock()
+_buffer = []
+_app = None
+_flush_requested = threading.Event()
+_thread = None
+_thread_pid = None
+_stats = {'recorded': 0, 'written': 0, 'dropped': 0, 'flush_errors': 0}
+
+
+def tracking_enabled():
+    return _app is not None and os.getenv('USAGE_TRACKING', 'true').lower() == 'true'
+
+
+def _batch_size():
+    return int(os.getenv('USAGE_BATCH_SIZE', '200'))
+
+
+def _buffer_max():
+    return int(os.getenv('USAGE_BUFFER_MAX', '10000'))
+
+
+def prices():
+    """Price table, with USAGE_PRICES (JSON, same shape as DEFAULT_PRICES) merged over the defaults"""
+    table = {model: dict(entry) for model, entry in DEFAULT_PRICES.items()}
+    for model, entry in json.loads(os.getenv('USAGE_PRICES') or '{}').items():
+        table.setdefault(model, {}).update(entry)
+    return table
+
+
+def estimate_cost(model, prompt_tokens=0, completion_tokens=0, images=0, quality=None):
+    """Estimated USD cost of one call; 0 for models without a price"""
+    entry = prices().get(model or '', {})
+    cost = (prompt_tokens * entry.get('input', 0) + completion_tokens * entry.get('output', 0)) / 1_000_000
+    image_price = entry.get(f'image_{quality}', entry.get('image', 0)) if quality else entry.get('image', 0)
+    return round(cost + images * image_price, 6)
+
+
+def _model_for(endpoint, url, payload):
+    if payload and payload.get('model'):
+        return payload['model']
+    if endpoint == 'huggingface' and '/models/' in url:
+        return url.split('/models/', 1)[1]
+    return None
+
+
+def record_usage(endpoint, model, latency, outcome='ok', usage=None, images=0, quality=None, call_type=None):
+    """Buffer one usage record; the user, request id and call type come from the current request"""
+    if not tracking_enabled():
+        return
+    usage = usage or {}
+    prompt_tokens = usage.get('prompt_tokens') or 0
+    completion_tokens = usage.get('completion_tokens') or 0
+    row = {
+        'user_id': current_request_user(),
+        'created_at': datetime.utcnow(),
+        'call_type': call_type or current_stage() or endpoint,
+        'endpoint': endpoint,
+        'model': model,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'images': images,
+        'latency_ms': int(latency * 1000),
+        'outcome': outcome,
+        'cost_usd': estimate_cost(model, prompt_tokens, completion_tokens, images, quality),
+        'request_id': current_request_id(),
+    }
+    with _lock:
+        if len(_buffer) >= _buffer_max():
+            _stats['dropped'] += 1
+            return
+        _buffer.append(row)
+        _stats['recorded'] += 1
+        full = len(_buffer) >= _batch_size()
+    _ensure_flusher()
+    if full:
+        _flush_requested.set()
+
+
+def record_call(endpoint, url, payload, response, latency, error=None):
+    """Record a finished call from the HTTP client (response is None when it raised)"""
+    if not tracking_enabled():
+        return
+    model = _model_for(endpoint, url, payload)
+    if response is None:
+        record_usage(endpoint, model, latency, outcome=type(error).__name__)
+        return
+    ok = response.status_code == 200
+    images = 0
+    if ok and endpoint == 'openai_images':
+        images = (payload or {}).get('n', 1)
+    elif ok and endpoint == 'huggingface':
+        images = 1
+    record_usage(endpoint, model, latency, outcome='ok' if ok else f"http_{response.status_code}",
+                 usage=getattr(response, 'usage', None), images=images,
+                 quality=(payload or {}).get('quality'))
+
+
+def flush_usage():
+    """Write buffered records in one multi-row insert; returns how many were written"""
+    from db import db
+    from db.models import UsageRecord
+
+    with _lock:
+        rows = _buffer[:]
+        del _buffer[:]
+    if not rows or _app is None:
+        return 0
+    try:
+        with _app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(db.insert(UsageRecord), rows)
+    except Exception as e:
+        _stats['flush_errors'] += 1
+        logger.warning("Could not write %d usage records: %s", len(rows), e)
+        # Keep them for the next attempt, unless the buffer has filled up meanwhile
+        with _lock:
+            kept = rows[:max(0, _buffer_max() - len(_buffer))]
+            _buffer[:0] = kept
+            _stats['dropped'] += len(rows) - len(kept)
+        return 0
+    _stats['written'] += len(rows)
+    return len(rows)
+
+
+def _flush_loop():
+    interval = float(os.getenv('USAGE_FLUSH_INTERVAL', '5'))
+    while True:
+        _flush_requested.wait(interval)
+        _flush_requested.clear()
+        flush_usage()
+
+
+def _ensure_flusher():
+    # One flusher per process: threads don't survive the fork into serve.py workers
+    global _thread, _thread_pid
+    pid = os.getpid()
+    if _thread_pid == pid:
+        return
+    with _lock:
+        if _thread_pid != pid:
+            _thread = threading.Thread(target=_flush_loop, name='senera-usage', daemon=True)
+            _thread.start()
+            _thread_pid = pid
+
+
+def init_usage_tracking(app):
+    """Write usage records through this app's database"""
+    global _app
+    _app = app
+
+
+def get_usage_stats():
+    with _lock:
+        return {**_stats, 'pending': len(_buffer)}
+
+
+def usage_rollup(group_by=('user', 'day'), days=7, user_id=None):
+    """Calls, tokens, images, latency, failures and cost per group, most expensive first
+
+    group_by is any of user, day, call_type, model and endpoint. Call inside an app context.
+    """
+    from db import db
+    from db.models import UsageRecord
+
+    columns = {
+        'user': UsageRecord.user_id,
+        'day': db.func.date(UsageRecord.created_at),
+        'call_type': UsageRecord.call_type,
+        'model': UsageRecord.model,
+        'endpoint': UsageRecord.endpoint,
+    }
+    unknown = [group for group in group_by if group not in columns]
+    if unknown:
+        raise ValueError(f"Unknown grouping {', '.join(unknown)}; expected {', '.join(GROUPS)}")
+
+    keys = [columns[group].label(group) for group in group_by]
+    cost = db.func.sum(UsageRecord.cost_usd)
+    query = (
+        db.select(
+            *keys,
+            db.func.count().label('calls'),
+            db.func.sum(db.case((UsageRecord.outcome != 'ok', 1), else_=0)).label('failures'),
+            db.func.sum(UsageRecord.prompt_tokens).label('prompt_tokens'),
+            db.func.sum(UsageRecord.completion_tokens).label('completion_tokens'),
+            db.func.sum(UsageRecord.images).label('images'),
+            db.func.avg(UsageRecord.latency_ms).label('avg_latency_ms'),
+            db.func.max(UsageRecord.latency_ms).label('max_latency_ms'),
+            db.func.sum(UsageRecord.latency_ms).label('total_latency_ms'),
+            cost.label('cost_usd'),
+        )
+        .where(UsageRecord.created_at >= datetime.utcnow() - timedelta(days=days))
+        .group_by(*keys)
+        .order_by(cost.desc(), db.func.count().desc())
+    )
+    if user_id is not None:
+        query = query.where(UsageRecord.user_id == user_id)
+
+    rows = []
+    for row in db.session.execute(query):
+        entry = dict(row._mapping)
+        if 'day' in entry and entry['day'] is not None:
+            entry['day'] = str(entry['day'])
+        entry['avg_latency_ms'] = round(entry['avg_latency_ms'] or 0)
+        entry['cost_usd'] = round(entry['cost_usd'] or 0, 4)
+        rows.append(entry)
+    return rows
+
+
+def format_rollup(rows, group_by):
+    """Plain-text table of usage_rollup rows"""
+    headers = list(group_by) + ['calls', 'failures', 'prompt_tokens', 'completion_tokens', 'images',
+                                'avg_latency_ms', 'max_latency_ms', 'cost_usd']
+    table = [[str(row[key]) for key in headers] for row in rows]
+    widths = [max([len(header)] + [len(line[i]) for line in table]) for i, header in enumerate(headers)]
+    lines = ['  '.join(header.ljust(width) for header, width in zip(headers, widths))]
+    lines += ['  '.join(value.ljust(width) for value, width in zip(line, widths)) for line in table]
+    return '\n'.join(lines)
+
+
+atexit.register(flush_usage)
@@ -0,0 +1,127 @@
+"""
+Adaptive vision payloads
+Picks image resolution, encoding and the OpenAI `detail` level for each
+vision call type, escalates to higher fidelity only when the parsed result is
+invalid, and records tokens and latency per setting.
+"""
+
+import os
+import io
+import base64
+import threading
+from PIL import Image
+
+# Settings per call type, cheapest first. "low" detail is a fixed 85 image
+# tokens at 512px; "high" is billed per 512px tile.
+VISION_LADDERS = {
+    'tagging': [
+        {'name': 'jpeg512-low', 'max_side': 512, 'format': 'JPEG', 'quality': 80, 'detail': 'low'},
+        {'name': 'jpeg512-high', 'max_side': 512, 'format': 'JPEG', 'quality': 90, 'detail': 'high'},
+    ],
+    'collage': [
+        {'name': 'jpeg1024-low', 'max_side': 1024, 'format': 'JPEG', 'quality': 85, 'detail': 'low'},
+        {'name': 'jpeg1024-high', 'max_side': 1024, 'format': 'JPEG', 'quality': 85, 'detail': 'high'},
+        {'name': 'png1024-high', 'max_side': 1024, 'format': 'PNG', 'quality': None, 'detail': 'high'},
+    ],
+}
+
+# Rung each call type starts on, overridable with VISION_<TYPE>_START_LEVEL
+DEFAULT_START_LEVELS = {'tagging': 0, 'collage': 1}
+
+VALID_TYPE_CATEGORIES = {'top', 'bottom', 'footwear', 'accessory', 'outerwear', 'headwear'}
+
+REFUSAL_PREFIXES = ("i'm sorry", "i am sorry", "i can't", "i cannot", "sorry", "unfortunately")
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def optimizer_enabled():
+    return os.getenv('VISION_PAYLOAD_OPTIMIZER', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+
+def vision_ladder(call_type):
+    """(level, setting) pairs to try for a call type, starting at its configured rung"""
+    ladder = VISION_LADDERS[call_type]
+    if not optimizer_enabled():
+        # Only the highest-fidelity setting, as before the optimizer existed
+        return [(len(ladder) - 1, ladder[-1])]
+    start = int(os.getenv(f'VISION_{call_type.upper()}_START_LEVEL', str(DEFAULT_START_LEVELS[call_type])))
+    start = max(0, min(start, len(ladder) - 1))
+    return [(level, ladder[level]) for level in range(start, len(ladder))]
+
+
+def encode_image_for_vision(image_path, setting):
+    """Re-encode an image for a vision call; returns (base64 data, mime type)"""
+    with Image.open(image_path) as img:
+        img = img.convert('RGB')
+        # Only ever downscale
+        img.thumbnail((setting['max_side'], setting['max_side']), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        if setting['format'] == 'JPEG':
+            img.save(buffer, 'JPEG', quality=setting['quality'], optimize=True)
+            mime_type = 'image/jpeg'
+        else:
+            img.save(buffer, 'PNG', optimize=True)
+            mime_type = 'image/png'
+    return base64.b64encode(buffer.getvalue()).decode('utf-8'), mime_type
+
+
+def is_valid_tags(tags):
+    """A tagging result is usable when it names a known type category and a type"""
+    if not isinstance(tags, dict):
+        return False
+    type_name = tags.get('type')
+    return tags.get('type_category') in VALID_TYPE_CATEGORIES and bool(type_name) and type_name != 'unknown'
+
+
+def is_valid_description(description):
+    """A collage description is usable when it is substantial and not a refusal"""
+    if not description or len(description.strip()) < 40:
+        return False
+    return not description.strip().lower().startswith(REFUSAL_PREFIXES)
+
+
+def record_vision_call(call_type, level, usage, latency, valid):
+    """Record tokens, latency and validity of one vision call at one setting"""
+    usage = usage or {}
+    setting = VISION_LADDERS[call_type][level]
+    with _stats_lock:
+        stats = _stats.setdefault((call_type, level), {
+            'call_type': call_type,
+            'setting': setting['name'],
+            'detail': setting['detail'],
+            'calls': 0,
+            'valid': 0,
+            'escalations': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'total_latency': 0.0,
+        })
+        stats['calls'] += 1
+        stats['valid'] += 1 if valid else 0
+        stats['escalations'] += 0 if valid or level == len(VISION_LADDERS[call_type]) - 1 else 1
+        stats['prompt_tokens'] += usage.get('prompt_tokens') or 0
+        stats['completion_tokens'] += usage.get('completion_tokens') or 0
+        stats['total_latency'] += latency or 0.0
+
+
+def get_vision_report():
+    """Per call type and setting: validity rate, average tokens and latency"""
+    with _stats_lock:
+        report = []
+        for (call_type, level), stats in sorted(_stats.items()):
+            calls = stats['calls']
+            report.append({
+                'call_type': call_type,
+                'level': level,
+                'setting': stats['setting'],
+                'detail': stats['detail'],
+                'calls': calls,
+                'valid_rate': round(stats['valid'] / calls, 3) if calls else None,
+                'escalations': stats['escalations'],
+                'avg_prompt_tokens': round(stats['prompt_tokens'] / calls, 1) if calls else None,
+                'avg_completion_tokens': round(stats['completion_tokens'] / calls, 1) if calls else None,
+                'avg_latency': round(stats['total_latency'] / calls, 4) if calls else None,
+            })
+        return report
@@ -0,0 +1,194 @@
+"""
+Session storage
+Selects where login sessions live, with SESSION_BACKEND:
+- sqlite (default): server-side sessions in a SQLite file shared by all
+  workers, with expired sessions swept periodically
+- memory: server-side sessions in a per-process LRU (single worker only)
+- filesystem: Flask-Session's filesystem backend (one file per session)
+- cookie: Flask's signed, stateless cookie (no server-side storage at all).
+  Anyone holding SECRET_KEY can forge a session for any user, and logging out
+  can't revoke a cookie, so it needs a real secret key.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import secrets
+import threading
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+from config import DEFAULT_SECRET_KEY
+from services.logs import get_logger
+
+logger = get_logger('sessions')
+
+SESSION_BACKENDS = ('cookie', 'memory', 'sqlite', 'filesystem')
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    """Session whose data lives in a server-side store, keyed by a random id"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class MemorySessionStore:
+    """Sessions in an in-process LRU; lost on restart and not shared between workers"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # sid -> (data, expires_at)
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self.sessions[sid]
+                return None
+            self.sessions.move_to_end(sid)
+            return dict(entry[0])
+
+    def set(self, sid, data, ttl):
+        with self.lock:
+            self.sessions[sid] = (dict(data), time.time() + ttl)
+            self.sessions.move_to_end(sid)
+            while len(self.sessions) > self.max_entries:
+                self.sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file, shared by every worker process"""
+
+    def __init__(self, path, sweep_interval=300):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.local = threading.local()
+        self.last_sweep = 0.0
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires)')
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or getattr(self.local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, sid):
+        row = self._connection().execute(
+            'SELECT data FROM sessions WHERE sid = ? AND expires > ?', (sid, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, sid, data, ttl):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            'INSERT INTO sessions (sid, data, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT(sid) DO UPDATE SET data = excluded.data, expires = excluded.expires',
+            (sid, json.dumps(data), now + ttl)
+        )
+        if now - self.last_sweep > self.sweep_interval:
+            self.last_sweep = now
+            swept = conn.execute('DELETE FROM sessions WHERE expires <= ?', (now,)).rowcount
+            if swept:
+                logger.info("Swept %d expired sessions", swept)
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class StoredSessionInterface(SessionInterface):
+    """Keeps session data in a store; the cookie only carries the signed session id"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='senera-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('utf-8')
+            except BadSignature:
+                sid = None
+            data = self.store.get(sid) if sid else None
+            if data is not None:
+                return StoredSession(data, sid=sid)
+        return StoredSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Only write when something changed, so plain authenticated reads cost no store write
+        if not self.should_set_cookie(app, session):
+            return
+
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        self.store.set(session.sid, dict(session), ttl)
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid.encode('utf-8')).decode('utf-8'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def init_session_store(app):
+    """Configure the session backend named by app.config['SESSION_BACKEND']"""
+    backend = app.config.get('SESSION_BACKEND', 'sqlite')
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}, expected one of {', '.join(SESSION_BACKENDS)}")
+    if backend == 'cookie' and app.config.get('SECRET_KEY') in (None, '', DEFAULT_SECRET_KEY):
+        # The cookie carries the session itself, so a known key lets anyone sign in as any user
+        raise ValueError("SESSION_BACKEND=cookie requires SECRET_KEY to be set to a private value")
+
+    if backend == 'filesystem':
+        from flask_session import Session
+        Session(app)
+    elif backend == 'memory':
+        app.session_interface = StoredSessionInterface(
+            MemorySessionStore(int(app.config.get('SESSION_MEMORY_MAX_ENTRIES', 10000)))
+        )
+    elif backend == 'sqlite':
+        app.session_interface = StoredSessionInterface(SQLiteSessionStore(
+            app.config['SESSION_SQLITE_PATH'],
+            int(app.config.get('SESSION_SWEEP_INTERVAL', 300))
+        ))
+    # 'cookie' keeps Flask's default signed cookie session
+    logger.info("Session backend: %s", backend)
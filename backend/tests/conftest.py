@@ -0,0 +1,65 @@
+"""
+Shared fixtures: an app on a temporary SQLite database, with uploads, the
+rate limiter store and sessions kept inside the test's tmp_path.
+Run from backend/: python -m pytest tests
+"""
+
+import os
+import sys
+import pytest
+
+# The backend uses flat imports (from services.x import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from db.engine import engine_options
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    """SQLAlchemy URL the app runs on; test_postgres.py overrides it"""
+    return f"sqlite:///{tmp_path / 'senera.db'}"
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, database_url):
+    from app import create_app
+    from db.migrations import upgrade_database
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'uploads').mkdir()
+    monkeypatch.setenv('RATE_LIMIT_DB', str(tmp_path / 'rate_limiter.db'))
+    monkeypatch.setenv('PASSWORD_HASH_WORKERS', '0')
+    monkeypatch.setenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_ENGINE_OPTIONS = engine_options(database_url)
+        SESSION_BACKEND = 'memory'
+        API_HOST = '127.0.0.1'
+        PRELOAD_APP = False
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        upgrade_database()
+        yield app
+        from db import db
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_id(client):
+    """Register and log in a user on client; returns the user's id"""
+    account = {'display_name': 'Tester', 'email': 'tester@example.com', 'password': 'Passw0rd!x'}
+    response = client.post('/register', json={**account, 'confirm_password': account['password'], 'not_robot': True})
+    assert response.status_code in (200, 201), response.get_json()
+    response = client.post('/login', json={'email': account['email'], 'password': account['password']})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['user']['id']
@@ -0,0 +1,79 @@
+"""Set-based deletes of saved outfits and wardrobe items"""
+
+from db import db
+from db.models import User, Tag, WardrobeItem, WardrobeItemTag, SavedOutfit
+from routes.routes import delete_wardrobe_rows
+
+
+def add_outfits(user_id, count):
+    outfits = [SavedOutfit(user_id=user_id, name=f"Outfit {index}", image_url=f"outfit_{index}.jpg") for index in range(count)]
+    db.session.add_all(outfits)
+    db.session.commit()
+    return [outfit.id for outfit in outfits]
+
+
+def add_other_user():
+    other = User(display_name='Other', email='other@example.com', password_hash='x')
+    db.session.add(other)
+    db.session.commit()
+    return other.id
+
+
+def test_delete_outfit(client, user_id):
+    own = add_outfits(user_id, 2)
+    others = add_outfits(add_other_user(), 1)
+
+    assert client.delete(f'/delete-outfit/{own[0]}').status_code == 200
+    assert client.delete(f'/delete-outfit/{own[0]}').status_code == 404
+    # Someone else's outfit is not found, and not deleted
+    assert client.delete(f'/saved-outfits/{others[0]}').status_code == 404
+    assert sorted(id for (id,) in db.session.query(SavedOutfit.id)) == sorted([own[1], others[0]])
+
+
+def test_delete_multiple_saved_outfits(client, user_id):
+    own = add_outfits(user_id, 3)
+    others = add_outfits(add_other_user(), 1)
+
+    response = client.delete('/saved-outfits', json={'outfit_ids': own[:2] + others})
+    assert response.status_code == 200
+    assert response.get_json()['message'].startswith('2 outfits')
+    assert sorted(id for (id,) in db.session.query(SavedOutfit.id)) == sorted([own[2], others[0]])
+
+
+def seed_items(user_id, other_id):
+    tag = Tag(name='navy', category='color')
+    items = [
+        WardrobeItem(user_id=user_id, image_url='/uploads/a.jpg', type_category='top', tags=[tag]),
+        WardrobeItem(user_id=user_id, image_url='/uploads/b.jpg', type_category='bottom', tags=[tag]),
+        WardrobeItem(user_id=user_id, image_url='/uploads/c.jpg', type_category='top', tags=[]),
+        WardrobeItem(user_id=other_id, image_url='/uploads/d.jpg', type_category='top', tags=[tag]),
+    ]
+    db.session.add_all(items)
+    db.session.commit()
+    return [item.id for item in items]
+
+
+def check_delete_wardrobe_rows(user_id, other_id):
+    """delete_wardrobe_rows on whatever database the app is bound to"""
+    ids = seed_items(user_id, other_id)
+
+    deleted = delete_wardrobe_rows(user_id, WardrobeItem.type_category == 'top')
+    db.session.commit()
+    assert sorted(deleted) == ['/uploads/a.jpg', '/uploads/c.jpg']
+
+    remaining = sorted(id for (id,) in db.session.query(WardrobeItem.id))
+    assert remaining == [ids[1], ids[3]]
+    # Tag links of deleted items are gone, the others are kept
+    links = sorted(id for (id,) in db.session.query(WardrobeItemTag.wardrobe_item_id))
+    assert links == [ids[1], ids[3]]
+
+    assert delete_wardrobe_rows(user_id, WardrobeItem.id == ids[3]) == []
+    db.session.commit()
+    assert db.session.get(WardrobeItem, ids[3]) is not None
+
+
+def test_delete_wardrobe_rows(app):
+    user = User(display_name='Tester', email='tester@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    check_delete_wardrobe_rows(user.id, add_other_user())
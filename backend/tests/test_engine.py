@@ -0,0 +1,72 @@
+"""Database profiles: DATABASE_URL rewriting, pool sizing and connection settings"""
+
+import pytest
+from db.engine import database_uri, engine_options, sqlite_pragmas, DEFAULT_SQLITE_PATH
+
+ENGINE_VARIABLES = [
+    'DATABASE_URL', 'DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT', 'DB_POOL_RECYCLE',
+    'DB_APPLICATION_NAME', 'DB_STATEMENT_TIMEOUT_MS', 'SQLITE_BUSY_TIMEOUT_MS',
+]
+
+
+@pytest.fixture(autouse=True)
+def clean_environment(monkeypatch):
+    for name in ENGINE_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_default_is_the_local_sqlite_file():
+    assert database_uri() == f"sqlite:///{DEFAULT_SQLITE_PATH}"
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('postgres://u:p@db:5432/senera', 'postgresql+psycopg2://u:p@db:5432/senera'),
+    ('postgresql://u:p@db/senera', 'postgresql+psycopg2://u:p@db/senera'),
+    ('postgresql+psycopg2://u:p@db/senera', 'postgresql+psycopg2://u:p@db/senera'),
+    ('sqlite:////data/senera.db', 'sqlite:////data/senera.db'),
+    ('mysql+pymysql://u:p@db/senera', 'mysql+pymysql://u:p@db/senera'),
+])
+def test_database_url_schemes(monkeypatch, url, expected):
+    monkeypatch.setenv('DATABASE_URL', url)
+    assert database_uri() == expected
+
+
+def test_sqlite_options():
+    assert engine_options('sqlite:///senera.db') == {'connect_args': {'timeout': 5.0}}
+
+
+def test_sqlite_busy_timeout(monkeypatch):
+    monkeypatch.setenv('SQLITE_BUSY_TIMEOUT_MS', '250')
+    assert engine_options('sqlite:///senera.db') == {'connect_args': {'timeout': 0.25}}
+    assert 'PRAGMA busy_timeout=250' in sqlite_pragmas()
+    assert 'PRAGMA journal_mode=WAL' in sqlite_pragmas()
+
+
+def test_postgresql_pool_defaults():
+    options = engine_options('postgresql+psycopg2://u:p@db/senera')
+    assert options == {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'connect_args': {'application_name': 'senera'},
+    }
+
+
+def test_postgresql_pool_sizing_and_statement_timeout(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '4')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '2')
+    monkeypatch.setenv('DB_POOL_TIMEOUT', '7')
+    monkeypatch.setenv('DB_POOL_RECYCLE', '60')
+    monkeypatch.setenv('DB_APPLICATION_NAME', 'senera-worker')
+    monkeypatch.setenv('DB_STATEMENT_TIMEOUT_MS', '15000')
+    options = engine_options('postgresql+psycopg2://u:p@db/senera')
+    assert (options['pool_size'], options['max_overflow'], options['pool_timeout'], options['pool_recycle']) == (4, 2, 7, 60)
+    assert options['connect_args'] == {'application_name': 'senera-worker', 'options': '-c statement_timeout=15000'}
+
+
+def test_other_databases_get_a_pool_without_postgresql_settings():
+    options = engine_options('mysql+pymysql://u:p@db/senera')
+    assert options['pool_size'] == 10
+    assert 'connect_args' not in options
@@ -0,0 +1,72 @@
+"""
+needs_rehash compares stored hashes against what the configured method
+actually writes, so a method given without its defaults doesn't rehash every
+password on every login.
+"""
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+import password_hasher
+from db.models import User
+
+
+@pytest.fixture(autouse=True)
+def inline_hashing(monkeypatch):
+    monkeypatch.setenv('PASSWORD_HASH_WORKERS', '0')
+    monkeypatch.setattr(password_hasher, '_method_prefixes', {})
+
+
+@pytest.mark.parametrize('configured,stored', [
+    ('pbkdf2', 'pbkdf2:sha256:600000'),
+    ('pbkdf2:sha256', 'pbkdf2:sha256:600000'),
+    ('pbkdf2:sha256:600000', 'pbkdf2:sha256:600000'),
+    ('scrypt', 'scrypt:32768:8:1'),
+])
+def test_defaults_match(monkeypatch, configured, stored):
+    monkeypatch.setenv('PASSWORD_HASH_METHOD', configured)
+    assert not password_hasher.needs_rehash(generate_password_hash('secret', stored))
+
+
+@pytest.mark.parametrize('configured,stored', [
+    ('pbkdf2', 'pbkdf2:sha256:1000'),
+    ('pbkdf2:sha256:600000', 'pbkdf2:sha512:600000'),
+    ('scrypt', 'pbkdf2:sha256:600000'),
+    ('pbkdf2:sha256:600000', 'scrypt:16384:8:1'),
+])
+def test_other_method_or_cost(monkeypatch, configured, stored):
+    monkeypatch.setenv('PASSWORD_HASH_METHOD', configured)
+    assert password_hasher.needs_rehash(generate_password_hash('secret', stored))
+
+
+def test_prefix_hashed_once_per_method(monkeypatch):
+    calls = []
+    real_run = password_hasher._run
+    monkeypatch.setattr(password_hasher, '_run', lambda func, *args: calls.append(args) or real_run(func, *args))
+    monkeypatch.setenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    pwhash = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+
+    for _ in range(3):
+        assert not password_hasher.needs_rehash(pwhash)
+    assert len(calls) == 1
+
+    monkeypatch.setenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000')
+    assert password_hasher.needs_rehash(pwhash)
+    assert len(calls) == 2
+
+
+def test_login_keeps_current_hash(app, client, user_id, monkeypatch):
+    from db import db
+    user = db.session.get(User, user_id)
+    user.password_hash = generate_password_hash('Passw0rd!x', 'pbkdf2:sha256:600000')
+    db.session.commit()
+    pwhash = user.password_hash
+    monkeypatch.setenv('PASSWORD_HASH_METHOD', 'pbkdf2')
+    rehashed = password_hasher.get_password_hasher_stats()['rehashed']
+
+    response = client.post('/login', json={'email': 'tester@example.com', 'password': 'Passw0rd!x'})
+
+    assert response.status_code == 200
+    assert password_hasher.get_password_hasher_stats()['rehashed'] == rehashed
+    db.session.expire_all()
+    assert db.session.get(User, user_id).password_hash == pwhash
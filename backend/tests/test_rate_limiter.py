@@ -0,0 +1,126 @@
+"""Shared OpenAI budget: priorities, pauses, timeouts and lock contention"""
+
+import time
+import sqlite3
+import threading
+import pytest
+from services import rate_limiter
+from services.rate_limiter import acquire, pause, request_priority, RateLimitTimeout, BACKGROUND, INTERACTIVE
+
+CHAT = {'messages': [{'role': 'user', 'content': 'navy blazer'}], 'max_tokens': 10}
+
+
+@pytest.fixture
+def limiter(tmp_path, monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_DB', str(tmp_path / 'rate_limiter.db'))
+    monkeypatch.setenv('OPENAI_RATE_LIMIT', 'true')
+    # One request every half second once the bucket is empty
+    monkeypatch.setenv('OPENAI_REQUESTS_PER_MINUTE', '120')
+    monkeypatch.setenv('OPENAI_TOKENS_PER_MINUTE', '1000000')
+    monkeypatch.setenv('OPENAI_IMAGES_PER_MINUTE', '1')
+    return tmp_path / 'rate_limiter.db'
+
+
+def drain_requests():
+    for _ in range(120):
+        acquire('openai_chat', CHAT)
+
+
+def acquire_in_thread(priority, finished, endpoint='openai_chat', payload=CHAT):
+    def run():
+        with request_priority(priority):
+            acquire(endpoint, payload)
+        finished.append((priority, time.monotonic()))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_background_waits_behind_interactive(limiter):
+    drain_requests()
+    finished = []
+    background = acquire_in_thread(BACKGROUND, finished)
+    # Queued later, served first
+    time.sleep(0.1)
+    interactive = acquire_in_thread(INTERACTIVE, finished)
+    background.join(5)
+    interactive.join(5)
+    assert [priority for priority, _ in finished] == [INTERACTIVE, BACKGROUND]
+
+
+def test_waiter_only_queues_behind_callers_of_the_same_bucket(limiter):
+    # An image generation waiting for its allowance is ahead of everyone
+    ahead = rate_limiter._enqueue(INTERACTIVE, {'openai_images': (1, 1)})
+    try:
+        started = time.monotonic()
+        acquire('openai_chat', CHAT)
+        assert time.monotonic() - started < 0.5
+    finally:
+        rate_limiter._leave(ahead)
+
+
+def test_pause_holds_every_caller(limiter):
+    pause(0.6)
+    started = time.monotonic()
+    finished = []
+    threads = [acquire_in_thread(INTERACTIVE, finished), acquire_in_thread(BACKGROUND, finished)]
+    for thread in threads:
+        thread.join(5)
+    assert len(finished) == 2
+    assert all(at - started >= 0.5 for _, at in finished)
+
+
+def test_timeout_after_max_wait(limiter, monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_MAX_WAIT_BACKGROUND', '0.3')
+    # An earlier caller holds the front of the image queue
+    ahead = rate_limiter._enqueue(INTERACTIVE, {'openai_images': (1, 1)})
+    try:
+        started = time.monotonic()
+        with request_priority(BACKGROUND), pytest.raises(RateLimitTimeout):
+            acquire('openai_images')
+        # Given up one poll before the limit would be crossed
+        assert 0.25 <= time.monotonic() - started < 2
+    finally:
+        rate_limiter._leave(ahead)
+    # The timed-out caller left the queue
+    assert rate_limiter.get_rate_limiter_stats()['queued'] == {}
+
+
+def test_known_shortfall_beyond_max_wait_fails_at_once(limiter, monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_MAX_WAIT_INTERACTIVE', '0.3')
+    acquire('openai_images')
+    started = time.monotonic()
+    # The next image is a minute away, so there's no point waiting
+    with pytest.raises(RateLimitTimeout):
+        acquire('openai_images')
+    assert time.monotonic() - started < 0.3
+
+
+def test_lock_timeout_is_retried(limiter, monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_BUSY_TIMEOUT_MS', '50')
+    acquire('openai_chat', CHAT)  # creates the store
+    retries = rate_limiter.get_rate_limiter_stats()['lock_retries']
+
+    finished = []
+    holder = sqlite3.connect(str(limiter), isolation_level=None)
+    holder.execute('BEGIN IMMEDIATE')
+    # A fresh thread opens its own connection with the short busy timeout
+    thread = acquire_in_thread(INTERACTIVE, finished)
+    time.sleep(0.5)
+    assert finished == []
+    holder.execute('COMMIT')
+    thread.join(5)
+
+    assert len(finished) == 1
+    assert rate_limiter.get_rate_limiter_stats()['lock_retries'] > retries
+
+
+def test_failed_transaction_rolls_back(limiter):
+    acquire('openai_chat', CHAT)
+    conn = rate_limiter._connection()
+    with pytest.raises(RuntimeError):
+        with rate_limiter._write_transaction(conn):
+            conn.execute("UPDATE buckets SET level = 0")
+            raise RuntimeError
+    assert not conn.in_transaction
+    assert conn.execute("SELECT MIN(level) FROM buckets").fetchone()[0] > 0
@@ -0,0 +1,87 @@
+"""The SQL selection (select_items_for_collage) and the in-memory one
+(rank_wardrobe_items) must pick the same items in the same order"""
+
+import pytest
+from db import db
+from db.models import User, Tag, WardrobeItem
+from benchmarks.fixtures import generate_wardrobe, TARGET_TAGS
+from services.collage_service import select_items_for_collage, load_wardrobe, rank_wardrobe_items
+
+TARGETS = [
+    TARGET_TAGS,
+    # Type categories only: every candidate ties on 10 points
+    {'type_categories': ['top', 'bottom']},
+    # "casual" asked for twice counts twice
+    {'type_categories': ['top', 'footwear'], 'styles': ['casual'], 'occasions': ['casual', 'party']},
+    # A category nobody owns, and an empty one
+    {'type_categories': ['headwear', '', 'bottom'], 'colors': ['red']},
+    {'type_categories': []},
+]
+
+
+def ids(selection):
+    return {category: [item.id for item in items] for category, items in selection.items()}
+
+
+def add_item(user, type_category, tag_names):
+    tags = []
+    for name in tag_names:
+        tag = Tag.query.filter_by(name=name).first() or Tag(name=name, category='style')
+        tags.append(tag)
+    item = WardrobeItem(user_id=user.id, image_url='/uploads/x.jpg', type_category=type_category, tags=tags)
+    db.session.add(item)
+    return item
+
+
+@pytest.fixture
+def wardrobe(app):
+    user = User(display_name='Tester', email='tester@example.com', password_hash='x')
+    other = User(display_name='Other', email='other@example.com', password_hash='x')
+    db.session.add_all([user, other])
+    db.session.flush()
+
+    # Ties on score, items without tags, and more tops than max_per_category
+    add_item(user, 'top', ['casual', 'party'])
+    add_item(user, 'top', [])
+    add_item(user, 'top', ['casual'])
+    add_item(user, 'top', ['party', 'casual'])
+    add_item(user, 'top', [])
+    add_item(user, 'top', ['red'])
+    add_item(user, 'top', ['casual'])
+    add_item(user, 'bottom', [])
+    add_item(user, 'bottom', ['red', 'party'])
+    add_item(user, 'footwear', ['navy'])
+    # Someone else's wardrobe is never selected
+    add_item(other, 'top', ['casual', 'party', 'red'])
+    db.session.commit()
+    return user.id
+
+
+@pytest.mark.parametrize('target_tags', TARGETS)
+def test_handmade_wardrobe_selections_match(wardrobe, target_tags):
+    sql = select_items_for_collage(target_tags, wardrobe)
+    in_memory = rank_wardrobe_items(load_wardrobe(wardrobe), target_tags)
+    assert ids(sql) == ids(in_memory)
+    assert list(sql) == list(in_memory)
+
+
+def test_ties_keep_insertion_order(wardrobe):
+    selection = ids(select_items_for_collage({'type_categories': ['top']}, wardrobe))
+    tops = [item.id for item in WardrobeItem.query.filter_by(user_id=wardrobe, type_category='top').order_by(WardrobeItem.id)]
+    assert selection == {'top': tops[:5]}
+
+
+def test_untagged_items_rank_last(wardrobe):
+    selection = select_items_for_collage({'type_categories': ['top'], 'styles': ['casual']}, wardrobe)
+    scores = [len({tag.name for tag in item.tags} & {'casual'}) for item in selection['top']]
+    assert scores == sorted(scores, reverse=True)
+    assert scores[:4] == [1, 1, 1, 1]
+
+
+@pytest.mark.parametrize('target_tags', TARGETS)
+@pytest.mark.parametrize('max_per_category', [1, 5, 20])
+def test_generated_wardrobe_selections_match(app, target_tags, max_per_category):
+    generate_wardrobe(1, 300, ['/uploads/x.jpg'], seed=7)
+    sql = select_items_for_collage(target_tags, 1, max_per_category)
+    in_memory = rank_wardrobe_items(load_wardrobe(1), target_tags, max_per_category)
+    assert ids(sql) == ids(in_memory)
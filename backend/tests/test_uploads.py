@@ -0,0 +1,107 @@
+"""
+Upload caps: oversized bodies, decompression bombs and non-images are answered
+with a JSON error before background removal, tagging or anything is written
+to uploads/.
+"""
+
+import io
+import struct
+import zlib
+import pytest
+from PIL import Image
+
+import routes.routes
+
+
+def png_header(width, height):
+    """A valid PNG of a few dozen bytes that declares width x height pixels"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', zlib.compress(b'')) + chunk(b'IEND', b'')
+
+
+@pytest.fixture(autouse=True)
+def no_processing(monkeypatch):
+    """Fail the test if a rejected upload reaches background removal or tagging"""
+    def unexpected(*args, **kwargs):
+        raise AssertionError('a rejected upload was processed')
+
+    monkeypatch.setattr(routes.routes, 'remove_background', unexpected)
+    monkeypatch.setattr(routes.routes, 'tag_image_file', unexpected)
+
+
+def upload(client, data, filename='item.png'):
+    return client.post('/upload-clothing', data={'image': (io.BytesIO(data), filename)},
+                       content_type='multipart/form-data')
+
+
+def assert_nothing_written(tmp_path):
+    assert list((tmp_path / 'uploads').iterdir()) == []
+
+
+def test_body_over_max_content_length(app, client, user_id, tmp_path):
+    app.config['MAX_CONTENT_LENGTH'] = 64 * 1024
+    response = upload(client, b'\0' * (128 * 1024))
+
+    assert response.status_code == 413
+    assert response.is_json
+    assert 'requests up to 0.0625 MB' in response.get_json()['error']
+    assert_nothing_written(tmp_path)
+
+
+@pytest.mark.parametrize('width,height', [
+    (100_000, 100_000),  # Past Pillow's own bomb limit: refused by Image.open
+    (8_000, 8_000),      # Within Pillow's limit, over UPLOAD_MAX_PIXELS
+    (4_000, 4_000),      # Within UPLOAD_MAX_PIXELS, but a PNG can't be decoded below full size
+])
+def test_decompression_bomb(client, user_id, tmp_path, width, height):
+    data = png_header(width, height)
+    assert len(data) < 100
+
+    response = upload(client, data)
+
+    assert response.status_code == 413
+    assert response.is_json
+    assert 'megapixels are accepted' in response.get_json()['error']
+    assert_nothing_written(tmp_path)
+
+
+def test_bomb_limit_from_env(client, user_id, tmp_path, monkeypatch):
+    monkeypatch.setenv('UPLOAD_MAX_PIXELS', '10000')
+    image = io.BytesIO()
+    Image.new('RGB', (200, 200), 'red').save(image, 'PNG')
+
+    response = upload(client, image.getvalue())
+
+    assert response.status_code == 413
+    assert response.get_json()['error'] == 'The image is 200x200 pixels; images up to 0.01 megapixels are accepted'
+    assert_nothing_written(tmp_path)
+
+
+def test_not_an_image(client, user_id, tmp_path):
+    response = upload(client, b'%PDF-1.4\n' + b'x' * 1000, filename='item.pdf')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'The file is not a supported image'}
+    assert_nothing_written(tmp_path)
+
+
+@pytest.mark.parametrize('keep', [300, -200])  # Cut inside the header, cut inside the image data
+def test_truncated_image(client, user_id, tmp_path, keep):
+    image = io.BytesIO()
+    Image.effect_noise((200, 200), 64).convert('RGB').save(image, 'JPEG')
+
+    response = upload(client, image.getvalue()[:keep])
+
+    assert response.status_code == 400
+    assert 'truncated or corrupt' in response.get_json()['error']
+    assert_nothing_written(tmp_path)
+
+
+def test_requires_login(client, tmp_path):
+    response = upload(client, png_header(10, 10))
+
+    assert response.status_code == 401
+    assert_nothing_written(tmp_path)